@@ -0,0 +1,245 @@
+import argparse
+import csv
+import datetime as dt
+import os
+import random
+import re
+import sys
+
+# *****************************************************************************
+# Fixture pages for the offline benchmarks, stored under benchmarks/fixtures.
+# build() writes pages with the same markup the scrapers read (calendar month,
+# tournament pages, eighthman result lists, Wayback WC7/WC8 score pages and a
+# usq_cup12.xlsx-style workbook), filled deterministically with real team names.
+# record() replaces any of them with the live page when the network is available.
+# *****************************************************************************
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+_TEAMS_FILE = os.path.join(_ROOT, 'conformer', 'teams.csv')
+_SEED = 12
+_CALENDAR_COLORS = ['#0054A6', '#D1C221', '#BA3434', '#1B996A', '#CB7005']
+# Fixture file -> page it stands in for
+SOURCES = {
+    'calendar_month.html': 'https://www.usquidditch.org/events/calendar/201710',
+    'tournament_small.html': 'https://www.usquidditch.org/events/view/small-fixture',
+    'tournament_medium.html': 'https://www.usquidditch.org/events/view/medium-fixture',
+    'tournament_large.html': 'https://www.usquidditch.org/events/view/large-fixture',
+    'eighthman_fall.html': 'http://www.eighthman.com/results/2012-2013-season/chronological-list-of-all-games-2012-2013-season/chronological-list-of-all-games-fall-2012/',
+    'eighthman_spring.html': 'http://www.eighthman.com/results/2012-2013-season/chronological-list-of-all-games-2012-2013-season/chronological-list-of-all-games-spring-2013/',
+    'eighthman_wc6.html': 'http://www.eighthman.com/results/world-cup/world-cup-vi-d1-pool-play/',
+    'wc7_scores.html': 'https://web.archive.org/web/20150206234411/http://iqaworldcup.com/scores',
+    'wc8_scores.html': 'https://web.archive.org/web/20170703075617/http://usqworldcup.com/scores/',
+}
+USQ12_FILE = 'usq_cup12.xlsx'
+
+
+def fixture_path(name):
+    return os.path.join(_FIXTURES, name)
+
+
+def team_names():
+    with open(_TEAMS_FILE, encoding='iso-8859-1') as fp:
+        return [row[1] for row in list(csv.reader(fp))[1:]]
+
+
+def _catch(rng):
+    return rng.choice(['*', '*', '^', '!', ''])
+
+
+def calendar_month(rng, events=40):
+    boxes = ''.join('<div class="event" href="/events/view/event-{0}"><div class="calendar_box" '
+                    'style="background-color:{1}"></div><div class="event_title">Event {0}</div></div>'
+                    .format(i, rng.choice(_CALENDAR_COLORS)) for i in range(events))
+    return ('<html><head><title>Calendar | US Quidditch</title></head><body><div id="calendar">{}</div>'
+            '</body></html>'.format(boxes))
+
+
+def tournament_page(rng, names, teams, games, players=21):
+    entrants = rng.sample(names, teams)
+    rosters = ''.join(
+        '<div class="team"><h3><a href="/teams/{0}" target="_BLANK">{1}</a></h3><table class="roster"><thead><tr>'
+        '<th>Name</th><th>Position</th></tr></thead><tbody>{2}<tr><td colspan="2">Total: {3}</td></tr></tbody>'
+        '</table></div>'.format(i, name, ''.join('<tr><td>Player {} {}</td><td>{}</td></tr>'.format(
+            i, j, 'Coach' if j == 0 else rng.choice(['Chaser', 'Keeper', 'Beater', 'Seeker'])) for j in range(players)),
+            players) for i, name in enumerate(entrants))
+    rows = []
+    for i in range(games):
+        t1, t2 = rng.sample(entrants, 2)
+        s1, s2 = rng.randrange(0, 250, 10), rng.randrange(0, 250, 10)
+        overtime = rng.choice(['', '', '', '\xa0(OT)', '\xa0(2OT)', '\xa0(SD)'])
+        score = '{}{}\xa0-\xa0{}{}'.format(s1, _catch(rng), s2, _catch(rng))
+        if i % 50 == 7:
+            score, t2 = 'Forfeit', ''
+        rows.append('<tr><td>10/{:02d}/2016</td><td>{}</td><td>{}</td><td>{}</td><td>0:{:02d}:{:02d}{}</td></tr>'
+                    .format(1 + i % 28, t1, score, t2, rng.randrange(10, 60), rng.randrange(60), overtime))
+    nav = ''.join('<a href="/nav/{0}">Link {0}</a>'.format(i) for i in range(60))
+    return ('<html><head><title>Fixture Classic | US Quidditch</title><script>var x = "<table>";</script></head>'
+            '<body><nav>{}</nav><div id="main">{}<table class="results"><thead><tr><th>Date</th><th>Team 1</th>'
+            '<th>Score</th><th>Team 2</th><th>Game Time</th></tr></thead><tbody>{}</tbody></table></div></body>'
+            '</html>'.format(nav, rosters, ''.join(rows)))
+
+
+def _eighthman_line(rng, names, timed=False):
+    t1, t2 = rng.sample(names, 2)
+    line = '{}{} {}{} – {} {}{}'.format('({}) '.format(rng.randrange(1, 60)) if rng.random() < 0.3 else '',
+                                        t1, rng.randrange(30, 250, 10), _catch(rng), t2, rng.randrange(0, 200, 10),
+                                        _catch(rng))
+    return line + (' ({}:{:02d})'.format(rng.randrange(10, 40), rng.randrange(60)) if timed else '')
+
+
+def eighthman_season(rng, names, days, games):
+    start = dt.date(2012, 9, 1)
+    paragraphs = []
+    for d in range(days):
+        date = start + dt.timedelta(days=7 * d)
+        lines = [_eighthman_line(rng, names) for _ in range(games)]
+        paragraphs.append('<p><strong>{}/{}/{}</strong><br/>{}</p>'.format(
+            date.month, date.day, date.year % 100, '<br/>'.join(lines)))
+        if d % 5 == 0:
+            paragraphs.append('<p><em>Results reported by tournament directors.</em></p>')
+    return ('<html><head><title>Chronological List | The Eighth Man</title></head><body><div id="content-area">'
+            '{}</div></body></html>'.format(''.join(paragraphs)))
+
+
+def eighthman_wc6(rng, names, pools, games):
+    paragraphs = []
+    for p in range(pools):
+        lines = [_eighthman_line(rng, names, timed=rng.random() < 0.8) for _ in range(games)]
+        paragraphs.append('<p>Pool {}<br/>{}</p>'.format(p + 1, '<br/>'.join(lines)))
+    lines = [_eighthman_line(rng, names, timed=True) for _ in range(games)]
+    paragraphs.append('<p>Play Ins<br/>{}</p>'.format('<br/>'.join(lines)))
+    return '<html><head><title>World Cup VI | The Eighth Man</title></head><body>{}</body></html>'.format(
+        ''.join(paragraphs))
+
+
+def wc8_scores(rng, names, games):
+    rows = []
+    for i in range(games):
+        t1, t2 = rng.sample(names, 2)
+        minutes = rng.randrange(10, 40)
+        rows.append('<tr><td>{}:{:02d} {}</td><td>{}</td><td>{}{}</td><td>{}</td><td>{}</td><td>{}</td>'
+                    '<td>{}:{:02d}</td><td>Pitch {}</td></tr>'.format(
+                        rng.randrange(1, 13), rng.choice([0, 15, 30, 45]), rng.choice(['AM', 'PM']), t1,
+                        rng.randrange(30, 250, 10), _catch(rng), rng.randrange(0, 200, 10), t2,
+                        rng.choice(['Reg', 'Reg', 'Reg', 'OT', '2OT', 'SD']), minutes, rng.randrange(60),
+                        rng.randrange(1, 10)))
+    return ('<html><head><title>Scores | USQ World Cup</title></head><body><table class="igsv-table"><tr>'
+            '<th>Time</th><th>Team 1</th><th>Score</th><th>Score</th><th>Team 2</th><th>Period</th>'
+            '<th>Game Time</th><th>Pitch</th></tr>{}</table></body></html>'.format(''.join(rows)))
+
+
+def wc7_scores(rng, names, games):
+    boxes = []
+    for i in range(games):
+        t1, t2 = rng.sample(names, 2)
+        # Every WC7 result records a snitch catch
+        c1 = rng.choice(['*', '^', '!'])
+        first = rng.random() < 0.5
+        side = '<div class="scorebox-body"><table><tr><td>{}</td><td>{}</td><td>{}{}</td></tr></table></div>'
+        boxes.append('<div class="scorebox">{}{}<span style="margin-right:10px;float:right;">{}</span></div>'.format(
+            side.format(1, t1, rng.randrange(30, 250, 10), c1 if first else ''),
+            side.format(2, t2, rng.randrange(0, 200, 10), '' if first else c1),
+            rng.choice(['Final', 'Final', 'Final (OT)'])))
+    return '<html><head><title>Scores | IQA World Cup</title></head><body>{}</body></html>'.format(''.join(boxes))
+
+
+def _abbreviation(i):
+    return ''.join(chr(ord('A') + (i // 26 ** k) % 26) for k in range(4))
+
+
+def usq_cup12_workbook(rng, names, path, teams_per_group=10, games_per_group=25):
+    import openpyxl
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    entrants = iter(rng.sample(names, 8 * teams_per_group + 32 + 16))
+    abbreviations = {}
+    for group in ('Flight', 'Pool'):
+        for letter in ('A', 'B', 'C', 'D'):
+            group_teams = [next(entrants) for _ in range(teams_per_group)]
+            rankings = wb.create_sheet('{} {} Rankings'.format(group, letter))
+            rankings.append(['Team', 'Abbreviation', 'Wins', 'Losses'])
+            for name in group_teams:
+                abbreviations[name] = _abbreviation(len(abbreviations))
+                rankings.append([name, abbreviations[name], 0, 0])
+            rankings.append(['BYE', 'BYE', 0, 0])
+            matches = wb.create_sheet('{} {} Matches'.format(group, letter))
+            matches.append(['Day', 'Time', 'Team 1', 'Score 1', 'Score 2', 'Team 2', 'Period',
+                            'Catch', 'OT Catch', '2OT Catch', 'Notes'])
+            for g in range(games_per_group):
+                t1, t2 = rng.sample(group_teams, 2)
+                a1, a2 = abbreviations[t1], abbreviations[t2]
+                if g == games_per_group - 1:
+                    a2 = 'BYE'
+                period = rng.choice(['Reg', 'Reg', 'Reg', 'OT', '2OT'])
+                matches.append([43568, rng.choice([0.375, 0.4375, 0.5, 0.5625, 0.625]), a1,
+                                rng.randrange(30, 250, 10), rng.randrange(0, 200, 10), a2, period,
+                                rng.choice([a1, a2]), rng.choice([a1, a2]) if period != 'Reg' else '',
+                                rng.choice([a1, a2]) if period == '2OT' else '', ''])
+
+    def bracket(sheet, columns, games):
+        for col, count in enumerate(games):
+            row = 1
+            for _ in range(count):
+                t1, t2 = rng.sample(list(abbreviations.values()), 2)
+                for value in ('{} {}{}'.format(t1, rng.randrange(30, 250, 10), _catch(rng)),
+                              'P{} {}:{:02d} PM'.format(rng.randrange(1, 9), rng.randrange(1, 10), rng.choice([0, 30])),
+                              '{} {}'.format(t2, rng.randrange(0, 200, 10))):
+                    sheet.cell(row=row, column=columns[col] + 1, value=value)
+                    row += 1
+                row += 1
+
+    # Two-sided collegiate bracket, worked from the outer columns in; one-sided community bracket
+    bracket(wb.create_sheet('Sun Collegiate Bracket - Full'), [0, 9, 1, 8, 2, 7, 3, 6, 4, 5],
+            [8, 8, 4, 4, 2, 2, 1, 1, 1, 1])
+    bracket(wb.create_sheet('Sun Community Bracket - Full'), [0, 1, 2, 3, 4], [8, 4, 2, 1, 1])
+    wb.save(path)
+
+
+def build():
+    rng = random.Random(_SEED)
+    names = team_names()
+    plain = [name for name in names if not re.search(r'\d', name)]
+    pages = {
+        'calendar_month.html': calendar_month(rng),
+        'tournament_small.html': tournament_page(rng, names, 8, 20),
+        'tournament_medium.html': tournament_page(rng, names, 24, 120),
+        'tournament_large.html': tournament_page(rng, names, 64, 400),
+        'eighthman_fall.html': eighthman_season(rng, plain, 14, 30),
+        'eighthman_spring.html': eighthman_season(rng, plain, 10, 30),
+        'eighthman_wc6.html': eighthman_wc6(rng, plain, 10, 20),
+        'wc7_scores.html': wc7_scores(rng, names, 220),
+        'wc8_scores.html': wc8_scores(rng, names, 300),
+    }
+    os.makedirs(_FIXTURES, exist_ok=True)
+    for name, html in pages.items():
+        with open(fixture_path(name), 'w', encoding='utf-8') as fp:
+            fp.write(html)
+    usq_cup12_workbook(rng, names, fixture_path(USQ12_FILE))
+
+
+def record(names=None):
+    # Overwrites fixtures with the live pages (the calendar month has to be rendered by Chromium)
+    import requests
+    if _ROOT not in sys.path:
+        sys.path.insert(0, _ROOT)
+    import usq_site_scraper.scraper as scraper
+    for name in names if names else SOURCES:
+        url = SOURCES[name]
+        if name == 'calendar_month.html':
+            html = scraper.asyncio.get_event_loop().run_until_complete(scraper.fetch_data(url))
+        else:
+            html = requests.get(url).text
+        with open(fixture_path(name), 'w', encoding='utf-8') as fp:
+            fp.write(html)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--record', nargs='*', metavar='FIXTURE',
+                        help='replace fixtures with the live pages (all of them when none are named)')
+    args = parser.parse_args()
+    if args.record is not None:
+        record(args.record)
+    else:
+        build()
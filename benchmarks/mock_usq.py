@@ -0,0 +1,191 @@
+import argparse
+import datetime as dt
+import email.utils
+import functools
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# *****************************************************************************
+# Local stand-in for usquidditch.org, for end-to-end and load runs of the scraper.
+# ----------------- /events/calendar/<YYYYMM>  calendar month; the div.event entries
+#                                             (with calendar_box colors) are added by
+#                                             script after load, like the real site
+# ----------------- /events/view/<id>-<slug>   tournament page with rosters and scores
+# Tournaments are spread evenly over the months and generated deterministically
+# from the seed. Latency, jitter and an error rate can be set for every response,
+# and tournament pages answer conditional requests with 304.
+# Run from the repository root, then point the scraper at it:
+#     python -m benchmarks.mock_usq --months 24 --tournaments 10000 --port 8765
+#     python -m usq_site_scraper.scraper --base-url http://127.0.0.1:8765
+# *****************************************************************************
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+import benchmarks.fixtures as fx
+
+_CALENDAR_PATH = re.compile(r'^/events/calendar/(\d{6})/?$')
+_TOURNAMENT_PATH = re.compile(r'^/events/view/(\d+)-[\w-]+/?$')
+_OFFICIAL = '#0054A6'
+# Colors of events that are not official tournaments
+_OTHER_COLORS = ['#D1C221', '#BA3434', '#1B996A', '#CB7005']
+_LAST_MODIFIED = email.utils.formatdate(dt.datetime(2019, 1, 1).timestamp(), usegmt=True)
+_PAGE_CACHE = 4096
+
+
+def _month_slugs(start, months):
+    year, month = int(start[:4]), int(start[4:])
+    slugs = []
+    for _ in range(months):
+        slugs.append('{}{:02d}'.format(year, month))
+        month, year = (1, year + 1) if month == 12 else (month + 1, year)
+    return slugs
+
+
+class MockSite:
+    def __init__(self, start='201709', months=12, tournaments=200, teams=16, games=40, players=21,
+                 official=0.9, render_delay=0.05, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503,
+                 seed=fx._SEED):
+        self.slugs = _month_slugs(start, months)
+        self.tournaments = tournaments
+        self.teams = teams
+        self.games = games
+        self.players = players
+        self.official = official
+        self.render_delay = render_delay
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.seed = seed
+        self.names = fx.team_names()
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.tournament = functools.lru_cache(maxsize=_PAGE_CACHE)(self._tournament)
+
+    def month_events(self, slug):
+        # [(tournament id, color)] of one month
+        if slug not in self.slugs:
+            return []
+        i = self.slugs.index(slug)
+        per_month = -(-self.tournaments // len(self.slugs))
+        rng = random.Random('{}:{}'.format(self.seed, slug))
+        return [(t, _OFFICIAL if rng.random() < self.official else rng.choice(_OTHER_COLORS))
+                for t in range(i * per_month, min((i + 1) * per_month, self.tournaments))]
+
+    def calendar(self, slug):
+        events = [{'href': '/events/view/{}-tournament-{}'.format(t, t), 'color': color,
+                   'name': 'Tournament {}'.format(t)} for t, color in self.month_events(slug)]
+        if not events:
+            body = '<div id="calendar"><p>No events in selected timeframe</p></div>'
+        else:
+            body = ('<div id="calendar"></div><script>var events = {};window.addEventListener("load", function () {{'
+                    'setTimeout(function () {{var calendar = document.getElementById("calendar");'
+                    'events.forEach(function (e) {{var div = document.createElement("div");div.className = "event";'
+                    'div.setAttribute("href", e.href);div.innerHTML = \'<div class="calendar_box" '
+                    'style="background-color:\' + e.color + \'"></div><div class="event_title">\' + e.name + '
+                    '\'</div>\';calendar.appendChild(div);}});}}, {});}});</script>'
+                    .format(json.dumps(events), int(self.render_delay * 1000)))
+        return '<html><head><title>Calendar | US Quidditch</title></head><body>{}</body></html>'.format(body)
+
+    def _tournament(self, t):
+        if not 0 <= t < self.tournaments:
+            return None
+        html = fx.tournament_page(random.Random('{}:{}'.format(self.seed, t)), self.names, self.teams, self.games,
+                                  self.players)
+        return html.replace('Fixture Classic', 'Tournament {}'.format(t))
+
+    def respond(self, path):
+        # (status, body) for a path, before latency and injected errors
+        match = _CALENDAR_PATH.match(path)
+        if match:
+            return 200, self.calendar(match.group(1))
+        match = _TOURNAMENT_PATH.match(path)
+        page = self.tournament(int(match.group(1))) if match else None
+        return (200, page) if page else (404, '<html><body>Not found</body></html>')
+
+    def handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                failed = random.random() < site.error_rate
+                with site._lock:
+                    site.requests += 1
+                    site.errors += failed
+                delay = site.latency + (random.uniform(-site.jitter, site.jitter) if site.jitter else 0)
+                if delay > 0:
+                    time.sleep(delay)
+                status, body = (site.error_status, 'Injected error') if failed else site.respond(self.path)
+                data = body.encode('utf-8')
+                etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+                if status == 200 and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                if status == 200:
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', _LAST_MODIFIED)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def serve(site, host='127.0.0.1', port=0):
+    # Starts the server on a background thread; returns it (server_address has the bound port)
+    server = ThreadingHTTPServer((host, port), site.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--start', default='201709', help='first calendar month, YYYYMM')
+    parser.add_argument('--months', type=int, default=12)
+    parser.add_argument('--tournaments', type=int, default=200, help='spread evenly over the months')
+    parser.add_argument('--teams', type=int, default=16, help='teams (rosters) per tournament')
+    parser.add_argument('--games', type=int, default=40, help='score rows per tournament')
+    parser.add_argument('--players', type=int, default=21, help='roster size')
+    parser.add_argument('--official', type=float, default=0.9, help='share of events colored official')
+    parser.add_argument('--render-delay', type=float, default=0.05, help='seconds before calendar events appear')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='latency varies by up to this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of responses replaced by an error')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--seed', type=int, default=fx._SEED)
+    args = parser.parse_args()
+    site = MockSite(args.start, args.months, args.tournaments, args.teams, args.games, args.players, args.official,
+                    args.render_delay, args.latency, args.jitter, args.error_rate, args.error_status, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), site.handler())
+    server.daemon_threads = True
+    print('Serving {} tournaments over {}..{} at http://{}:{}'.format(
+        args.tournaments, site.slugs[0], site.slugs[-1], *server.server_address), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('{} requests, {} injected errors'.format(site.requests, site.errors))
@@ -0,0 +1,205 @@
+import argparse
+import datetime as dt
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+# *****************************************************************************
+# Offline benchmarks over the fixtures in benchmarks/fixtures.
+# Run from the repository root:   python -m benchmarks.run
+# ----------------- --update      store the timings as the new baseline
+# ----------------- --tolerance   allowed slowdown against the baseline (0.5 = 50%)
+# Every page is served from a throwaway offline response cache, so nothing touches
+# the network, and the conformer works on copies of the mapping files. The run
+# exits with status 1 when a case is slower than its baseline allows.
+# startup[...] cases time a fresh interpreter importing an entry point from a
+# directory without the mapping files.
+# *****************************************************************************
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+import benchmarks.fixtures as fx
+
+_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+_REPEAT = 5
+_TOLERANCE = 0.5
+# Differences below this many seconds are timer noise, whatever the ratio
+_NOISE_FLOOR = 0.002
+_ROW_SIZES = [120, 400, 1000, 10000, 100000]
+_MONTH_SIZES = [1, 6, 24]
+_CONFORM_SIZES = [1000, 10000, 100000]
+_FUZZY_SIZES = [10, 100]
+_DEDUP_SIZES = [1000, 10000]
+_STARTUP_MODULES = ['usq_site_scraper.scraper', 'historical_scrapers.nationals', 'conformer.conform']
+
+
+def _read(name):
+    with open(fx.fixture_path(name), encoding='utf-8') as fp:
+        return fp.read()
+
+
+def _setup(workdir):
+    # Offline cache holding every fixture page under its real url, copies of the mapping files
+    for name in ('raw_conf.csv', 'teams.csv'):
+        shutil.copy(os.path.join(_ROOT, 'conformer', name), workdir)
+    os.chdir(workdir)
+    import fetching.cache as fc
+    cache = fc.configure(os.path.join(workdir, 'cache'), offline=True)
+    for name, url in fx.SOURCES.items():
+        cache.put(url, _read(name).encode('utf-8'))
+
+
+def _startup(module, cwd):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [_ROOT, os.environ.get('PYTHONPATH')])))
+    subprocess.run([sys.executable, '-c', 'import ' + module], cwd=cwd, env=env, check=True)
+
+
+def _cases():
+    # [(name, callable)]; the callables are timed as they are
+    import usq_site_scraper.scraper as scraper
+    import usq_site_scraper.batch_parse as bp
+    import usq_site_scraper.dedup as dedup
+    import usq_site_scraper.records as rc
+    import conformer.conform as cf
+    import historical_scrapers.nationals as nationals
+    import historical_scrapers.eighthman_rs as eighthman
+
+    cases = []
+    empty = os.path.join(os.getcwd(), 'startup')
+    os.makedirs(empty, exist_ok=True)
+    for module in _STARTUP_MODULES:
+        cases.append(('startup[{}]'.format(module), lambda module=module: _startup(module, empty)))
+    month = _read('calendar_month.html')
+    for n in _MONTH_SIZES:
+        cases.append(('parse_event_list[months={}]'.format(n), lambda n=n: [scraper.parse_event_list(month)
+                                                                           for _ in range(n)]))
+    for size in ('small', 'medium', 'large'):
+        name = 'tournament_{}.html'.format(size)
+        url = fx.SOURCES[name]
+        html = _read(name)
+        cases.append(('parse_tournament[{}]'.format(size), lambda url=url, html=html: scraper.parse_tournament(
+            url, html=html)))
+        cases.append(('parse_tournament_soup[{}]'.format(size), lambda url=url, html=html: scraper.parse_tournament(
+            url, html=html, fast=False)))
+        cases.append(('parse_tournament_cached[{}]'.format(size), lambda url=url: scraper.parse_tournament(url)))
+
+    rows = scraper._score_cells(scraper.lxml_html.fromstring(_read('tournament_large.html')))
+    for n in _ROW_SIZES:
+        batch = (rows * (n // len(rows) + 1))[:n]
+        cases.append(('process_result[rows={}]'.format(n), lambda batch=batch: [scraper.process_result(row)
+                                                                               for row in batch]))
+        cases.append(('batch_parse[rows={}]'.format(n), lambda batch=batch: bp.parse_results(batch, 'Fixture')))
+
+    cases.append(('eighthman_season[pages=1]', lambda: list(eighthman.iter_results(
+        eighthman.T8M_FALL_URL, 'Unknown', eighthman._WC6_SEASON_START, True, prompt=False))))
+    cases.append(('eighthman_all[pages=3]', lambda: eighthman.parse_all()))
+    cases.append(('get_wc7', lambda: nationals.get_wc7(nationals._WC7_URL)))
+    cases.append(('get_wc8', lambda: nationals.get_wc8(nationals._WC8_URL)))
+    workbook = fx.fixture_path(fx.USQ12_FILE)
+    cases.append(('usq_cup12_scraper', lambda: nationals.usq_cup12_scraper(workbook)))
+    # The WC8 games repeated a week apart, once as records and once as a batch dated a day later
+    wc8 = list(nationals.get_wc8(nationals._WC8_URL))
+    for n in _DEDUP_SIZES:
+        games = [rc.GameRecord(*game[:1], game.date + dt.timedelta(weeks=i // len(wc8)), *game[2:])
+                 for i, game in enumerate((wc8 * (n // len(wc8) + 1))[:n])]
+        later = rc.GameBatch(rc.GameRecord(*game[:1], game.date + dt.timedelta(days=1), *game[2:]) for game in games)
+        cases.append(('dedup[games={}]'.format(n), lambda games=games, later=later: dedup.merge_sources(
+            {'site': games, 'wc8': later}).to_batch()))
+
+    conformer = cf.Conformer()
+    known = list(conformer.conformer_dict) + [name.lower() for name in conformer.team_dict.values()]
+    for n in _CONFORM_SIZES:
+        names = (known * (n // len(known) + 1))[:n]
+
+        def conform(names=names):
+            conformer._changed()
+            return [conformer.conform(name) for name in names]
+        cases.append(('conform[names={}]'.format(n), conform))
+    for n in _FUZZY_SIZES:
+        unknown = ['{} QUIDDITCH CLUB {}'.format(name, i) for i, name in enumerate((known * n)[:n])]
+        cases.append(('conform_fuzzy[names={}]'.format(n), lambda unknown=unknown: [
+            conformer.candidates(name) for name in unknown]))
+    return cases
+
+
+def _time(fn, repeat):
+    fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {'min': min(timings), 'median': statistics.median(timings), 'repeat': repeat}
+
+
+def run(repeat=_REPEAT, only=None):
+    # {case: timings or {'error': ...}}
+    results = {}
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='qscore_bench_')
+    try:
+        # The parsers' own warnings (e.g. bs4 guessing a parser) would drown out the timings
+        warnings.simplefilter('ignore')
+        _setup(workdir)
+        for name, fn in _cases():
+            if only and not any(part in name for part in only):
+                continue
+            try:
+                results[name] = _time(fn, repeat)
+            except Exception as e:
+                results[name] = {'error': '{}: {}'.format(type(e).__name__, e)}
+            print('{:<45} {}'.format(name, '{:.4f}s'.format(results[name]['min']) if 'min' in results[name]
+                                     else results[name]['error']), flush=True)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance=_TOLERANCE):
+    # [(case, baseline seconds, current seconds)] for every case slower than allowed
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before or 'min' not in before or 'min' not in current:
+            continue
+        if current['min'] > before['min'] * (1 + tolerance) and current['min'] - before['min'] > _NOISE_FLOOR:
+            regressions.append((name, before['min'], current['min']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--baseline', default=_BASELINE_FILE)
+    parser.add_argument('--update', action='store_true', help='write these timings as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=_TOLERANCE)
+    parser.add_argument('--repeat', type=int, default=_REPEAT)
+    parser.add_argument('--output', help='also write the timings to this file')
+    parser.add_argument('cases', nargs='*', help='only run cases whose name contains one of these')
+    args = parser.parse_args()
+    results = run(args.repeat, args.cases)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    if args.update:
+        baseline = {}
+        if args.cases and os.path.exists(args.baseline):
+            with open(args.baseline) as fp:
+                baseline = json.load(fp)
+        baseline.update({name: val for name, val in results.items() if 'min' in val})
+        with open(args.baseline, 'w') as fp:
+            json.dump(baseline, fp, indent=2, sort_keys=True)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        for name, before, after in regressions:
+            print('REGRESSION: {} {:.4f}s -> {:.4f}s ({:+.0%})'.format(name, before, after, after / before - 1))
+        sys.exit(1 if regressions else 0)
@@ -1,5 +1,17 @@
-import pandas as pd
-import numpy as np
+import csv
+import datetime as dt
+import os
+import sys
+import contextlib
+from functools import lru_cache
+from .fuzzy import NGramIndex
+from .store import ConformerStore
+
+_PURIFY_CACHE = 65536
+_CONFORM_CACHE = 65536
+_FUZZY_THRESHOLD = 0.85
+_REVIEW_FILE = 'review_queue.csv'
+_REVIEW_COLUMNS = ['Time', 'Raw', 'Status', 'Conformed', 'Score', 'Candidates']
 
 
 def can_encode(string):
@@ -14,66 +26,197 @@ def can_encode(string):
 def force_encodable(string):
     if can_encode(string):
         return string
-    for c in string:
-        if not can_encode(c):
-            string = string.replace(c,'@')
-    return string
+    # A single character encodes to both utf-8 and iso-8859-1 exactly when it is below 256
+    return ''.join(c if ord(c) < 256 else '@' for c in string)
+
+
+@lru_cache(maxsize=_PURIFY_CACHE)
+def _purify(string):
+    return force_encodable(string.replace('\xa0', '').replace("'", "").replace('"', '').replace(',', '').upper().strip())
 
 
 def purify(string):
     if type(string) == str:
-        return force_encodable(string.replace('\xa0', '').replace("'", "").replace('"', '').replace(',', '').upper().strip())
+        return _purify(string)
     else:
         return None
 
 
 class Conformer:
-    def __init__(self, conformers='raw_conf.csv', teams='teams.csv'):
+    # review_file: when set, unknown names are never prompted for. Fuzzy matches at or
+    # above threshold are accepted (and recorded as 'accepted'), everything else is
+    # queued there as 'pending' with its ranked candidates and conforms to None.
+    # store: a ConformerStore (or the path of one) to read and write mappings through
+    # instead of appending to the CSVs; it is seeded from them on first use.
+    def __init__(self, conformers='raw_conf.csv', teams='teams.csv', review_file=None, threshold=_FUZZY_THRESHOLD,
+                 store=None):
         self.conformer_file = conformers
         self.team_file = teams
-        self.conformer_dict = pd.read_csv(conformers, encoding = 'iso-8859-1', index_col = 0).to_dict()['Conformed']
-        self.team_dict = pd.read_csv(teams, encoding='iso-8859-1', index_col=0).to_dict()['Name']
+        self.review_file = review_file
+        self.threshold = threshold
+        self._fuzzy_index = None
+        self._queued = set()
+        self.store = ConformerStore(store, conformers, teams) if isinstance(store, str) else store
+        if self.store is not None:
+            self.conformer_dict, self.team_dict = self.store.load()
+        else:
+            import pandas as pd
+            self.conformer_dict = pd.read_csv(conformers, encoding = 'iso-8859-1', index_col = 0).to_dict()['Conformed']
+            self.team_dict = pd.read_csv(teams, encoding='iso-8859-1', index_col=0).to_dict()['Name']
         self.source = {k: self.team_dict[v] for k, v in self.conformer_dict.items()}
         for v in set(self.source.values()):
             self.source[purify(v)] = v
+        # Reverse name -> id index (first id wins, like the old linear scan) and next free id
+        self.name_index = {}
+        for k, v in self.team_dict.items():
+            self.name_index.setdefault(v, k)
+        self.next_id = max([int(i) for i in self.team_dict.keys()], default=-1) + 1
+        self._lookup = lru_cache(maxsize=_CONFORM_CACHE)(self._lookup_raw)
+
+    def _lookup_raw(self, n):
+        pure = purify(n)
+        return self.source.get(pure) if pure else None
+
+    def _changed(self):
+        self._lookup.cache_clear()
 
     def set_source(self, source):
         self.source = source
+        self._fuzzy_index = None
+        self._changed()
+
+    def fuzzy_index(self):
+        if self._fuzzy_index is None:
+            self._fuzzy_index = NGramIndex(self.source)
+        return self._fuzzy_index
+
+    def candidates(self, n, limit=5, purified=False):
+        # Known conformed names ranked by similarity to n: [(conformed, score)]
+        pure = n if purified else purify(n)
+        return [(value, score) for value, _, score in self.fuzzy_index().candidates(pure, limit)]
+
+    def _review(self, raw, status, ranked):
+        new_file = not os.path.exists(self.review_file)
+        with open(self.review_file, 'a', newline='', encoding='utf-8') as fp:
+            writer = csv.writer(fp)
+            if new_file:
+                writer.writerow(_REVIEW_COLUMNS)
+            best, score = ranked[0] if ranked else ('', '')
+            writer.writerow([dt.datetime.now().isoformat(), raw, status, best,
+                             '{:.3f}'.format(score) if ranked else '',
+                             '|'.join('{}={:.3f}'.format(v, s) for v, s in ranked)])
 
-    def conform(self, n, purified=False, prompt=False):
+    def _resolve_unknown(self, n, prompt, fuzzy):
+        # n is purified and not a known name
+        ranked = self.candidates(n, purified=True) if fuzzy or self.review_file else []
+        if fuzzy and ranked and ranked[0][1] >= self.threshold:
+            self.add_alias(n, ranked[0][0])
+            if self.review_file:
+                self._review(n, 'accepted', ranked)
+            return ranked[0][0]
+        if self.review_file:
+            if n not in self._queued:
+                self._queued.add(n)
+                self._review(n, 'pending', ranked)
+            return None
+        if prompt:
+            cname = input('Conform {} to ?'.format(n)).strip().replace("'", "").replace('"', '').replace(',', '')
+            college = input('College (y/n) ?')[0].upper() == 'Y'
+            self.add_team(n, cname, college)
+            return self.conform(n, True, False)
+        return None
+
+    def conform(self, n, purified=False, prompt=False, fuzzy=False):
+        if not purified and type(n) == str:
+            # Memoized fast path for names that are already known
+            known = self._lookup(n)
+            if known is not None or not (prompt or fuzzy or self.review_file):
+                return known
         if not purified:
             pure = purify(n)
-            return self.conform(pure, True, prompt)
+            return self.conform(pure, True, prompt, fuzzy)
         elif n:
             if n in self.source:
                 return self.source[n]
-            elif prompt:
-                cname = input('Conform {} to ?'.format(n)).strip().replace("'", "").replace('"', '').replace(',', '')
-                college = input('College (y/n) ?')[0].upper() == 'Y'
-                self.add_team(n, cname, college)
-                return self.conform(n, True, False)
-            else:
-                return None
+            return self._resolve_unknown(n, prompt, fuzzy)
         else:
             return None
 
+    def conform_many(self, names, prompt=False, fuzzy=False):
+        # Conforms a whole column, looking each distinct name up once.
+        # Returns a Series for a Series and a list otherwise.
+        # (names can only be a Series once something has imported pandas)
+        pd = sys.modules.get('pandas')
+        is_series = pd is not None and isinstance(names, pd.Series)
+        values = names.tolist() if is_series else list(names)
+        conformed = {}
+        for n in values:
+            if n not in conformed:
+                conformed[n] = self.conform(n, prompt=prompt, fuzzy=fuzzy)
+        if is_series:
+            return names.map(conformed)
+        return [conformed[n] for n in values]
+
     def get_id(self, team_name):
-        if purify(team_name) in self.conformer_dict:
-            return self.conformer_dict[purify(team_name)]
-        for k, v in self.team_dict.items():
-            if v == team_name:
-                return k
-        return None
+        pure = purify(team_name)
+        if pure in self.conformer_dict:
+            return self.conformer_dict[pure]
+        return self.name_index.get(team_name)
 
     def add_team(self, raw: str, conformed: str, college: bool):
-        new_index = max([int(i) for i in self.team_dict.keys()])+1
+        new_index = self.next_id
+        self.next_id += 1
         self.team_dict[new_index] = conformed
+        self.name_index.setdefault(conformed, new_index)
         self.conformer_dict[raw] = new_index
         self.source[raw] = conformed
         self.source[purify(conformed)] = conformed
+        if self._fuzzy_index is not None:
+            self._fuzzy_index.add(raw, conformed)
+            self._fuzzy_index.add(purify(conformed), conformed)
+        self._changed()
+        if self.store is not None:
+            self._renumber(self.store.add_team(raw, conformed, college, new_index))
+            return
         with open(self.team_file, 'ab')as t:
             t.write('{},{},{}\n'.format(new_index, conformed, college).encode('iso-8859-1'))
         with open(self.conformer_file, 'ab') as c:
             c.write('{},{}\n'.format(raw, new_index).encode('iso-8859-1'))
 
+    def add_alias(self, raw: str, conformed: str):
+        # Maps another raw name onto an existing team
+        team_id = self.get_id(conformed)
+        self.conformer_dict[raw] = team_id
+        self.source[raw] = conformed
+        if self._fuzzy_index is not None:
+            self._fuzzy_index.add(raw, conformed)
+        self._changed()
+        if self.store is not None:
+            self._renumber(self.store.add_alias(raw, team_id))
+            return
+        with open(self.conformer_file, 'ab') as c:
+            c.write('{},{}\n'.format(raw, team_id).encode('iso-8859-1'))
+
+    def _renumber(self, ids):
+        # ids: {provisional id: stored id} from the store. Another process may have taken
+        # a provisional id (or added the same team) first, so move everything over at once.
+        moved = {old: new for old, new in ids.items() if old != new}
+        if not moved:
+            return
+        self.team_dict = {moved.get(k, k): v for k, v in self.team_dict.items()}
+        self.conformer_dict = {k: moved.get(v, v) for k, v in self.conformer_dict.items()}
+        self.name_index = {k: moved.get(v, v) for k, v in self.name_index.items()}
+        self.next_id = max(self.next_id, max(moved.values()) + 1)
 
+    @contextlib.contextmanager
+    def batch(self):
+        # New teams and aliases added inside the block are committed to the store together
+        if self.store is None:
+            yield self
+            return
+        try:
+            with self.store.batch():
+                yield self
+        finally:
+            if not self.store.in_batch:
+                self._renumber(self.store.flush())
@@ -0,0 +1,92 @@
+import math
+import re
+
+# *****************************************************************************
+# Character trigram + token index over purified team names, used to rank known
+# names for an unseen variant. Features are padded trigrams plus whole tokens of
+# the name with punctuation dropped, weighted by inverse document frequency;
+# features shared by more than _STOP_FRACTION of the names ('UNIVERSITY',
+# 'QUIDDITCH', ...) carry no weight. A candidate's score is the weighted Dice
+# coefficient of the two feature sets, between 0 and 1.
+# *****************************************************************************
+
+_N = 3
+_STOP_FRACTION = 0.05
+_REWEIGHT_GROWTH = 1.1
+_PUNCTUATION = re.compile(r'[^\w\s&]')
+
+
+def features(name):
+    words = _PUNCTUATION.sub(' ', name).split()
+    padded = ' {} '.format(' '.join(words))
+    grams = {padded[i:i + _N] for i in range(len(padded) - _N + 1)}
+    return grams | {'#' + word for word in words}
+
+
+class NGramIndex:
+    def __init__(self, names=None):
+        # names: {purified name: value returned for it}
+        self.names = []
+        self.values = []
+        self.grams = []
+        self.postings = {}
+        self._known = set()
+        self._weights = {}
+        self._totals = []
+        self._weighted_size = 0
+        for name, value in (names.items() if names else []):
+            self.add(name, value)
+        self._reweight()
+
+    def add(self, name, value):
+        if not name or name in self._known:
+            return
+        self._known.add(name)
+        entry = len(self.names)
+        grams = features(name)
+        self.names.append(name)
+        self.values.append(value)
+        self.grams.append(grams)
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(entry)
+        # Scored with the current weights until the next reweight
+        self._totals.append(sum(self._weight(gram) for gram in grams))
+
+    def _reweight(self):
+        # Weights follow document frequencies as of the last reweight; they are only
+        # recomputed once the index has grown by _REWEIGHT_GROWTH
+        size = max(len(self.names), 1)
+        stop = max(_STOP_FRACTION * size, 2)
+        self._weights = {gram: (math.log(size / len(entries)) if len(entries) <= stop else 0.0)
+                         for gram, entries in self.postings.items()}
+        self._totals = [sum(self._weights[g] for g in grams) for grams in self.grams]
+        self._weighted_size = len(self.names)
+
+    def _weight(self, gram):
+        # Features never seen in the index are as rare as a feature can be
+        return self._weights.get(gram, math.log(max(self._weighted_size, 1) + 1))
+
+    def candidates(self, name, limit=5):
+        # [(value, indexed name, score)], best first; one row per distinct value
+        if not name:
+            return []
+        if len(self.names) > self._weighted_size * _REWEIGHT_GROWTH:
+            self._reweight()
+        grams = features(name)
+        shared = {}
+        for gram in grams:
+            weight = self._weights.get(gram)
+            if weight:
+                for entry in self.postings[gram]:
+                    shared[entry] = shared.get(entry, 0.0) + weight
+        total = sum(self._weight(gram) for gram in grams)
+        scored = sorted(((2 * weight / (total + self._totals[entry]), entry) for entry, weight in shared.items()
+                         if self._totals[entry] > 0), reverse=True)
+        ranked, seen = [], set()
+        for score, entry in scored:
+            if self.values[entry] not in seen:
+                seen.add(self.values[entry])
+                ranked.append((self.values[entry], self.names[entry], score))
+                if len(ranked) == limit:
+                    break
+        return ranked
@@ -0,0 +1,120 @@
+import contextlib
+import csv
+import os
+import sqlite3
+
+# *****************************************************************************
+# SQLite store for conformer mappings, shared safely by concurrent scrapers.
+# ----------------- teams:    id, name, college
+# ----------------- aliases:  raw (purified) name -> team id
+# The store is seeded from raw_conf.csv / teams.csv the first time it is opened
+# and can write them back out with export_csv. Writes inside batch() are held in
+# memory and committed in one immediate transaction; team ids are only assigned
+# at commit time, so two processes adding the same team end up sharing one id.
+# *****************************************************************************
+
+_STORE_FILE = 'conformer.sqlite'
+_TIMEOUT = 60
+
+
+def _to_bool(value):
+    return str(value).strip().upper() in ('1', 'TRUE', 'Y', 'YES')
+
+
+class ConformerStore:
+    def __init__(self, path=_STORE_FILE, conformers='raw_conf.csv', teams='teams.csv'):
+        self.path = path
+        self._pending_teams = []
+        self._pending_aliases = []
+        self._batch_depth = 0
+        self._db = sqlite3.connect(path, timeout=_TIMEOUT, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA busy_timeout={}'.format(_TIMEOUT * 1000))
+        with self._transaction():
+            self._db.execute('CREATE TABLE IF NOT EXISTS teams (id INTEGER PRIMARY KEY, name TEXT NOT NULL, '
+                             'college INTEGER NOT NULL DEFAULT 0)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS teams_name ON teams (name)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS aliases (raw TEXT PRIMARY KEY, team_id INTEGER NOT NULL)')
+            seeded = self._db.execute('SELECT EXISTS (SELECT 1 FROM teams)').fetchone()[0]
+            if not seeded and os.path.exists(conformers) and os.path.exists(teams):
+                self._seed(conformers, teams)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so id allocation can't race
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+    def _seed(self, conformers, teams):
+        import pandas as pd
+        team_df = pd.read_csv(teams, encoding='iso-8859-1', index_col=0)
+        colleges = team_df['College'] if 'College' in team_df else pd.Series(0, index=team_df.index)
+        self._db.executemany('INSERT OR REPLACE INTO teams VALUES (?, ?, ?)',
+                             [(int(k), v, int(_to_bool(colleges[k]))) for k, v in team_df['Name'].items()])
+        raw = pd.read_csv(conformers, encoding='iso-8859-1', index_col=0).to_dict()['Conformed']
+        self._db.executemany('INSERT OR REPLACE INTO aliases VALUES (?, ?)', [(k, int(v)) for k, v in raw.items()])
+
+    def load(self):
+        # (conformer_dict, team_dict) in the shapes Conformer uses
+        conformer_dict = dict(self._db.execute('SELECT raw, team_id FROM aliases'))
+        team_dict = dict(self._db.execute('SELECT id, name FROM teams ORDER BY id'))
+        return conformer_dict, team_dict
+
+    def add_team(self, raw, conformed, college, provisional):
+        # Returns {provisional id: stored id} once written; {} while a batch is open
+        self._pending_teams.append((provisional, raw, conformed, college))
+        return self.flush() if not self._batch_depth else {}
+
+    def add_alias(self, raw, team_id):
+        self._pending_aliases.append((raw, team_id))
+        return self.flush() if not self._batch_depth else {}
+
+    def flush(self):
+        if not self._pending_teams and not self._pending_aliases:
+            return {}
+        ids = {}
+        with self._transaction():
+            for provisional, raw, conformed, college in self._pending_teams:
+                row = self._db.execute('SELECT id FROM teams WHERE name = ? ORDER BY id LIMIT 1', (conformed,)).fetchone()
+                if row:
+                    team_id = row[0]
+                else:
+                    team_id = self._db.execute('SELECT COALESCE(MAX(id), -1) + 1 FROM teams').fetchone()[0]
+                    self._db.execute('INSERT INTO teams VALUES (?, ?, ?)', (team_id, conformed, int(bool(college))))
+                ids[provisional] = team_id
+                self._db.execute('INSERT OR REPLACE INTO aliases VALUES (?, ?)', (raw, team_id))
+            self._db.executemany('INSERT OR REPLACE INTO aliases VALUES (?, ?)',
+                                 [(raw, ids.get(team_id, team_id)) for raw, team_id in self._pending_aliases])
+        self._pending_teams = []
+        self._pending_aliases = []
+        return ids
+
+    @property
+    def in_batch(self):
+        return self._batch_depth > 0
+
+    @contextlib.contextmanager
+    def batch(self):
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+
+    def export_csv(self, conformers='raw_conf.csv', teams='teams.csv'):
+        with open(teams, 'w', newline='', encoding='iso-8859-1') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['ID', 'Name', 'College'])
+            writer.writerows(self._db.execute('SELECT id, name, college FROM teams ORDER BY id'))
+        with open(conformers, 'w', newline='', encoding='iso-8859-1') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['Team', 'Conformed'])
+            writer.writerows(self._db.execute('SELECT raw, team_id FROM aliases ORDER BY raw'))
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from . import scheduler
+
+# *****************************************************************************
+# Content-addressed on-disk cache for fetched pages, shared by every scraper.
+# Bodies are stored once per sha256 digest under <root>/objects, and a small
+# sqlite index maps each URL to its digest with store/access times for TTL and
+# LRU eviction. In offline (replay only) mode the network is never touched and
+# a missing URL raises CacheMiss.
+#
+# Enabled with configure(...) or the environment:
+# ----------------- QSCORE_HTTP_CACHE          cache directory
+# ----------------- QSCORE_HTTP_CACHE_TTL      seconds before an entry is refetched
+# ----------------- QSCORE_HTTP_CACHE_MAX_MB   size limit before LRU eviction
+# ----------------- QSCORE_HTTP_CACHE_OFFLINE  1 to replay from the cache only
+# *****************************************************************************
+
+_MAX_BYTES = 1024 ** 3
+_CACHE = None
+_CONFIGURED = False
+_LOCK = threading.Lock()
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class ResponseCache:
+    def __init__(self, root='.http_cache', ttl=None, max_bytes=_MAX_BYTES, offline=False):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, 'index.sqlite'), timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS entries (url TEXT PRIMARY KEY, digest TEXT NOT NULL, '
+                             'size INTEGER NOT NULL, stored REAL NOT NULL, accessed REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def get(self, url):
+        with self._lock:
+            row = self._db.execute('SELECT digest, stored FROM entries WHERE url = ?', (url,)).fetchone()
+            if not row:
+                return None
+            digest, stored = row
+            if self.ttl is not None and not self.offline and time.time() - stored > self.ttl:
+                return None
+            try:
+                with open(self._object_path(digest), 'rb') as f:
+                    body = f.read()
+            except FileNotFoundError:
+                with self._db:
+                    self._db.execute('DELETE FROM entries WHERE url = ?', (url,))
+                return None
+            with self._db:
+                self._db.execute('UPDATE entries SET accessed = ? WHERE url = ?', (time.time(), url))
+            return body
+
+    def put(self, url, body: bytes):
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+            with open(tmp, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        now = time.time()
+        with self._lock:
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                                 (url, digest, len(body), now, now))
+        self.evict()
+        return digest
+
+    def size(self):
+        with self._lock:
+            return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def evict(self):
+        # Least recently accessed URLs go first; an object is removed once no URL points at it
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            dropped = []
+            for url, digest, size in self._db.execute('SELECT url, digest, size FROM entries ORDER BY accessed').fetchall():
+                if total <= self.max_bytes:
+                    break
+                dropped.append((url, digest))
+                total -= size
+            with self._db:
+                self._db.executemany('DELETE FROM entries WHERE url = ?', [(url,) for url, _ in dropped])
+            for digest in {d for _, d in dropped}:
+                if not self._db.execute('SELECT 1 FROM entries WHERE digest = ?', (digest,)).fetchone():
+                    try:
+                        os.remove(self._object_path(digest))
+                    except FileNotFoundError:
+                        pass
+
+    def close(self):
+        self._db.close()
+
+
+def configure(root='.http_cache', ttl=None, max_bytes=_MAX_BYTES, offline=False):
+    global _CACHE, _CONFIGURED
+    with _LOCK:
+        _CACHE = ResponseCache(root, ttl, max_bytes, offline) if root else None
+        _CONFIGURED = True
+    return _CACHE
+
+
+def get_cache():
+    # None when caching is disabled
+    global _CACHE, _CONFIGURED
+    with _LOCK:
+        if not _CONFIGURED:
+            root = os.environ.get('QSCORE_HTTP_CACHE')
+            if root:
+                ttl = os.environ.get('QSCORE_HTTP_CACHE_TTL')
+                max_mb = os.environ.get('QSCORE_HTTP_CACHE_MAX_MB')
+                _CACHE = ResponseCache(root, float(ttl) if ttl else None,
+                                       int(float(max_mb) * 1024 ** 2) if max_mb else _MAX_BYTES,
+                                       os.environ.get('QSCORE_HTTP_CACHE_OFFLINE') == '1')
+            _CONFIGURED = True
+        return _CACHE
+
+
+def get_text(url, session=None):
+    cache = get_cache()
+    if cache:
+        body = cache.get(url)
+        if body is not None:
+            return body.decode('utf-8')
+        if cache.offline:
+            raise CacheMiss(url)
+    # Timeouts, retries and per-host limits; raises scheduler.FetchError once retries run out
+    response = scheduler.fetch(url, session)
+    # Error pages are returned to the caller but never replayed
+    if cache and response.ok:
+        cache.put(url, response.text.encode('utf-8'))
+    return response.text
@@ -0,0 +1,222 @@
+import datetime as dt
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+# *****************************************************************************
+# Shared scheduler for every outbound fetch.
+# ----------------- per-host token bucket (rate, burst), honouring Retry-After
+# ----------------- per-host AIMD concurrency: +1/limit per good response, halved
+#                   on 429/5xx, timeouts or a latency spike (at most once per window)
+# ----------------- connect/read timeouts and retries with full-jitter backoff
+# ----------------- a dead-letter list of urls that failed every attempt, which can
+#                   be saved as JSON lines and retried later
+# fetch() is for blocking callers; reserve()/backoff()/dead_letter() let async
+# callers (the calendar renderer) share the same limits.
+# *****************************************************************************
+
+_RATE = 20.0
+_BURST = 20
+_MIN_CONCURRENCY = 1
+_START_CONCURRENCY = 4
+_MAX_CONCURRENCY = 32
+_TIMEOUT = (10, 30)
+_RETRIES = 4
+_BACKOFF = 0.5
+_BACKOFF_CAP = 30.0
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+# A response this many times slower than the host's running average counts as a spike
+_SPIKE_FACTOR = 3.0
+_SPIKE_FLOOR = 1.0
+_EWMA_WEIGHT = 0.2
+_DEAD_LETTER_FILE = 'dead_letters.jsonl'
+_SCHEDULER = None
+_LOCK = threading.Lock()
+
+
+class FetchError(Exception):
+    pass
+
+
+def host_of(url):
+    return urlsplit(url).netloc.lower()
+
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return float(value) if value else 0.0
+    except ValueError:
+        return 0.0
+
+
+class _Host:
+    def __init__(self, rate, burst, concurrency):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.limit = float(concurrency)
+        self.in_flight = 0
+        self.ewma = None
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.condition = threading.Condition()
+
+
+class Scheduler:
+    def __init__(self, rate=_RATE, burst=_BURST, concurrency=_START_CONCURRENCY, min_concurrency=_MIN_CONCURRENCY,
+                 max_concurrency=_MAX_CONCURRENCY, timeout=_TIMEOUT, retries=_RETRIES, backoff=_BACKOFF,
+                 backoff_cap=_BACKOFF_CAP):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff
+        self.backoff_cap = backoff_cap
+        self.dead_letters = []
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        name = host_of(url)
+        with self._lock:
+            host = self._hosts.get(name)
+            if host is None:
+                host = self._hosts[name] = _Host(self.rate, self.burst, self.concurrency)
+            return host
+
+    def reserve(self, url):
+        # Takes a token for url's host; returns how long to wait before sending
+        host = self._host(url)
+        with host.condition:
+            now = time.monotonic()
+            host.tokens = min(host.burst, host.tokens + (now - host.updated) * host.rate)
+            host.updated = now
+            host.tokens -= 1
+            return max(-host.tokens / host.rate, host.paused_until - now, 0.0)
+
+    def backoff(self, attempt, retry_after=0.0):
+        # Full jitter: anywhere up to the capped exponential delay, but never before Retry-After
+        return max(random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt)), retry_after)
+
+    def _acquire(self, host):
+        with host.condition:
+            while host.in_flight >= int(host.limit):
+                host.condition.wait()
+            host.in_flight += 1
+            host.requests += 1
+
+    def _release(self, host, ok, latency, retry_after=0.0):
+        with host.condition:
+            host.in_flight -= 1
+            now = time.monotonic()
+            spike = (ok and host.ewma is not None
+                     and latency > max(_SPIKE_FACTOR * host.ewma, _SPIKE_FLOOR))
+            if ok:
+                host.ewma = latency if host.ewma is None else (1 - _EWMA_WEIGHT) * host.ewma + _EWMA_WEIGHT * latency
+            if ok and not spike:
+                host.limit = min(self.max_concurrency, host.limit + 1 / host.limit)
+            elif now - host.last_decrease > (host.ewma if host.ewma else _SPIKE_FLOOR):
+                # One decrease per window, so a burst of failures from the same window counts once
+                host.limit = max(self.min_concurrency, host.limit / 2)
+                host.last_decrease = now
+            if retry_after:
+                host.paused_until = max(host.paused_until, now + retry_after)
+            host.condition.notify_all()
+
+    def fetch(self, url, session=None, headers=None):
+        # GET with limits and retries. Returns the last response unless every attempt failed
+        # with a request error (timeout, connection, truncated body) or retryable status, in
+        # which case url is dead-lettered and FetchError raised.
+        import requests
+        host = self._host(url)
+        error = None
+        for attempt in range(self.retries + 1):
+            self._acquire(host)
+            start = time.monotonic()
+            response = None
+            try:
+                wait = self.reserve(url)
+                if wait:
+                    time.sleep(wait)
+                start = time.monotonic()
+                response = (session if session else requests).get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                # Timeouts and refused connections, but also bodies cut off mid-transfer
+                # (ChunkedEncodingError, ContentDecodingError)
+                error = e
+            finally:
+                # The slot is returned whatever happened, or the host would stall at its limit
+                latency = time.monotonic() - start
+                failed = response is None or response.status_code in _RETRY_STATUS
+                retry_after = _retry_after(response)
+                self._release(host, not failed, latency, retry_after)
+            if not failed:
+                return response
+            error = error if response is None else FetchError('HTTP {}'.format(response.status_code))
+            if attempt < self.retries:
+                with host.condition:
+                    host.retries += 1
+                time.sleep(self.backoff(attempt, retry_after))
+        with host.condition:
+            host.failures += 1
+        self.dead_letter(url, error, self.retries + 1)
+        raise FetchError('{} failed after {} attempts: {}'.format(url, self.retries + 1, error))
+
+    def dead_letter(self, url, error, attempts):
+        with self._lock:
+            self.dead_letters.append({'url': url, 'error': '{}: {}'.format(type(error).__name__, error),
+                                      'attempts': attempts, 'time': dt.datetime.now().isoformat()})
+
+    def stats(self):
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {name: {'limit': round(host.limit, 2), 'rate': host.rate, 'requests': host.requests,
+                       'retries': host.retries, 'failures': host.failures,
+                       'latency': round(host.ewma, 4) if host.ewma is not None else None}
+                for name, host in hosts.items()}
+
+    def save_dead_letters(self, path=_DEAD_LETTER_FILE):
+        # Appends the dead letters collected so far and clears them; returns how many were written
+        with self._lock:
+            letters, self.dead_letters = self.dead_letters, []
+        if letters:
+            with open(path, 'a', encoding='utf-8') as fp:
+                fp.writelines(json.dumps(letter) + '\n' for letter in letters)
+        return len(letters)
+
+
+def load_dead_letters(path=_DEAD_LETTER_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def configure(**options):
+    global _SCHEDULER
+    with _LOCK:
+        _SCHEDULER = Scheduler(**options)
+    return _SCHEDULER
+
+
+def get_scheduler():
+    global _SCHEDULER
+    with _LOCK:
+        if _SCHEDULER is None:
+            _SCHEDULER = Scheduler()
+        return _SCHEDULER
+
+
+def fetch(url, session=None, headers=None):
+    return get_scheduler().fetch(url, session, headers)
@@ -1,11 +1,10 @@
-import pandas as pd
-import numpy as np
-from bs4 import BeautifulSoup
-import bs4
 import re
-import requests
 import datetime as dt
-import qscore_scraper.conformer.conform as cf
+import conformer.conform as cf
+import fetching.cache as fc
+import usq_site_scraper.logs as lg
+import usq_site_scraper.metrics as mt
+import usq_site_scraper.records as rc
 # *****************************************************************************
 # Historical scraper for all Eighthman regular season data (fall + spring of wc6 season)
 # Data Source:  eighthman.com
@@ -20,10 +19,21 @@ _CATCH_MARKERS = ['*', '^', '!']
 T8M_FALL_URL = "http://www.eighthman.com/results/2012-2013-season/chronological-list-of-all-games-2012-2013-season/chronological-list-of-all-games-fall-2012/"
 T8M_SPRING_URL = 'http://www.eighthman.com/results/2012-2013-season/chronological-list-of-all-games-2012-2013-season/chronological-list-of-all-games-spring-2013/'
 T8M_WC6D1_URL = 'http://www.eighthman.com/results/world-cup/world-cup-vi-d1-pool-play/'
+_WC6_SEASON_START = dt.datetime(year=2012, month=7, day=1)
+_WC6_DATE = dt.datetime(year=2013, month=4, day=13)
+_WC6_PLAY_INS_DATE = dt.datetime(year=2013, month=4, day=14)
+_DATE_PATTERN = re.compile(r'(?P<month>\d+)/(?P<day>\d+)/(?P<year>\d+)')
+_RESULT_PATTERN = re.compile(r'[(\d)]*\s*(?P<t1name>\D+)\s*(?P<t1score>\d+)(?P<extras1>[*^!]*)\s*[\sv–-]\s*[(\d)]*'
+                             r'(?P<t2name>\D+)\s*(?P<t2score>\d+)(?P<extras2>[\*\^\!]*)')
+_TIMED_RESULT_PATTERN = re.compile(_RESULT_PATTERN.pattern + r'\s*\((?P<minutes>\d*):(?P<seconds>\d*)\)')
+_CONFORMER = None
+_REVIEW_FILE = 'review_queue.csv'
+_STORE_FILE = 'conformer.sqlite'
+_LOG_ERROR_FILE = 'error_log.jsonl'
 
 
 def parse_wc6_rs_result(tournament, date, t1name, t1score, extras1, t2name, t2score, extras2, minutes=0, seconds=0):
-    gtime = int(minutes) * 60 + int(seconds)
+    gtime = int(minutes if minutes else 0) * 60 + int(seconds if seconds else 0)
     t1 = [t1name, int(t1score)]
     t2 = [t2name, int(t2score)]
     ots = 0
@@ -39,78 +49,87 @@ def parse_wc6_rs_result(tournament, date, t1name, t1score, extras1, t2name, t2sc
         else:
             t1.append(False)
             t2.append(False)
-    return [tournament, date, *t1, *t2, ots, gtime]
+    return rc.GameRecord(tournament, date, *t1, *t2, ots, gtime)
 
 
-def parse_wc6season(url):
-    #Create Conformer object
-    conformer = cf.Conformer()
-    soup = BeautifulSoup(requests.get(url).text)
-    data = [result for result in soup.find("div", {"id": "content-area"}).findAll('p') if not result.find('em')]
-    results = []
-    date = dt.datetime(year=2012, month=7, day=1)
-    for line in data:
-        date_match = None
-        if line.find('strong'):
-            date_match = re.match(r'(?P<month>\d+)/(?P<day>\d+)/(?P<year>\d+)', line.find('strong').text)
-            if date_match:
-                year = int(date_match.group('year'))
-                month = int(date_match.group('month'))
-                day = int(date_match.group('day'))
-                date = dt.datetime(year=year if year // 100 != 0 else year + 2000, month=month, day=day)
+def _get_conformer():
+    global _CONFORMER
+    if _CONFORMER is None:
+        _CONFORMER = cf.Conformer(review_file=_REVIEW_FILE, store=_STORE_FILE)
+    return _CONFORMER
 
-        pattern = r'[(\d)]*\s*(?P<t1name>\D+)\s*(?P<t1score>\d+)(?P<extras1>[*^!]*)\s*[\sv–-]\s*[(\d)]*(?P<t2name>\D+)\s*(?P<t2score>\d+)(?P<extras2>[\*\^\!]*)'
-        breaks = line.findAll('br')
-        str_line = str(line)
-        for br in set(breaks):
-            str_line = str_line.replace(str(br), '\n')
+
+def _page_lines(url, season):
+    # Single pass over the page: yields ('date', datetime) and ('line', text) tokens.
+    # <br> tags become newlines in place, so each <p> is read once with no re-parsing.
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(fc.get_text(url))
+    root = soup.find('div', {'id': 'content-area'}) if season else soup
+    for p in root.findAll('p'):
+        if season and p.find('em'):
+            continue
+        strong = p.find('strong') if season else None
+        date_match = _DATE_PATTERN.match(strong.text) if strong else None
+        for br in p.findAll('br'):
+            br.replace_with('\n')
+        text = p.get_text()
         if date_match:
-            str_line = str_line.replace(date_match.group(0), '')
-        line = BeautifulSoup(str_line)
-        for val in line.text.split('\n'):
-            # print(val)
-            match = re.match(pattern, val)
-            if val == '' or val == '\n':
-                pass
-            elif not match:
-                print('{} could not be matched to the pattern'.format(val))
-            else:
-                groups = match.groups()
-                #Conform group names
-                groups[0] = conformer.conform(groups[0], purified=False, prompt=True)
-                groups[3] = conformer.conform(groups[3], purified=False, prompt=True)
-                parsed = parse_wc6_rs_result('Unknown', date, *groups)
-                results.append(parsed)
-    return results
+            year = int(date_match.group('year'))
+            yield 'date', dt.datetime(year=year if year // 100 != 0 else year + 2000,
+                                      month=int(date_match.group('month')), day=int(date_match.group('day')))
+            text = text.replace(date_match.group(0), '')
+        for line in text.split('\n'):
+            if line.strip():
+                yield 'line', line
+
+
+def iter_results(url, tournament, date, season=True, report=None, prompt=True):
+    # Parses one eighthman result page. Lines that match neither pattern are logged to
+    # _LOG_ERROR_FILE, and also added to report (a list of {'url', 'line'} dicts) when
+    # given, instead of stopping the parse; team names are conformed once per distinct
+    # name after the page is read.
+    raw, unmatched = [], []
+    for kind, value in _page_lines(url, season):
+        if kind == 'date':
+            date = value
+            continue
+        if not season and 'Play Ins' in value:
+            date = _WC6_PLAY_INS_DATE
+            continue
+        match = None if season else _TIMED_RESULT_PATTERN.match(value)
+        match = match if match else _RESULT_PATTERN.match(value)
+        if match:
+            raw.append((date, list(match.groups())))
+        else:
+            unmatched.append({'url': url, 'line': value})
+    logger = lg.get_logger(_LOG_ERROR_FILE)
+    for entry in unmatched:
+        logger.warning('{} could not be matched to the pattern'.format(entry['line'].strip()),
+                       extra={'stage': 'parsing result', 'url': url})
+    if report is not None:
+        report.extend(unmatched)
+    conformer = _get_conformer()
+    names = list(dict.fromkeys(name for _, groups in raw for name in (groups[0], groups[3])))
+    with conformer.batch(), mt.timed('conform', count=len(names)):
+        conformed = dict(zip(names, conformer.conform_many(names, prompt=prompt, fuzzy=True)))
+    for date, groups in raw:
+        groups[0] = conformed[groups[0]]
+        groups[3] = conformed[groups[3]]
+        yield parse_wc6_rs_result(tournament, date, *groups)
+
+
+def parse_wc6season(url, report=None):
+    return rc.GameBatch(iter_results(url, 'Unknown', _WC6_SEASON_START, True, report))
+
+
+def parse_wc6_nationals(url, report=None):
+    return rc.GameBatch(iter_results(url, 'IQA World Cup 6', _WC6_DATE, False, report, prompt=False))
 
 
-def parse_wc6_nationals(url):
-    conformer = cf.Conformer()
-    ps = BeautifulSoup(requests.get(url).text).findAll('p')
-    rows = [''.join([str(x) for x in c.contents]) if type(c) == bs4.element.Tag else str(c).strip() for p in ps for c in p.contents]
-    results = []
-    date = dt.datetime(year =2013, month=4, day=13)
-    for row in rows:
-        data = row.replace('<br/>', '').split('\n')
-        for datum in data:
-            if 'Play Ins' in datum:
-                date = dt.datetime(year=2013,month=4,day=14)
-                continue
-            pattern = r'[(\d)]*\s*(?P<t1name>\D+)\s*(?P<t1score>\d+)(?P<extras1>[\*\^\!]*)\s*[\sv–-]\s*[(\d)]*(?P<t2name>\D+)\s*(?P<t2score>\d+)(?P<extras2>[\*\^\!]*)\s*\((?P<minutes>\d*):(?P<seconds>\d*)\)'
-            match = re.match(pattern,datum)
-            if datum =='' or datum =='\n':
-                continue
-            if not match:
-                abridged_pattern = r'[(\d)]*\s*(?P<t1name>\D+)\s*(?P<t1score>\d+)(?P<extras1>[\*\^\!]*)\s*[\sv–-]\s*[(\d)]*(?P<t2name>\D+)\s*(?P<t2score>\d+)(?P<extras2>[\*\^\!]*)\s*'
-                new_match = re.match(abridged_pattern,datum)
-                if not new_match:
-                    print('{} could not be matched to the pattern'.format(datum))
-                    continue
-                else:
-                    pass
-            groups = match.groups() if match else new_match.groups()
-            groups[0] = conformer.conform(groups[0])
-            groups[3] = conformer.conform(groups[3])
-            parsed = parse_wc6_rs_result('IQA World Cup 6', date, *groups)
-            results.append(parsed)
+def parse_all(report=None):
+    # Fall and spring regular seasons plus World Cup VI D1 pool play
+    results = rc.GameBatch()
+    for url in (T8M_FALL_URL, T8M_SPRING_URL):
+        results.extend(iter_results(url, 'Unknown', _WC6_SEASON_START, True, report))
+    results.extend(iter_results(T8M_WC6D1_URL, 'IQA World Cup 6', _WC6_DATE, False, report, prompt=False))
     return results
@@ -1,25 +1,31 @@
 import datetime as dt
-from bs4 import BeautifulSoup
-import pandas as pd
-import xlrd
-import numpy as np
 import conformer.conform as cf
-import re, requests
+import fetching.cache as fc
+import usq_site_scraper.metrics as mt
+import usq_site_scraper.records as rc
+import re
 _CATCH_MARKERS = ['*', '^', '!']
 _WC8_URL = 'https://web.archive.org/web/20170703075617/http://usqworldcup.com/scores/'
 _WC7_URL = 'https://web.archive.org/web/20150206234411/http://iqaworldcup.com/scores'
 _USQ12_FNAME = 'usq_cup12.xlsx'
-_COLUMNS = ['Tournament', 'Date', 'Winner', 'Winning_Score', '*1', '^1', '!1',
-               'Loser', 'Losing_Score', '*2', '^2', '!2', 'OTS', 'Gametime']
+_REVIEW_FILE = 'review_queue.csv'
+_STORE_FILE = 'conformer.sqlite'
+_CONFORMER = None
 
-conformer = cf.Conformer()
+
+def _get_conformer():
+    # Loaded on first use, so importing the module needs neither the mapping files nor pandas
+    global _CONFORMER
+    if _CONFORMER is None:
+        _CONFORMER = cf.Conformer(review_file=_REVIEW_FILE, store=_STORE_FILE)
+    return _CONFORMER
 
 
 def parse_usq12_result(row):
     days, pdays, t1, s1, s2, t2, period, c1, c2, c3, _ = row
     if t1 == 'BYE' or t2 == 'BYE':
-        return []
-    seconds = int(np.round(pdays * 86400))
+        return None
+    seconds = round(pdays * 86400)
     time = dt.datetime(1900, 1, 1) + dt.timedelta(days=days - 2) + dt.timedelta(seconds=seconds)
     team1 = [t1, int(s1)]
     team2 = [t2, int(s2)]
@@ -57,7 +63,7 @@ def parse_usq12_result(row):
     else:
         loser = team1
         winner = team2
-    return ['US Quidditch Cup 12', time, *winner, *loser, ots, None]
+    return rc.GameRecord('US Quidditch Cup 12', time, *winner, *loser, ots, None)
 
 
 def parse_bracket_12(game, long_conf: dict):
@@ -71,8 +77,9 @@ def parse_bracket_12(game, long_conf: dict):
         name1, score1, extras1 = m1.groups()
         name2, score2, extras2 = m2.groups()
         hour, minute = mt.groups()
-        team1 = [conformer.conform(long_conf[name1]), int(score1)]
-        team2 = [conformer.conform(long_conf[name2]), int(score2)]
+        conformer = _get_conformer()
+        team1 = [conformer.conform(long_conf.get(name1, name1)), int(score1)]
+        team2 = [conformer.conform(long_conf.get(name2, name2)), int(score2)]
         ots = 0
         for i, catch in enumerate(_CATCH_MARKERS):
             if catch in extras1:
@@ -93,8 +100,8 @@ def parse_bracket_12(game, long_conf: dict):
             winner = team2
             loser = team1
         gtime = dt.datetime(2019, 4, 14, hour=int(hour) + 12, minute=int(minute))
-        return ['US Quidditch Cup 12', gtime, *winner, *loser, ots, None]
-    return []
+        return rc.GameRecord('US Quidditch Cup 12', gtime, *winner, *loser, ots, None)
+    return None
 
 
 def parse_wc8_result(idx, time, team1, score1, score2, team2, period, gtime, pitch):
@@ -123,7 +130,7 @@ def parse_wc8_result(idx, time, team1, score1, score2, team2, period, gtime, pit
     else:
         ots = 1 if period == 'OT' else 0
     gametime = sum([int(s) * (60 ** (1 - i)) for i, s in enumerate(gtime.split(':'))])
-    return [tstamp, *team1_results, *team2_results, ots, gametime]
+    return rc.GameRecord('USQ World Cup 8', tstamp, *team1_results, *team2_results, ots, gametime)
 
 def parse_wc7_result(idx, team1, score1, team2, score2, description):
     _CATCH_MARKERS = ['*', '^', '!']
@@ -149,81 +156,122 @@ def parse_wc7_result(idx, team1, score1, team2, score2, description):
     tournament = 'IQA World Cup 7'
     winner, loser = (team1_result, team2_result) if int(team1_result[1]) > int(team2_result[1]) else (
     team2_result, team1_result)
-    return [tournament, date, *winner, *loser, ots, gtime]
+    return rc.GameRecord(tournament, date, *winner, *loser, ots, gtime)
 
 
 def get_wc8(url) -> list:
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text)
+    from bs4 import BeautifulSoup
+    conformer = _get_conformer()
+    soup = BeautifulSoup(fc.get_text(url))
     scores = [[v.text for v in row.findAll('td')] for row in soup.find("table", {"class": "igsv-table"}).findAll('tr')][
              1:]
-    score_list = [['USQ World Cup 8', *parse_wc8_result(i, *res)] for i, res in enumerate(scores)]
-    for i, result in enumerate(score_list):
-        score_list[i][2] = conformer.conform(result[2], prompt=True)
-        score_list[i][7] = conformer.conform(result[7], prompt=True)
+    score_list = rc.GameBatch(parse_wc8_result(i, *res) for i, res in enumerate(scores))
+    with conformer.batch(), mt.timed('conform', count=2 * len(score_list)):
+        score_list.rename_teams(lambda name: conformer.conform(name, prompt=True, fuzzy=True))
     return score_list
 
 
 def get_wc7(url) -> list:
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text)
+    from bs4 import BeautifulSoup
+    conformer = _get_conformer()
+    soup = BeautifulSoup(fc.get_text(url))
     result_soup = [(result.findAll('div', {'class': 'scorebox-body'}),
                     result.find('span', {'style': 'margin-right:10px;float:right;'})) for result in
                    soup.findAll('div', {"class": "scorebox"})]
     results = [[val.text for score in result for val in score.findAll('td')[1:]] + [desc.text] for result, desc in
                result_soup]
-    score_list = [parse_wc7_result(idx, *r) for idx, r in enumerate(results)]
-    for i, result in enumerate(score_list):
-        score_list[i][2] = conformer.conform(result[2], prompt=True)
-        score_list[i][7] = conformer.conform(result[7], prompt=True)
+    score_list = rc.GameBatch(parse_wc7_result(idx, *r) for idx, r in enumerate(results))
+    with conformer.batch(), mt.timed('conform', count=2 * len(score_list)):
+        score_list.rename_teams(lambda name: conformer.conform(name, prompt=True, fuzzy=True))
+    return score_list
 
 
-def usq_cup12_scraper(fname):
-    # Open Workbook
-    wb = xlrd.open_workbook(fname)
-    scores = []
-    # Get Day1 Scores for Flight/Pool A/B/C/D
-    for group in ('Flight', 'Pool'):
-        for i in ('A', 'B', 'C', 'D'):
-            matches = wb.sheet_by_name('{} {} Matches'.format(group, i))
-            rankings = wb.sheet_by_name('{} {} Rankings'.format(group, i))
-            # Make a dictionary matching the four letter abbreviation to a full team name
-            long_conf = {row [1]:row[0] for row in rankings._cell_values[1:] if row[1]!='BYE'}
-            cutoff = 0 if i=='A' else 1
-            raw = [parse_usq12_result(row) for row in matches._cell_values[1:]]
-            for j, result in enumerate(raw):
-                raw[j][2] = conformer.conform(long_conf[result[2]], prompt=True)
-                raw[j][7] = conformer.conform(long_conf[result[7]], prompt=True)
-            scores = [*scores, *raw]
-
-    # Get Day2 Scores (Bracket Play)
-    collegiate = wb.sheet_by_name('Sun Collegiate Bracket - Full')
-    bracket_scores = []
-    values = collegiate._cell_values
-    LEFT, RIGHT = (0, len(values[0]) - 1)
-    round_no = 32
-    round_games = []
+def _excel_serial(value):
+    # openpyxl returns date/time formatted cells as datetimes; the parser works on Excel serials
+    if isinstance(value, dt.datetime):
+        return (value - dt.datetime(1899, 12, 30)).total_seconds() / 86400
+    if isinstance(value, dt.time):
+        return (value.hour * 3600 + value.minute * 60 + value.second) / 86400
+    return value
+
+
+def _sheet_rows(wb, name, min_row=1, max_col=None):
+    # Streams one sheet's rows as tuples ('' for empty cells), skipping blank rows
+    for row in wb[name].iter_rows(min_row=min_row, max_col=max_col, values_only=True):
+        if any(value is not None and value != '' for value in row):
+            yield tuple('' if value is None else value for value in row)
+
+
+def _read_group(wb, group, letter):
+    # (abbreviation -> full team name, parsed Day 1 results) of one Flight/Pool
+    rankings = _sheet_rows(wb, '{} {} Rankings'.format(group, letter), min_row=2, max_col=2)
+    long_conf = {abbreviation: name for name, abbreviation in rankings if abbreviation != 'BYE'}
+    matches = _sheet_rows(wb, '{} {} Matches'.format(group, letter), min_row=2, max_col=11)
+    raw = (parse_usq12_result((_excel_serial(days), _excel_serial(pdays), *rest)) for days, pdays, *rest in matches)
+    return long_conf, rc.GameBatch(result for result in raw if result)
+
+
+def _collegiate_rounds(width):
     # Two-sided bracket, work games from outer bounds to inner
-    while LEFT < RIGHT and round_no > 1:
-        round_games.append([val[LEFT] for val in values if val[LEFT]] + [val[RIGHT] for val in values if val[RIGHT]])
-        LEFT += 1
-        RIGHT -= 1
-        round_no = round_no / 2
-    # Club bracket, one sided
-    club = wb.sheet_by_name('Sun Community Bracket - Full')
-    values = club._cell_values
-    round_no, i = (16, 0)
-    while round_no >= 1:
-        round_games.append([val[i] for val in values if val[i]])
-        i += 1
-        round_no /= 2
-    for rd in round_games:
+    rounds, left, right, round_no = [], 0, width - 1, 32
+    while left < right and round_no > 1:
+        rounds.append((left, right))
+        left, right, round_no = left + 1, right - 1, round_no / 2
+    return rounds
+
+
+def _community_rounds(width):
+    # Club bracket, one sided: round of 16 through the final
+    return [(i,) for i in range(5)]
+
+
+def _read_bracket(wb, name, rounds):
+    # [(team 1 cell, time cell, team 2 cell)] of a bracket sheet. The sheet is streamed once,
+    # keeping the filled cells of every column, and rounds(width) says which columns hold
+    # each round. A round without a multiple of three cells is a lone final with no time.
+    columns, width = {}, 0
+    for row in _sheet_rows(wb, name):
+        for col, value in enumerate(row):
+            if value:
+                columns.setdefault(col, []).append(value)
+                width = max(width, col + 1)
+    games = []
+    for cols in rounds(width):
+        rd = [value for col in cols for value in columns.get(col, [])]
+        if not rd:
+            continue
         if len(rd) % 3 == 0:
-            bracket_scores = [*bracket_scores, *[rd[i:i + 3] for i in range(0, max(3, len(rd) - 3), 3)]]
+            games.extend(rd[i:i + 3] for i in range(0, max(3, len(rd) - 3), 3))
         else:
-            bracket_scores.append([rd[0], 'P1 9:30 PM', rd[1]])
-    scores = [*scores, *[parse_bracket_12(game) for game in bracket_scores]]
-
-    return [r for r in scores if r]
+            games.append([rd[0], 'P1 9:30 PM', rd[1]])
+    return games
 
 
+def usq_cup12_scraper(fname):
+    # The workbook is opened once, read-only, and its sheets streamed in order: the Day 1
+    # Flight/Pool sheets, then the two Day 2 brackets
+    import openpyxl
+    conformer = _get_conformer()
+    scores, long_conf = rc.GameBatch(), {}
+    wb = openpyxl.load_workbook(fname, read_only=True, data_only=True)
+    try:
+        # Only the conform calls are timed, not the sheet reads between them
+        with conformer.batch():
+            for group in ('Flight', 'Pool'):
+                for letter in ('A', 'B', 'C', 'D'):
+                    group_conf, raw = _read_group(wb, group, letter)
+                    long_conf.update(group_conf)
+                    with mt.timed('conform', count=2 * len(raw)):
+                        raw.rename_teams(lambda name: conformer.conform(group_conf[name], prompt=True, fuzzy=True))
+                    scores.extend(raw)
+            # Bracket cells use the abbreviations of every group
+            for name, rounds in (('Sun Collegiate Bracket - Full', _collegiate_rounds),
+                                 ('Sun Community Bracket - Full', _community_rounds)):
+                games = _read_bracket(wb, name, rounds)
+                with mt.timed('conform') as timer:
+                    parsed = list(filter(None, (parse_bracket_12(game, long_conf) for game in games)))
+                    timer.count = 2 * len(parsed)
+                scores.extend(parsed)
+    finally:
+        wb.close()
+    return scores
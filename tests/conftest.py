@@ -0,0 +1,12 @@
+import os
+import sys
+import pytest
+
+# The packages import each other from the repo root, as when run with python -m from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def _workdir(tmp_path, monkeypatch):
+    # The scrapers log (and write their outputs) to the working directory
+    monkeypatch.chdir(tmp_path)
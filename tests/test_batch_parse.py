@@ -0,0 +1,100 @@
+import random
+import pytest
+import usq_site_scraper.batch_parse as bp
+import usq_site_scraper.records as rc
+import usq_site_scraper.scraper as sc
+
+# *****************************************************************************
+# batch_parse.parse_results must accept exactly the rows process_result accepts, with
+# the same values, and reject every row it drops. Rows are fuzzed around the site's
+# own format: signs, underscores and non-ASCII digits, catch markers anywhere, odd
+# whitespace and separators, overtime notes, missing teams and short rows.
+# *****************************************************************************
+
+_SEED = 8
+_ROWS = 10000
+_SPACES = ['', '', '', ' ', '\xa0', '\t', '　', '\n']
+_MARKERS = ['', '', '', '*', '^', '!', '*^', '^!*']
+_SEPARATORS = ['\xa0-\xa0'] * 12 + ['-', ' - ', '\xa0-\xa0\xa0-\xa0', '\xa0*-\xa0', '']
+_NOTES = ['', '', '', '\xa0(OT)', '\xa0(2OT)', ' (SD)', '(OT)', '\xa0', ' 2OT SD', '\n(OT)']
+
+
+def _number(rng):
+    number = str(rng.randrange(0, 300, rng.choice([10, 10, 10, 1])))
+    roll = rng.random()
+    if roll < 0.03:
+        number = rng.choice(['+', '-']) + number
+    elif roll < 0.05 and len(number) > 1:
+        number = number[0] + rng.choice(['_', '__', ' ']) + number[1:]
+    elif roll < 0.07:
+        number = number.translate(str.maketrans('0123456789', '٠١٢٣٤٥٦٧٨٩'))
+    elif roll < 0.08:
+        number = rng.choice(['', 'x', '1.5', '10_'])
+    return number
+
+
+def _side(rng):
+    side = rng.choice(_SPACES) + _number(rng) + rng.choice(_SPACES)
+    markers = rng.choice(_MARKERS)
+    if rng.random() < 0.8:
+        return side + markers
+    at = rng.randrange(len(side) + 1)
+    return side[:at] + markers + side[at:]
+
+
+def _gametime(rng):
+    parts = [_number(rng) if rng.random() < 0.1 else str(rng.randrange(60)) for _ in range(rng.choice([3] * 9 + [2, 4]))]
+    return ':'.join(parts) + rng.choice(_NOTES)
+
+
+def _row(rng):
+    roll = rng.random()
+    if roll < 0.02:
+        return rng.choice([[], ['10/01/2016'], ['10/01/2016', 'A', '10\xa0-\xa00', 'B', '0:1:2', 'extra']])
+    row = ['10/{:02d}/2016'.format(rng.randrange(1, 29)), rng.choice(['Alpha', 'Beta', '', 'Gamma']),
+           _side(rng) + rng.choice(_SEPARATORS) + _side(rng), rng.choice(['Delta', 'Epsilon', '', 'Zeta']),
+           _gametime(rng)]
+    if roll < 0.05:
+        row[rng.randrange(1, 5)] = rng.choice([None, 7, b'10\xa0-\xa00', 'Forfeit'])
+    return row
+
+
+def _check(rows, results, rejects):
+    expected = [sc.process_result(row) for row in rows]
+    assert sorted(rejects['Row']) == [i for i, values in enumerate(expected) if not values]
+    accepted = [values for values in expected if values]
+    assert len(results) == len(accepted)
+    assert [list(row[1:]) for row in results.itertuples(index=False)] == accepted
+    assert set(rejects['Reason']) <= {'Wrong number of fields', 'Invalid score', 'Forfeit or invalid Team Names',
+                                      'Invalid game time'}
+
+
+@pytest.mark.parametrize('seed', range(_SEED, _SEED + 3))
+def test_fuzzed_rows(seed):
+    rng = random.Random(seed)
+    rows = [_row(rng) for _ in range(_ROWS)]
+    results, rejects = bp.parse_results(rows, 'Fuzz')
+    _check(rows, results, rejects)
+    assert set(results['Tournament']) <= {'Fuzz'}
+    # Both outcomes are exercised
+    assert len(results) > _ROWS // 4 and len(rejects) > _ROWS // 20
+
+
+def test_tournaments_and_frames():
+    rng = random.Random(_SEED)
+    rows = [_row(rng) for _ in range(500)]
+    names = ['T{}'.format(i % 3) for i in range(len(rows))]
+    results, rejects = bp.parse_results(rows, names)
+    _check(rows, results, rejects)
+    assert list(rejects['Tournament']) == [names[i] for i in rejects['Row']]
+    full = [row for row in rows if len(row) == 5]
+    frame = bp.pd.DataFrame(full, columns=bp._RAW_COLUMNS).assign(Tournament='Framed')
+    framed, framed_rejects = bp.parse_results(frame)
+    _check(full, framed, framed_rejects)
+    assert set(framed['Tournament']) <= {'Framed'}
+
+
+def test_empty():
+    results, rejects = bp.parse_results([], 'Empty')
+    assert list(results.columns) == rc._COLUMNS and results.empty
+    assert list(rejects.columns) == bp._REJECT_COLUMNS and rejects.empty
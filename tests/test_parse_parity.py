@@ -0,0 +1,64 @@
+import pytest
+import benchmarks.fixtures as fx
+import usq_site_scraper.scraper as sc
+
+# *****************************************************************************
+# parse_tournament(fast=True) (lxml) must read every page exactly as the soup parser
+# (fast=False) does: the fixture tournament pages, and variations of the small one with
+# markup the site has served or could serve.
+# *****************************************************************************
+
+pytestmark = pytest.mark.filterwarnings('ignore::DeprecationWarning', 'ignore::bs4.XMLParsedAsHTMLWarning')
+
+_FIXTURES = ['tournament_small.html', 'tournament_medium.html', 'tournament_large.html']
+_TRAILING_TABLE = '<table class="sponsors"><tr><td>Sponsor</td><td>Link</td></tr></table>'
+_VARIATIONS = {
+    'class_lists': lambda page: page.replace('class="roster"', 'class="table roster striped"')
+                                    .replace('class="results"', 'class="table results"')
+                                    .replace('class="team"', 'class="team clearfix"'),
+    'comments': lambda page: page.replace('<tbody>', '<tbody><!-- <tr><td>Ghost</td></tr> -->')
+                                 .replace('</td><td>', '</td><!-- cell --><td>')
+                                 .replace('<h3>', '<h3><!-- team -->'),
+    'inline_tags': lambda page: page.replace('<td>Player ', '<td><b>Player</b> ')
+                                    .replace('<td>Forfeit', '<td><span class="note">Forfeit</span>')
+                                    .replace('target="_BLANK">', 'target="_BLANK"><strong>')
+                                    .replace('</a></h3>', '</strong></a></h3>'),
+    'missing_title': lambda page: page.replace('<title>Fixture Classic | US Quidditch</title>', ''),
+    'empty_title': lambda page: page.replace('Fixture Classic | US Quidditch', ''),
+    'xml_declaration': lambda page: '<?xml version="1.0" encoding="UTF-8"?>\n' + page,
+    'doctype': lambda page: '<!DOCTYPE html>\n' + page,
+    'trailing_table': lambda page: page.replace('</div></body>', _TRAILING_TABLE + '</div></body>'),
+    'no_results': lambda page: page[:page.index('<table class="results">')] + '</div></body></html>',
+}
+
+
+def _read(name):
+    with open(fx.fixture_path(name), encoding='utf-8') as fp:
+        return fp.read()
+
+
+def _parsed(url, html, fast):
+    result = sc.parse_tournament(url, html=html, fast=fast)
+    if not result:
+        return result
+    return {'Tournament': result['Tournament'], 'Rosters': result['Rosters'],
+            'Scores': [record.to_list() for record in result['Scores']]}
+
+
+def _assert_parity(url, html):
+    fast, soup = _parsed(url, html, True), _parsed(url, html, False)
+    assert fast == soup
+    return fast
+
+
+@pytest.mark.parametrize('name', _FIXTURES)
+def test_fixture_pages(name):
+    parsed = _assert_parity(fx.SOURCES[name], _read(name))
+    assert parsed['Rosters'] and parsed['Scores']
+
+
+@pytest.mark.parametrize('variation', sorted(_VARIATIONS))
+def test_markup_variations(variation):
+    html = _VARIATIONS[variation](_read('tournament_small.html'))
+    assert html != _read('tournament_small.html')
+    _assert_parity(fx.SOURCES['tournament_small.html'], html)
@@ -0,0 +1,57 @@
+import usq_site_scraper.records as rc
+import usq_site_scraper.roster_index as rx
+import usq_site_scraper.writers as wr
+
+# *****************************************************************************
+# Tournament names recur from season to season: every edition of a recurring name must
+# file its rosters under its own season, whether the index is built while scraping
+# (add), from a finished run's outputs (from_outputs) or read back from disk (load).
+# *****************************************************************************
+
+_EDITIONS = [('https://example.org/events/view/classic-2015', '10/01/2015', {'P1', 'P2'}),
+             ('https://example.org/events/view/classic-2017', '10/01/2017', {'P2', 'P3'})]
+
+
+def _rosters(players):
+    return {'Team A': [{'Classic': {'Coach': ['C'], 'Players': sorted(players)}}]}
+
+
+def _game(date):
+    return rc.GameRecord('Classic', date, 'Team A', 100, False, False, False, 'Team B', 50,
+                         False, False, False, 0, 900)
+
+
+def _check(index):
+    assert sorted(index.player('P2')) == [('Team A', 'Classic', '2015-2016', 'Player'),
+                                          ('Team A', 'Classic', '2017-2018', 'Player')]
+    assert index.player('P3') == [('Team A', 'Classic', '2017-2018', 'Player')]
+    team = index.team('Team A')
+    assert sorted(team) == ['2015-2016', '2017-2018']
+    assert team['2015-2016'] == {'Players': ['P1', 'P2'], 'Coach': ['C']}
+    assert team['2017-2018'] == {'Players': ['P2', 'P3'], 'Coach': ['C']}
+    assert index.team('Team A', '2017-2018') == {'2017-2018': team['2017-2018']}
+
+
+def test_recurring_tournament_added_while_scraping(tmp_path):
+    index = rx.RosterIndex()
+    for _, date, players in _EDITIONS:
+        index.add(_rosters(players), {'Classic': date})
+    _check(index)
+    index.save(str(tmp_path / 'index'))
+    _check(rx.RosterIndex.load(str(tmp_path / 'index')))
+
+
+def test_recurring_tournament_from_outputs(tmp_path):
+    scores_file, rosters_file, sources_file = [str(tmp_path / name) for name in
+                                               ('scores.csv', 'rosters.json', 'sources.json')]
+    sources = wr.Sources()
+    with wr.ScoreWriter(scores_file) as scores, wr.RosterWriter(rosters_file) as rosters:
+        for url, date, players in _EDITIONS:
+            scores.write([_game(date)])
+            rosters.write('Classic', _rosters(players))
+            sources.add(url, 1, _rosters(players))
+    sources.save(sources_file)
+    _check(rx.RosterIndex.from_outputs(rosters_file, scores_file, sources_file))
+    # Without urls the editions cannot be told apart and share the first one's season
+    legacy = rx.RosterIndex.from_outputs(rosters_file, scores_file, None)
+    assert sorted(legacy.team('Team A')) == ['2015-2016']
@@ -0,0 +1,377 @@
+import argparse
+import asyncio
+import csv
+import datetime as dt
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import fetching.scheduler as sch
+import usq_site_scraper.scraper as sc
+import usq_site_scraper.writers as wr
+import usq_site_scraper.logs as lg
+import usq_site_scraper.metrics as mt
+
+# *****************************************************************************
+# Non-interactive backfill of a date range, split into one shard per calendar month.
+# Shards are claimed through lease files in a shared work directory, so the same
+# command can run in several local processes and on any number of nodes at once:
+#     python -m usq_site_scraper.backfill run --workdir /shared/bf --start 2013-06 --processes 4
+#     python -m usq_site_scraper.backfill retry --workdir /shared/bf
+#     python -m usq_site_scraper.backfill merge --workdir /shared/bf
+# ----------------- plan.json               the months of the range, written once
+# ----------------- leases/<YYYYMM>.lease    owner and expiry of a running shard; renewed
+#                                           while it runs and taken over once it expires
+# ----------------- shards/<YYYYMM>/         scores.csv, rosters.jsonl/json, tournaments.json,
+#                                           metrics.json and dead_letters.jsonl of the month
+# ----------------- status/<YYYYMM>.json     done or failed (with the error), written last
+# Each process keeps one browser open across the shards it claims (launched for the
+# first month that is not in the response cache).
+# A shard fails when its month cannot be rendered, it raises, or a tournament is
+# dead-lettered; retry reruns only the failed shards. merge joins the done shards in
+# month order, keeping every tournament url from the first month that listed it.
+# *****************************************************************************
+
+_WORKDIR = 'backfill'
+_FIRST_MONTH = '2013-06'
+_LEASE_TTL = 1800
+_PLAN_FILE = 'plan.json'
+_DONE = 'done'
+_FAILED = 'failed'
+_RUNNING = 'running'
+_PENDING = 'pending'
+
+
+def _write_json(path, data):
+    # Write then rename, so other nodes never read a half written file
+    tmp = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    with open(tmp, 'w') as fp:
+        json.dump(data, fp, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return default
+
+
+def _owner():
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+class _Lease:
+    # Exclusive claim on one shard. The file is created with O_EXCL, renewed from a
+    # background thread while held, and may be taken over by anyone once it expires.
+    def __init__(self, workdir, slug, owner, ttl=_LEASE_TTL):
+        self.path = os.path.join(workdir, 'leases', slug + '.lease')
+        self.owner = owner
+        self.ttl = ttl
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _content(self):
+        return {'owner': self.owner, 'expires': time.time() + self.ttl}
+
+    def _expired(self, lease):
+        # A lease that cannot be read yet is being written; it counts from its mtime
+        try:
+            expires = lease['expires'] if lease else os.path.getmtime(self.path) + self.ttl
+        except OSError:
+            return True
+        return expires <= time.time()
+
+    def acquire(self) -> bool:
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            lease = _read_json(self.path)
+            if not self._expired(lease):
+                return False
+            # Only the node whose rename succeeds takes an expired lease over. If the file
+            # it moved aside is not the one it judged expired, another node got there
+            # first; the file is linked back (link never overwrites) and the claim dropped.
+            stale = '{}.{}.stale'.format(self.path, uuid.uuid4().hex)
+            try:
+                os.rename(self.path, stale)
+            except FileNotFoundError:
+                return False
+            if _read_json(stale) != lease:
+                try:
+                    os.link(stale, self.path)
+                except OSError:
+                    pass
+                os.remove(stale)
+                return False
+            os.remove(stale)
+            return self.acquire()
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(self._content(), fp)
+        self._thread = threading.Thread(target=self._renew, daemon=True)
+        self._thread.start()
+        return True
+
+    def held(self) -> bool:
+        lease = _read_json(self.path)
+        return not self.lost and bool(lease) and lease.get('owner') == self.owner
+
+    def _renew(self):
+        while not self._stop.wait(self.ttl / 3):
+            if not self.held():
+                self.lost = True
+                return
+            _write_json(self.path, self._content())
+
+    def release(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self.held():
+            os.remove(self.path)
+
+
+def plan(workdir, start=_FIRST_MONTH, end=None):
+    # Month slugs of the range (YYYY-MM, checked like the interactive scraper's input).
+    # A work directory keeps the range it was first planned with.
+    end = end if end else dt.date.today().strftime('%Y-%m')
+    positions = sc.process_input(start, end)
+    if not positions:
+        raise ValueError('Invalid backfill range {} .. {}'.format(start, end))
+    slugs = sc._month_slugs(*positions)
+    for name in ('leases', 'shards', 'status'):
+        os.makedirs(os.path.join(workdir, name), exist_ok=True)
+    existing = _read_json(os.path.join(workdir, _PLAN_FILE))
+    if existing is None:
+        _write_json(os.path.join(workdir, _PLAN_FILE), {'start': start, 'end': end, 'shards': slugs})
+        return slugs
+    if existing['shards'] != slugs:
+        raise ValueError('{} was planned for {} .. {}'.format(workdir, existing['start'], existing['end']))
+    return existing['shards']
+
+
+def shard_states(workdir) -> dict:
+    # slug -> done, failed, running (unexpired lease) or pending, in month order
+    states = {}
+    for slug in _read_json(os.path.join(workdir, _PLAN_FILE), {}).get('shards', []):
+        status = _read_json(os.path.join(workdir, 'status', slug + '.json'))
+        lease = _Lease(workdir, slug, None)
+        if status:
+            states[slug] = status['state']
+        elif os.path.exists(lease.path) and not lease._expired(_read_json(lease.path)):
+            states[slug] = _RUNNING
+        else:
+            states[slug] = _PENDING
+    return states
+
+
+def run_shard(workdir, slug, lease, workers=sc._HTTP_WORKERS, pages=sc._BROWSER_PAGES, parsers=0,
+              browser=None) -> dict:
+    # Scrapes one month into shards/<slug>. Output goes to a scratch directory that only
+    # replaces the shard once it is complete; nothing is kept if the lease was lost.
+    # browser: a sc.BrowserPool shared by the shards of this process
+    out = os.path.join(workdir, 'shards', slug)
+    scratch = '{}.{}.tmp'.format(out, uuid.uuid4().hex)
+    status_path = os.path.join(workdir, 'status', slug + '.json')
+    attempts = _read_json(status_path, {}).get('attempts', 0) + 1
+    status = {'owner': lease.owner, 'attempts': attempts, 'started': dt.datetime.now().isoformat()}
+    start = time.perf_counter()
+    metrics = mt.configure()
+    scheduler = sch.get_scheduler()
+    os.makedirs(scratch)
+    try:
+        events = sc.get_month_events([slug], pages, browser)[slug]
+        if events is None:
+            if browser:
+                # The next shard launches a fresh browser, in case this one is what failed
+                asyncio.get_event_loop().run_until_complete(browser.close())
+            raise Exception('Calendar month {} could not be read'.format(slug))
+        tournaments = []
+        with wr.ScoreWriter(os.path.join(scratch, 'scores.csv')) as scores, \
+                wr.RosterWriter(os.path.join(scratch, 'rosters.json')) as rosters:
+            for url, val in sc.iter_parsed_tournaments(list(dict.fromkeys(events)), workers, parsers=parsers):
+                if sc._check_tournament(url, val):
+                    with mt.timed('store', count=len(val['Scores'])):
+                        scores.write(val['Scores'])
+                        rosters.write(val['Tournament'], val['Rosters'])
+                    tournaments.append({'url': url, 'tournament': val['Tournament'], 'games': len(val['Scores'])})
+        _write_json(os.path.join(scratch, 'tournaments.json'), tournaments)
+        dead = scheduler.save_dead_letters(os.path.join(scratch, 'dead_letters.jsonl'))
+        status.update(tournaments=len(tournaments), games=sum(t['games'] for t in tournaments), dead_letters=dead)
+        if dead:
+            status.update(state=_FAILED, error='{} urls failed every retry'.format(dead))
+        else:
+            status.update(state=_DONE)
+    except Exception as e:
+        sc._log_exception(e, 'running backfill shard', slug)
+        scheduler.save_dead_letters(os.path.join(scratch, 'dead_letters.jsonl'))
+        status.update(state=_FAILED, error='{}: {}'.format(type(e).__name__, e))
+    metrics.write_report(os.path.join(scratch, 'metrics.json'))
+    if not lease.held():
+        shutil.rmtree(scratch, ignore_errors=True)
+        return None
+    shutil.rmtree(out, ignore_errors=True)
+    os.rename(scratch, out)
+    status.update(seconds=round(time.perf_counter() - start, 3), finished=time.time())
+    _write_json(status_path, status)
+    sc._log_progress('{}: backfill shard {} ({} tournaments)'.format(
+        'SUCCESS' if status['state'] == _DONE else 'FAILURE', slug, status.get('tournaments', 0)),
+        'running backfill shard', slug)
+    return status
+
+
+def work(workdir, workers=sc._HTTP_WORKERS, pages=sc._BROWSER_PAGES, parsers=0, ttl=_LEASE_TTL,
+         retry_failed=False, shards=None) -> dict:
+    # Claims and runs shards until every one is done, failed or leased by someone else.
+    # With retry_failed, shards that failed before this call started are run once more.
+    # Returns {slug: status} of the shards this process ran.
+    started = time.time()
+    owner = _owner()
+    ran = {}
+    browser = sc.BrowserPool(pages)
+    try:
+        for slug in _read_json(os.path.join(workdir, _PLAN_FILE))['shards']:
+            if shards and slug not in shards:
+                continue
+            lease = _Lease(workdir, slug, owner, ttl)
+            if not _runnable(workdir, slug, retry_failed, started) or not lease.acquire():
+                continue
+            try:
+                # It may have finished between the status check and the lease
+                if _runnable(workdir, slug, retry_failed, started):
+                    ran[slug] = run_shard(workdir, slug, lease, workers, pages, parsers, browser)
+            finally:
+                lease.release()
+    finally:
+        asyncio.get_event_loop().run_until_complete(browser.close())
+    return ran
+
+
+def _runnable(workdir, slug, retry_failed, started) -> bool:
+    status = _read_json(os.path.join(workdir, 'status', slug + '.json'))
+    if not status:
+        return True
+    return retry_failed and status['state'] == _FAILED and status.get('finished', 0) < started
+
+
+def _init_worker(remote, base_url, scheduler_options):
+    lg.log_to(remote)
+    sc.set_base_url(base_url)
+    sch.configure(**scheduler_options)
+
+
+def run(workdir, processes=1, workers=sc._HTTP_WORKERS, pages=sc._BROWSER_PAGES, parsers=0, ttl=_LEASE_TTL,
+        retry_failed=False, shards=None, scheduler_options=None) -> dict:
+    # work() in this process, or in that many spawned processes sharing the work directory
+    scheduler_options = scheduler_options if scheduler_options else {}
+    if processes <= 1:
+        sch.configure(**scheduler_options)
+        return work(workdir, workers, pages, parsers, ttl, retry_failed, shards)
+    context = multiprocessing.get_context('spawn')
+    remote = context.Queue()
+    receiver = lg.receive(remote)
+    ran = {}
+    try:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker,
+                                 initargs=(remote, sc._BASE_URL, scheduler_options)) as pool:
+            futures = [pool.submit(work, workdir, workers, pages, parsers, ttl, retry_failed, shards)
+                       for _ in range(processes)]
+            for future in futures:
+                ran.update(future.result())
+    finally:
+        receiver.stop()
+    return ran
+
+
+def merge(workdir, scores_file='scores.csv', rosters_file='rosters.json', partial=False,
+          sources_file=wr._SOURCES_FILE) -> dict:
+    # One scores.csv/rosters.json from the done shards, in month order and then in the
+    # order each month listed its tournaments. A tournament url listed by several months
+    # (events spanning a month boundary) is only taken from the first of them. sources_file
+    # records the url of every row for later incremental upserts.
+    states = shard_states(workdir)
+    missing = [slug for slug, state in states.items() if state != _DONE]
+    if missing and not partial:
+        raise ValueError('{} shards are not done: {}'.format(len(missing), ', '.join(missing)))
+    seen = set()
+    sources = wr.Sources()
+    lines_path = rosters_file + '.lines.tmp'
+    with wr.ScoreWriter(scores_file) as scores, open(lines_path, 'w') as lines:
+        for slug, state in states.items():
+            if state != _DONE:
+                continue
+            shard = os.path.join(workdir, 'shards', slug)
+            # A shard's score rows and roster lines come in the order of its tournament list,
+            # so they are matched to their url by position, not by the (not unique) name
+            roster_lines = wr.iter_roster_lines(os.path.join(shard, 'rosters.jsonl'))
+            with open(os.path.join(shard, 'scores.csv'), newline='') as fp:
+                reader = csv.reader(fp)
+                next(reader, None)
+                for tournament in _read_json(os.path.join(shard, 'tournaments.json'), []):
+                    rows = [row[1:] for row in itertools.islice(reader, tournament['games'])]
+                    record = next(roster_lines)
+                    if tournament['url'] in seen:
+                        continue
+                    seen.add(tournament['url'])
+                    scores.write(rows)
+                    lines.write(json.dumps(record) + '\n')
+                    sources.add(tournament['url'], len(rows), record['Rosters'])
+    wr.consolidate_rosters(lines_path, rosters_file)
+    os.remove(lines_path)
+    sources.save(sources_file)
+    return {'shards': len(states) - len(missing), 'tournaments': len(seen), 'games': scores.rows}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='plan the range and run every shard that is not done')
+    retry_parser = commands.add_parser('retry', help='run the failed shards (or --shards) again')
+    for command in (run_parser, retry_parser):
+        command.add_argument('--workdir', default=_WORKDIR, help='work directory shared by every node')
+        command.add_argument('--processes', type=int, default=1, help='local processes claiming shards')
+        command.add_argument('--shards', nargs='*', metavar='YYYYMM', help='only these months')
+        command.add_argument('--workers', type=int, default=sc._HTTP_WORKERS, help='concurrent fetches per process')
+        command.add_argument('--pages', type=int, default=sc._BROWSER_PAGES, help='browser pages per process')
+        command.add_argument('--parsers', type=int, default=0, help='parser processes per shard process')
+        command.add_argument('--lease-ttl', type=float, default=_LEASE_TTL,
+                             help='seconds before the shard of a node that stopped renewing is taken over')
+        command.add_argument('--base-url', help='scrape this copy of the USQ site instead')
+        command.add_argument('--rate', type=float, default=sch._RATE, help='requests per second per host and process')
+        command.add_argument('--max-concurrency', type=int, default=sch._MAX_CONCURRENCY)
+    run_parser.add_argument('--start', default=_FIRST_MONTH, help='first month, YYYY-MM')
+    run_parser.add_argument('--end', help='last month, YYYY-MM (default: this month)')
+    merge_parser = commands.add_parser('merge', help='join the done shards into one output')
+    merge_parser.add_argument('--workdir', default=_WORKDIR)
+    merge_parser.add_argument('--scores', default='scores.csv')
+    merge_parser.add_argument('--rosters', default='rosters.json')
+    merge_parser.add_argument('--sources', default=wr._SOURCES_FILE)
+    merge_parser.add_argument('--partial', action='store_true', help='merge even if some shards are not done')
+    status_parser = commands.add_parser('status', help='print the state of every shard')
+    status_parser.add_argument('--workdir', default=_WORKDIR)
+    args = parser.parse_args()
+    if args.command in ('run', 'retry'):
+        if args.base_url:
+            sc.set_base_url(args.base_url)
+        if args.command == 'run':
+            plan(args.workdir, args.start, args.end)
+        ran = run(args.workdir, args.processes, args.workers, args.pages, args.parsers, args.lease_ttl,
+                  args.command == 'retry', args.shards,
+                  {'rate': args.rate, 'burst': max(1, int(args.rate)), 'max_concurrency': args.max_concurrency})
+        failed = sorted(slug for slug, status in ran.items() if status and status['state'] == _FAILED)
+        print('Ran {} shards, {} failed{}'.format(len(ran), len(failed), ': ' + ', '.join(failed) if failed else ''))
+    elif args.command == 'merge':
+        print(json.dumps(merge(args.workdir, args.scores, args.rosters, args.partial, args.sources)))
+    else:
+        states = shard_states(args.workdir)
+        for slug, state in states.items():
+            error = _read_json(os.path.join(args.workdir, 'status', slug + '.json'), {}).get('error')
+            print('{} {}{}'.format(slug, state, ' ({})'.format(error) if error else ''))
@@ -0,0 +1,104 @@
+import itertools
+import re
+import numpy as np
+import pandas as pd
+import usq_site_scraper.records as rc
+
+# *****************************************************************************
+# Batch counterpart of scraper.process_result / process_score.
+# parse_results takes every raw score row of a tournament (or a whole season)
+# and returns a typed results table plus a rejects table with the reason each
+# row was dropped, instead of logging row by row.
+# Every row is read in one pass with precompiled patterns (the score, and the
+# game time) into plain tuples, so pandas only builds the two finished tables.
+# *****************************************************************************
+
+_RAW_COLUMNS = ['Date', 'Team_1', 'Score', 'Team_2', 'Gametime']
+_REJECT_COLUMNS = ['Tournament', 'Row', *_RAW_COLUMNS, 'Reason']
+_FLAG_COLUMNS = ['*1', '^1', '!1', '*2', '^2', '!2']
+_CATCH_MARKERS = ['*', '^', '!']
+_SCORE_SEPARATOR = '\xa0-\xa0'
+_DTYPES = {'Winning_Score': 'int64', 'Losing_Score': 'int64', 'OTS': 'int8', 'Gametime': 'int64',
+           **{c: bool for c in _FLAG_COLUMNS}}
+_NO_MARKERS = str.maketrans('', '', ''.join(_CATCH_MARKERS))
+# A signed integer as int() reads it
+_NUMBER = r'[+-]?\d+(?:_\d+)*'
+# A score as the site writes it, catch markers after each number; any other score goes
+# through _score, which reads it the way process_score does
+_SCORE_RE = re.compile(r'(\d+)([*^!]*){0}(\d+)([*^!]*)'.format(_SCORE_SEPARATOR))
+# One side of a score once its catch markers are dropped
+_SIDE_RE = re.compile(r'\s*({0})\s*'.format(_NUMBER))
+# H:M:S up to the first whitespace, then optionally an overtime note (OT, 2OT or SD);
+# the parts are read with int() as process_result does
+_GAMETIME_RE = re.compile(r'([^:\s]*):([^:\s]*):([^:\s]*)(\s[\s\S]*)?')
+
+
+def _frame(records, columns, dtypes):
+    # Records transposed into typed columns once, after the pass. Text columns stay object
+    # dtype rather than going through pandas' string inference.
+    values = zip(*records) if records else [()] * len(columns)
+    with pd.option_context('future.infer_string', False):
+        return pd.DataFrame({column: np.array(value, dtype=dtypes.get(column, object))
+                             for column, value in zip(columns, values)}, copy=False)
+
+
+def _raw_rows(rows, tournament):
+    # (tournament, row) per raw row
+    if isinstance(rows, pd.DataFrame):
+        names = rows['Tournament'] if 'Tournament' in rows else [tournament] * len(rows)
+        return zip(names, zip(*[rows[column].tolist() for column in _RAW_COLUMNS]))
+    if isinstance(tournament, list):
+        return zip(tournament, rows)
+    return zip(itertools.repeat(tournament), rows)
+
+
+def _score(score):
+    # (side 1, side 2, score 1, score 2) of a score process_score accepts, else None
+    sides = score.split(_SCORE_SEPARATOR) if isinstance(score, str) else ()
+    if len(sides) != 2:
+        return None
+    match1 = _SIDE_RE.fullmatch(sides[0].translate(_NO_MARKERS))
+    match2 = _SIDE_RE.fullmatch(sides[1].translate(_NO_MARKERS))
+    if not (match1 and match2):
+        return None
+    return sides[0], sides[1], int(match1[1]), int(match2[1])
+
+
+def parse_results(rows, tournament=None):
+    # rows: an iterable of [date, team1, score, team2, gametime] rows, or a DataFrame
+    # with those _RAW_COLUMNS (and optionally a Tournament column). tournament is one
+    # name for every row or a list aligned with rows.
+    accepted, rejected = [], []
+    for i, (name, row) in enumerate(_raw_rows(rows, tournament)):
+        try:
+            date, team1, score, team2, gtime = row
+        except (TypeError, ValueError):
+            rejected.append((name, i, None, None, None, None, None, 'Wrong number of fields'))
+            continue
+        match = _SCORE_RE.fullmatch(score) if isinstance(score, str) else None
+        if match:
+            score1, side1, score2, side2 = match.groups()
+            score1, score2 = int(score1), int(score2)
+        else:
+            scores = _score(score)
+            if scores is None:
+                rejected.append((name, i, *row, 'Invalid score'))
+                continue
+            side1, side2, score1, score2 = scores
+        if not (team1 and team2):
+            rejected.append((name, i, *row, 'Forfeit or invalid Team Names'))
+            continue
+        clock = _GAMETIME_RE.fullmatch(gtime) if isinstance(gtime, str) else None
+        try:
+            hours, minutes, seconds, overtime = clock.groups()
+            seconds = int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+        except (AttributeError, ValueError):
+            rejected.append((name, i, *row, 'Invalid game time'))
+            continue
+        if score1 <= score2:
+            team1, side1, score1, team2, side2, score2 = team2, side2, score2, team1, side1, score1
+        ots = (2 if '2OT' in gtime or 'SD' in gtime else 1) if overtime else 0
+        accepted.append((name, date, team1, score1, '*' in side1, '^' in side1, '!' in side1,
+                         team2, score2, '*' in side2, '^' in side2, '!' in side2, ots, seconds))
+
+    return _frame(accepted, rc._COLUMNS, _DTYPES), _frame(rejected, _REJECT_COLUMNS, {'Row': 'int64'})
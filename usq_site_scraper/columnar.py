@@ -0,0 +1,112 @@
+import json
+import pandas as pd
+import usq_site_scraper.records as rc
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# *****************************************************************************
+# Typed columnar (Parquet) output for scores and rosters. Needs pyarrow.
+# ----------------- scores:   team/tournament names dictionary encoded, catch flags
+#                             as bit-packed booleans, Date as a timestamp and
+#                             Gametime as a duration, partitioned by Season
+# ----------------- rosters:  one row per player (or coach), team and tournament
+# *****************************************************************************
+
+_FLAGS = ['*1', '^1', '!1', '*2', '^2', '!2']
+_NAMES = pa.dictionary(pa.int32(), pa.string()) if pa else None
+_SCORE_SCHEMA = pa.schema([('Tournament', _NAMES), ('Date', pa.timestamp('s')),
+                           ('Winner', _NAMES), ('Winning_Score', pa.int16()),
+                           ('*1', pa.bool_()), ('^1', pa.bool_()), ('!1', pa.bool_()),
+                           ('Loser', _NAMES), ('Losing_Score', pa.int16()),
+                           ('*2', pa.bool_()), ('^2', pa.bool_()), ('!2', pa.bool_()),
+                           ('OTS', pa.int8()), ('Gametime', pa.duration('s')),
+                           ('Season', pa.string())]) if pa else None
+_ROSTER_SCHEMA = pa.schema([('Player', _NAMES), ('Team', _NAMES), ('Tournament', _NAMES),
+                            ('Role', _NAMES)]) if pa else None
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow is required for columnar output')
+
+
+def scores_table(scores):
+    # scores: a records.GameBatch, a DataFrame with the _COLUMNS schema or an iterable of score rows
+    _require_pyarrow()
+    if isinstance(scores, rc.GameBatch):
+        table = scores.to_arrow()
+        seasons = table.column('Date').to_pandas().map(rc.season_of)
+        return table.append_column(_SCORE_SCHEMA.field('Season'), pa.array(seasons, type=pa.string()))
+    df = scores if isinstance(scores, pd.DataFrame) else pd.DataFrame(list(scores), columns=rc._COLUMNS)
+    dates = pd.to_datetime(df['Date'], errors='coerce', format='mixed')
+    columns = {
+        'Tournament': df['Tournament'],
+        'Date': dates,
+        'Winner': df['Winner'],
+        'Winning_Score': pd.to_numeric(df['Winning_Score'], errors='coerce').astype('Int16'),
+        'Loser': df['Loser'],
+        'Losing_Score': pd.to_numeric(df['Losing_Score'], errors='coerce').astype('Int16'),
+        'OTS': pd.to_numeric(df['OTS'], errors='coerce').astype('Int8'),
+        'Gametime': pd.to_numeric(df['Gametime'], errors='coerce').astype('Int64'),
+        'Season': dates.map(rc.season_of),
+    }
+    for flag in _FLAGS:
+        columns[flag] = df[flag].astype(str).str.upper().isin(['TRUE', '1'])
+    arrays = [pa.array(columns[field.name], type=field.type.value_type, from_pandas=True).dictionary_encode()
+              if pa.types.is_dictionary(field.type) else
+              pa.array(columns[field.name], type=field.type, from_pandas=True) for field in _SCORE_SCHEMA]
+    return pa.Table.from_arrays(arrays, schema=_SCORE_SCHEMA)
+
+
+def _roster_rows(team, entries):
+    # Roster entries are {tournament: roster} dicts, possibly nested in lists
+    for entry in entries:
+        if isinstance(entry, list):
+            yield from _roster_rows(team, entry)
+        else:
+            for tournament, roster in entry.items():
+                for coach in roster.get('Coach', []):
+                    yield coach, team, tournament, 'Coach'
+                for player in roster.get('Players', []):
+                    yield player, team, tournament, 'Player'
+
+
+def rosters_table(rosters):
+    # rosters: the {team: [{tournament: {'Coach': [...], 'Players': [...]}}]} structure
+    _require_pyarrow()
+    rows = [row for team, entries in rosters.items() for row in _roster_rows(team, entries)]
+    arrays = [pa.array([row[i] for row in rows], type=pa.string()).dictionary_encode()
+              for i in range(len(_ROSTER_SCHEMA))]
+    return pa.Table.from_arrays(arrays, schema=_ROSTER_SCHEMA)
+
+
+def write_scores(scores, root='scores_parquet'):
+    # One directory per season (Season=2015-2016/...); seasons being rewritten are replaced
+    table = scores_table(scores)
+    pq.write_to_dataset(table, root, partition_cols=['Season'], existing_data_behavior='delete_matching')
+    return table.num_rows
+
+
+def write_rosters(rosters, path='rosters.parquet'):
+    table = rosters_table(rosters)
+    pq.write_table(table, path)
+    return table.num_rows
+
+
+def store_columnar(val, scores_root='scores_parquet', rosters_file='rosters.parquet'):
+    # Columnar counterpart of scraper.store_data
+    write_scores(rc.GameBatch.concat(val['Scores']), scores_root)
+    write_rosters(val['Rosters'], rosters_file)
+
+
+def convert_outputs(scores_file='scores.csv', rosters_file='rosters.json',
+                    scores_root='scores_parquet', rosters_parquet='rosters.parquet'):
+    # Converts the csv/json outputs of a finished run
+    write_scores(pd.read_csv(scores_file, index_col=0), scores_root)
+    with open(rosters_file) as fp:
+        write_rosters(json.load(fp), rosters_parquet)
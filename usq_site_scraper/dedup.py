@@ -0,0 +1,240 @@
+import argparse
+import csv
+import datetime as dt
+import json
+import usq_site_scraper.records as rc
+import usq_site_scraper.writers as wr
+
+# *****************************************************************************
+# Cross-source game deduplication. The site scraper, the Wayback World Cup scrapers and
+# the Cup 12 workbook report some of the same games with different timestamps, game
+# times and catch flags; GameIndex merges every source in one pass over its records.
+# ----------------- key:      conformed team pair and their scores (pair in name order, so
+#                             winner/loser orientation does not matter) plus the day
+# ----------------- buckets:  a record probes its own day, then the days around it up to
+#                             `days` away, and joins the first game there that has no record
+#                             from its source yet (rematches with the same score in one
+#                             source stay separate games)
+# ----------------- policy:   {field group: [sources, highest priority first]} picks the
+#                             source each group of a merged game is taken from; sources not
+#                             listed follow in the order they were added, and a missing value
+#                             falls through to the next source
+#     python -m usq_site_scraper.dedup site=scores.csv wc8=wc8.csv --priority gametime=wc8,site
+# *****************************************************************************
+
+_DATE_TOLERANCE = 1
+_GROUPS = ['tournament', 'date', 'catches', 'gametime']
+# Formats of dates read back from csv (the site's own, and str() of parsed datetimes)
+_DATE_FORMATS = ['%m/%d/%Y', '%m/%d/%Y %I:%M %p', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+# Positions in a record's values
+_TOURNAMENT, _DATE, _WINNER, _WINNING_SCORE, _LOSER, _LOSING_SCORE, _GAMETIME = 0, 1, 2, 3, 7, 8, 13
+_FLAGS_1 = slice(4, 7)
+_FLAGS_2 = slice(9, 12)
+_OTS = 12
+
+
+def parse_date(value):
+    # datetime of a record's date (datetimes, dates or strings), None when it has none
+    if value is None or value == '':
+        return None
+    if isinstance(value, dt.datetime):
+        return value
+    if isinstance(value, dt.date):
+        return dt.datetime(value.year, value.month, value.day)
+    value = str(value).strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return dt.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    try:
+        return dt.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def read_scores(path):
+    # GameRecords of a scores csv written by ScoreWriter (or DataFrame.to_csv)
+    with open(path, newline='') as fp:
+        reader = csv.reader(fp)
+        next(reader, None)
+        for row in reader:
+            (tournament, date, winner, winning_score, c1, o1, t1,
+             loser, losing_score, c2, o2, t2, ots, gametime) = row[1:]
+            yield rc.GameRecord(tournament, date or None, winner, int(float(winning_score)),
+                                c1 == 'True', o1 == 'True', t1 == 'True', loser, int(float(losing_score)),
+                                c2 == 'True', o2 == 'True', t2 == 'True', int(float(ots)),
+                                int(float(gametime)) if gametime else None)
+
+
+def _group_value(values, group):
+    if group == 'catches':
+        return values[_FLAGS_1], values[_FLAGS_2], values[_OTS]
+    return values[_TOURNAMENT if group == 'tournament' else _DATE if group == 'date' else _GAMETIME]
+
+
+class GameIndex:
+    # conform: maps a raw team name to its conformed name (e.g. a Conformer's conform);
+    # names it returns None for are kept as they are
+    def __init__(self, policy=None, conform=None, days=_DATE_TOLERANCE):
+        unknown = set(policy if policy else {}) - set(_GROUPS)
+        if unknown:
+            raise ValueError('Unknown field groups {}; expected {}'.format(sorted(unknown), _GROUPS))
+        self.policy = policy if policy else {}
+        self.days = days
+        self.sources = []
+        self.records = 0
+        self._conform = conform
+        self._names = {}
+        self._dates = {}
+        self._index = {}
+        # Per game: [(source, record values, conformed winner, conformed loser)]
+        self._games = []
+
+    def _name(self, raw):
+        name = self._names.get(raw)
+        if name is None:
+            name = self._names[raw] = (self._conform(raw) if self._conform else None) or raw
+        return name
+
+    def _parsed(self, value):
+        try:
+            return self._dates[value]
+        except KeyError:
+            parsed = self._dates[value] = parse_date(value)
+            return parsed
+        except TypeError:
+            return parse_date(value)
+
+    def _find(self, key, day, source):
+        offsets = [0] if day is None else [o for d in range(self.days + 1) for o in ((d, -d) if d else (0,))]
+        for offset in offsets:
+            for game in self._index.get((*key, None if day is None else day + offset), ()):
+                if all(entry[0] != source for entry in self._games[game]):
+                    return game
+        return None
+
+    def add(self, records, source):
+        # records: a GameBatch, GameRecords or 14-element rows. Returns how many joined a known game.
+        if source not in self.sources:
+            self.sources.append(source)
+        joined = 0
+        for record in records:
+            values = rc._values(record) if isinstance(record, rc.GameRecord) else tuple(record)
+            winner, loser = self._name(values[_WINNER]), self._name(values[_LOSER])
+            scores = values[_WINNING_SCORE], values[_LOSING_SCORE]
+            key = (winner, loser, *scores) if winner <= loser else (loser, winner, scores[1], scores[0])
+            date = self._parsed(values[_DATE])
+            day = date.toordinal() if date else None
+            game = self._find(key, day, source)
+            if game is None:
+                game = len(self._games)
+                self._games.append([])
+                self._index.setdefault((*key, day), []).append(game)
+            else:
+                joined += 1
+            self._games[game].append((source, values, winner, loser))
+            self.records += 1
+        return joined
+
+    def __len__(self):
+        return len(self._games)
+
+    def _ranks(self):
+        ranks = {}
+        for group in _GROUPS:
+            listed = list(self.policy.get(group, []))
+            order = listed + [source for source in self.sources if source not in listed]
+            ranks[group] = {source: i for i, source in enumerate(order)}
+        return ranks
+
+    def _pick(self, entries, group, rank):
+        # Highest priority entry with a value for group (the first entry if none has one)
+        best = None
+        for entry in entries:
+            value = _group_value(entry[1], group)
+            if value is None or value == '':
+                continue
+            if best is None or rank.get(entry[0], len(rank)) < rank.get(best[0], len(rank)):
+                best = entry
+        return best if best else entries[0]
+
+    def merged(self):
+        # (GameRecord, sources) per game in the order games were first seen. Teams keep the
+        # first record's winner/loser orientation (it only differs for ties) and catch flags
+        # are swapped when the chosen source has the teams the other way round.
+        ranks = self._ranks()
+        for entries in self._games:
+            _, first, winner, loser = entries[0]
+            values = {}
+            for group in _GROUPS:
+                source, chosen, chosen_winner, _ = self._pick(entries, group, ranks[group])
+                values[group] = _group_value(chosen, group)
+                if group == 'catches' and chosen_winner != winner:
+                    flags1, flags2, ots = values[group]
+                    values[group] = flags2, flags1, ots
+            flags1, flags2, ots = values['catches']
+            record = rc.GameRecord(values['tournament'], values['date'], winner, first[_WINNING_SCORE], *flags1,
+                                   loser, first[_LOSING_SCORE], *flags2, ots, values['gametime'])
+            yield record, tuple(entry[0] for entry in entries)
+
+    def conflicts(self) -> dict:
+        # Merged games whose sources disagree, per field group (dates compared as parsed)
+        counts = dict.fromkeys(_GROUPS, 0)
+        for entries in self._games:
+            if len(entries) < 2:
+                continue
+            for group in _GROUPS:
+                seen = set()
+                for _, values, winner, _ in entries:
+                    value = _group_value(values, group)
+                    if group == 'date':
+                        value = self._parsed(value)
+                    elif group == 'catches' and winner != entries[0][2]:
+                        value = value[1], value[0], value[2]
+                    if value is not None and value != '':
+                        seen.add(value)
+                counts[group] += len(seen) > 1
+        return counts
+
+    def to_batch(self):
+        return rc.GameBatch(record for record, _ in self.merged())
+
+    def stats(self) -> dict:
+        return {'sources': self.sources, 'records': self.records, 'games': len(self._games),
+                'merged': sum(len(entries) > 1 for entries in self._games), 'conflicts': self.conflicts()}
+
+
+def merge_sources(sources, policy=None, conform=None, days=_DATE_TOLERANCE):
+    # sources: {name: records} in default priority order; returns the filled GameIndex
+    index = GameIndex(policy, conform, days)
+    for name, records in sources.items():
+        index.add(records, name)
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sources', nargs='+', metavar='NAME=SCORES_CSV',
+                        help='scores files in default priority order')
+    parser.add_argument('--priority', action='append', default=[], metavar='GROUP=NAME,NAME',
+                        help='source order for one of {}'.format(', '.join(_GROUPS)))
+    parser.add_argument('--days', type=int, default=_DATE_TOLERANCE, help='how many days apart a game may be dated')
+    parser.add_argument('--conformer', metavar='STORE', help='conform team names through this conformer store')
+    parser.add_argument('--output', default='merged_scores.csv')
+    parser.add_argument('--provenance', help='also write the sources of every merged game as JSON lines')
+    args = parser.parse_args()
+    sources = dict(source.split('=', 1) for source in args.sources)
+    policy = {group: names.split(',') for group, names in (p.split('=', 1) for p in args.priority)}
+    conform = None
+    if args.conformer:
+        import conformer.conform as cf
+        conform = cf.Conformer(store=args.conformer).conform
+    index = merge_sources({name: read_scores(path) for name, path in sources.items()}, policy, conform, args.days)
+    merged = list(index.merged())
+    with wr.ScoreWriter(args.output) as scores:
+        scores.write(record for record, _ in merged)
+    if args.provenance:
+        with open(args.provenance, 'w') as fp:
+            fp.writelines(json.dumps({'row': row, 'sources': names}) + '\n' for row, (_, names) in enumerate(merged))
+    print(json.dumps(index.stats()))
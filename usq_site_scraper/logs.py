@@ -0,0 +1,129 @@
+import atexit
+import datetime as dt
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+# *****************************************************************************
+# Non-blocking JSON-lines logging for the scrapers.
+# Callers only put records on a queue; one writer thread formats them, writes
+# them to size-rotated files and flushes whenever the queue runs dry, so a burst
+# of per-row errors costs one write instead of an open/append/close per line.
+# Records carry the stage, url and tournament they were logged for.
+# Worker processes call log_to(queue) and their records are written by the
+# parent's writer (see receive), so only one process ever touches the files.
+# *****************************************************************************
+
+_MAX_BYTES = 16 * 2 ** 20
+_BACKUPS = 5
+_FIELDS = ['stage', 'url', 'tournament', 'error', 'detail']
+_LOCK = threading.Lock()
+_QUEUE = queue.SimpleQueue()
+_LISTENER = None
+_LOGGERS = {}
+_REMOTE = None
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': dt.datetime.fromtimestamp(record.created).isoformat(), 'level': record.levelname}
+        for field in _FIELDS:
+            value = getattr(record, field, None)
+            if value not in (None, ''):
+                entry[field] = value
+        entry['message'] = record.getMessage()
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _JsonLinesFile(logging.handlers.RotatingFileHandler):
+    # Leaves records in the file buffer; the writer thread drains it once the queue is empty
+    def flush(self):
+        pass
+
+    def drain(self):
+        super().flush()
+
+
+class _Router(logging.Handler):
+    # Sends each record to the file of the logger it was logged on
+    def __init__(self):
+        super().__init__()
+        self.files = {}
+
+    def emit(self, record):
+        if record.name not in self.files:
+            # Logged by a worker process on a file this process has not opened yet
+            get_logger(record.name.split(':', 1)[1])
+        self.files[record.name].handle(record)
+
+    def drain(self):
+        for handler in list(self.files.values()):
+            handler.drain()
+
+
+class _Listener(logging.handlers.QueueListener):
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            self.handlers[0].drain()
+
+
+_ROUTER = _Router()
+
+
+def get_logger(path, max_bytes=_MAX_BYTES, backups=_BACKUPS):
+    # One logger per file, all written by the same background thread
+    global _LISTENER
+    logger = _LOGGERS.get(path)
+    if logger is not None and (_LISTENER is not None or _REMOTE is not None):
+        return logger
+    name = 'qscore:{}'.format(path)
+    with _LOCK:
+        logger = logging.getLogger(name)
+        if path not in _LOGGERS:
+            if _REMOTE is None:
+                handler = _JsonLinesFile(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+                handler.setFormatter(_JsonFormatter())
+                _ROUTER.files[name] = handler
+            logger.handlers = [logging.handlers.QueueHandler(_QUEUE if _REMOTE is None else _REMOTE)]
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            _LOGGERS[path] = logger
+        if _LISTENER is None and _REMOTE is None:
+            _LISTENER = _Listener(_QUEUE, _ROUTER)
+            _LISTENER.start()
+    return logger
+
+
+def log_to(remote):
+    # In a worker process: send every record to the parent's writer through remote
+    # (a multiprocessing queue the parent passed to receive) instead of writing files
+    global _REMOTE
+    with _LOCK:
+        _REMOTE = remote
+        for logger in _LOGGERS.values():
+            logger.handlers = [logging.handlers.QueueHandler(remote)]
+
+
+def receive(remote):
+    # In the parent: writes the records worker processes put on remote. Returns the
+    # listener; stop() it once the workers are done.
+    listener = _Listener(remote, _ROUTER)
+    listener.start()
+    return listener
+
+
+def stop():
+    # Writes out everything queued so far and closes the files; the next get_logger restarts the writer
+    global _LISTENER
+    with _LOCK:
+        if _LISTENER is not None:
+            _LISTENER.stop()
+            _LISTENER = None
+        for handler in _ROUTER.files.values():
+            handler.close()
+
+
+atexit.register(stop)
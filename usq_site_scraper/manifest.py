@@ -0,0 +1,47 @@
+import datetime as dt
+import json
+import os
+
+# *****************************************************************************
+# Manifest of what previous runs already scraped, used by incremental runs.
+# ----------------- months:       calendar slug -> event urls found in that month
+# ----------------- tournaments:  url -> content digest, validators and name of the
+#                                 version whose rows are in the outputs
+# *****************************************************************************
+
+_MANIFEST_FILE = 'manifest.json'
+
+
+class Manifest:
+    def __init__(self, path=_MANIFEST_FILE):
+        self.path = path
+        self.months = {}
+        self.tournaments = {}
+        if os.path.exists(path):
+            with open(path) as fp:
+                data = json.load(fp)
+            self.months = data.get('months', {})
+            self.tournaments = data.get('tournaments', {})
+
+    def has_month(self, slug):
+        return slug in self.months
+
+    def month_urls(self, slug):
+        return self.months[slug]['urls'] if slug in self.months else []
+
+    def mark_month(self, slug, urls):
+        self.months[slug] = {'urls': list(urls), 'rendered': dt.datetime.now().isoformat()}
+
+    def tournament(self, url):
+        return self.tournaments.get(url)
+
+    def mark_tournament(self, url, name, digest, etag=None, last_modified=None):
+        self.tournaments[url] = {'name': name, 'digest': digest, 'etag': etag,
+                                 'last_modified': last_modified, 'fetched': dt.datetime.now().isoformat()}
+
+    def save(self):
+        # Write then rename so an interrupted run never leaves a truncated manifest
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump({'months': self.months, 'tournaments': self.tournaments}, fp, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
@@ -0,0 +1,208 @@
+import bisect
+import cProfile
+import datetime as dt
+import heapq
+import itertools
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+
+# *****************************************************************************
+# Per-stage run metrics: for every stage (render, http, parse, rosters, scores,
+# conform, store) a count, total/max latency, a latency histogram and the bytes
+# handled, written as one JSON report at the end of a run.
+# With profiling switched on, tournaments are run under cProfile and tracemalloc
+# one at a time and the slowest ones keep their top functions and allocations.
+# *****************************************************************************
+
+_REPORT_FILE = 'metrics.json'
+# Histogram bucket upper bounds in seconds; the last bucket is everything slower
+_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60]
+_PROFILE_FUNCTIONS = 25
+_PROFILE_ALLOCATIONS = 10
+_METRICS = None
+
+
+class _Stage:
+    __slots__ = ['count', 'calls', 'seconds', 'max', 'bytes', 'buckets']
+
+    def __init__(self):
+        self.count = 0
+        self.calls = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.buckets = [0] * (len(_BUCKETS) + 1)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th call (None past the last bound)
+        rank, seen = q * self.calls, 0
+        for bound, n in zip(_BUCKETS + [None], self.buckets):
+            seen += n
+            if seen >= rank:
+                return bound
+        return None
+
+    def summary(self):
+        return {'count': self.count, 'calls': self.calls, 'seconds': round(self.seconds, 6),
+                'mean': round(self.seconds / self.calls, 6) if self.calls else None, 'max': round(self.max, 6),
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+                'bytes': self.bytes,
+                'histogram': {('le_{}'.format(b) if b is not None else 'inf'): n
+                              for b, n in zip(_BUCKETS + [None], self.buckets) if n}}
+
+
+class _Timer:
+    # with metrics.timed(stage) as t: ...; t.bytes / t.count may be set inside the block
+    __slots__ = ['metrics', 'stage', 'bytes', 'count', 'start']
+
+    def __init__(self, metrics, stage, nbytes, count):
+        self.metrics = metrics
+        self.stage = stage
+        self.bytes = nbytes
+        self.count = count
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.stage, time.perf_counter() - self.start, self.bytes, self.count)
+
+
+class _Profiled:
+    def __init__(self, metrics, label):
+        self.metrics = metrics
+        self.label = label
+        self.profiler = None
+
+    def __enter__(self):
+        # Only one profiled block at a time: blocks entered while another one runs are not
+        # profiled (the scraper runs tournaments one at a time when profiling)
+        if self.metrics.profile and self.metrics._profile_lock.acquire(blocking=False):
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.before = tracemalloc.take_snapshot()
+            self.profiler = cProfile.Profile()
+            self.start = time.perf_counter()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.profiler is None:
+            return
+        try:
+            self.profiler.disable()
+            elapsed = time.perf_counter() - self.start
+            if self.metrics.is_heavy(elapsed):
+                _, peak = tracemalloc.get_traced_memory()
+                growth = tracemalloc.take_snapshot().compare_to(self.before, 'lineno')[:_PROFILE_ALLOCATIONS]
+                stats = pstats.Stats(self.profiler).stats
+                functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:_PROFILE_FUNCTIONS]
+                self.metrics.keep_profile(elapsed, {
+                    'label': self.label, 'seconds': round(elapsed, 6), 'peak_bytes': peak,
+                    'functions': [{'function': '{}:{}({})'.format(*key), 'calls': nc, 'tottime': round(tt, 6),
+                                   'cumtime': round(ct, 6)} for key, (cc, nc, tt, ct, _) in functions],
+                    'allocations': [{'where': str(stat.traceback), 'size_diff': stat.size_diff,
+                                     'count_diff': stat.count_diff} for stat in growth]})
+        finally:
+            self.profiler = None
+            self.metrics._profile_lock.release()
+
+
+class Metrics:
+    def __init__(self, profile=0):
+        # profile: how many of the heaviest profiled tournaments to keep (0 disables profiling)
+        self.profile = profile
+        self.started = dt.datetime.now()
+        self._clock = time.perf_counter()
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._profile_lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def record(self, stage, seconds, nbytes=0, count=1):
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = _Stage()
+            stats.count += count
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.max = max(stats.max, seconds)
+            stats.bytes += nbytes
+            stats.buckets[bisect.bisect_left(_BUCKETS, seconds)] += 1
+
+    def snapshot(self):
+        # Raw per-stage totals, e.g. to hand a worker process's metrics back to the parent
+        with self._lock:
+            return {stage: (stats.count, stats.calls, stats.seconds, stats.max, stats.bytes, list(stats.buckets))
+                    for stage, stats in self._stages.items()}
+
+    def merge(self, snapshot):
+        with self._lock:
+            for stage, (count, calls, seconds, longest, nbytes, buckets) in snapshot.items():
+                stats = self._stages.get(stage)
+                if stats is None:
+                    stats = self._stages[stage] = _Stage()
+                stats.count += count
+                stats.calls += calls
+                stats.seconds += seconds
+                stats.max = max(stats.max, longest)
+                stats.bytes += nbytes
+                stats.buckets = [a + b for a, b in zip(stats.buckets, buckets)]
+
+    def timed(self, stage, nbytes=0, count=1):
+        return _Timer(self, stage, nbytes, count)
+
+    def profiled(self, label):
+        return _Profiled(self, label)
+
+    def is_heavy(self, seconds):
+        with self._lock:
+            return len(self._profiles) < self.profile or seconds > self._profiles[0][0]
+
+    def keep_profile(self, seconds, entry):
+        with self._lock:
+            item = (seconds, next(self._sequence), entry)
+            if len(self._profiles) < self.profile:
+                heapq.heappush(self._profiles, item)
+            else:
+                heapq.heappushpop(self._profiles, item)
+
+    def report(self):
+        with self._lock:
+            return {'started': self.started.isoformat(), 'finished': dt.datetime.now().isoformat(),
+                    'wall_seconds': round(time.perf_counter() - self._clock, 6),
+                    'stages': {stage: stats.summary() for stage, stats in self._stages.items()},
+                    'profiles': [entry for _, _, entry in sorted(self._profiles, reverse=True)]}
+
+    def write_report(self, path=_REPORT_FILE):
+        with open(path, 'w') as fp:
+            json.dump(self.report(), fp, indent=2)
+
+
+def configure(profile=0):
+    # Starts a fresh set of metrics for the run
+    global _METRICS
+    _METRICS = Metrics(profile)
+    return _METRICS
+
+
+def get_metrics():
+    global _METRICS
+    if _METRICS is None:
+        _METRICS = Metrics()
+    return _METRICS
+
+
+def timed(stage, nbytes=0, count=1):
+    return get_metrics().timed(stage, nbytes, count)
+
+
+def profiled(label):
+    return get_metrics().profiled(label)
@@ -0,0 +1,293 @@
+import sys
+from array import array
+from operator import attrgetter
+
+# *****************************************************************************
+# Compact game records shared by every scraper.
+# ----------------- GameRecord:  one game as a slotted object with named fields in
+#                                _COLUMNS order; len/indexing/iteration/unpacking
+#                                work like the 14-element lists it replaces, but
+#                                fields are only changed by name
+# ----------------- GameBatch:   many games as packed columns; tournament, team and
+#                                date values are dictionary encoded (int32 codes
+#                                into the distinct values), scores, flags, overtimes
+#                                and game times are typed arrays. to_frame/to_arrow
+#                                wrap the code and number buffers without copying.
+# ----------------- season_of:   the season a game date falls in, shared by the
+#                                columnar outputs and the roster index
+# numpy, pandas and pyarrow are only imported by the conversions, so building records
+# stays cheap in processes that never make a frame.
+# *****************************************************************************
+
+_COLUMNS = ['Tournament', 'Date', 'Winner', 'Winning_Score', '*1', '^1', '!1',
+            'Loser', 'Losing_Score', '*2', '^2', '!2', 'OTS', 'Gametime']
+_FIELDS = ['tournament', 'date', 'winner', 'winning_score', 'catch1', 'ot_catch1', 'ot2_catch1',
+           'loser', 'losing_score', 'catch2', 'ot_catch2', 'ot2_catch2', 'ots', 'gametime']
+_ENCODED = ['tournament', 'date', 'winner', 'loser']
+_FLAGS = ['catch1', 'ot_catch1', 'ot2_catch1', 'catch2', 'ot_catch2', 'ot2_catch2']
+# array typecodes of the packed columns; codes of encoded columns are 'i' (int32)
+_TYPECODES = {'winning_score': 'h', 'losing_score': 'h', 'ots': 'b', 'gametime': 'q',
+              **{flag: 'b' for flag in _FLAGS}}
+_DTYPES = {'i': 'int32', 'h': 'int16', 'b': 'int8', 'q': 'int64'}
+# Code of a missing (None) value, and the game time stored for a missing one
+_MISSING = -1
+_NO_GAMETIME = -1
+_SEASON_START_MONTH = 7
+_UNKNOWN_SEASON = 'unknown'
+_SCHEMA = None
+_values = attrgetter(*_FIELDS)
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def season_of(date) -> str:
+    # Seasons run from the summer through nationals in the spring, e.g. 2015-2016.
+    # date: a date or datetime; None, NaT and NaN are an unknown season
+    if date is None or date != date:
+        return _UNKNOWN_SEASON
+    year = date.year if date.month >= _SEASON_START_MONTH else date.year - 1
+    return '{}-{}'.format(year, year + 1)
+
+
+def _schema():
+    # Columnar scores schema without Season; needs pyarrow
+    global _SCHEMA
+    if _SCHEMA is None:
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError('pyarrow is required for GameBatch.to_arrow')
+        names = pa.dictionary(pa.int32(), pa.string())
+        _SCHEMA = pa.schema([('Tournament', names), ('Date', pa.timestamp('s')),
+                             ('Winner', names), ('Winning_Score', pa.int16()),
+                             ('*1', pa.bool_()), ('^1', pa.bool_()), ('!1', pa.bool_()),
+                             ('Loser', names), ('Losing_Score', pa.int16()),
+                             ('*2', pa.bool_()), ('^2', pa.bool_()), ('!2', pa.bool_()),
+                             ('OTS', pa.int8()), ('Gametime', pa.duration('s'))])
+    return _SCHEMA
+
+
+class GameRecord:
+    __slots__ = _FIELDS
+
+    def __init__(self, tournament, date, winner, winning_score, catch1, ot_catch1, ot2_catch1,
+                 loser, losing_score, catch2, ot_catch2, ot2_catch2, ots, gametime):
+        self.tournament = _intern(tournament)
+        self.date = date
+        self.winner = _intern(winner)
+        self.winning_score = int(winning_score)
+        self.catch1 = bool(catch1)
+        self.ot_catch1 = bool(ot_catch1)
+        self.ot2_catch1 = bool(ot2_catch1)
+        self.loser = _intern(loser)
+        self.losing_score = int(losing_score)
+        self.catch2 = bool(catch2)
+        self.ot_catch2 = bool(ot_catch2)
+        self.ot2_catch2 = bool(ot2_catch2)
+        self.ots = int(ots)
+        self.gametime = None if gametime is None else int(gametime)
+
+    def __len__(self):
+        return len(_FIELDS)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [getattr(self, field) for field in _FIELDS[i]]
+        return getattr(self, _FIELDS[i])
+
+    def __iter__(self):
+        return iter(_values(self))
+
+    def __eq__(self, other):
+        if isinstance(other, (GameRecord, list, tuple)):
+            return _values(self) == tuple(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'GameRecord({})'.format(', '.join('{}={!r}'.format(f, v) for f, v in zip(_FIELDS, self)))
+
+    def to_list(self):
+        return list(_values(self))
+
+
+class _Pool:
+    # Distinct values of an encoded column, in order of first appearance
+    __slots__ = ['values', 'codes']
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        if value is None:
+            return _MISSING
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(_intern(value))
+        return code
+
+    def __getstate__(self):
+        # Only the values are pickled (e.g. batches coming back from parser processes)
+        return self.values
+
+    def __setstate__(self, values):
+        self.values = values
+        self.codes = {value: code for code, value in enumerate(values)}
+
+    def decode(self, codes):
+        # object ndarray of the values behind codes (None for _MISSING)
+        import numpy as np
+        values = np.empty(len(self.values) + 1, dtype=object)
+        values[:-1] = self.values
+        return values[self.view(codes)]
+
+    @staticmethod
+    def view(codes):
+        return _view(codes)
+
+
+def _view(column):
+    import numpy as np
+    return np.frombuffer(column, dtype=_DTYPES[column.typecode]) if len(column) else np.empty(
+        0, dtype=_DTYPES[column.typecode])
+
+
+class GameBatch:
+    # Iterating (or indexing) gives GameRecords; a list of batches is joined with concat.
+    # Frames and tables from to_frame/to_arrow share the batch's buffers, so the batch
+    # cannot grow while they are alive.
+    def __init__(self, records=()):
+        self._pools = {'tournament': _Pool(), 'date': _Pool(), 'team': _Pool()}
+        self._columns = {field: array('i') for field in _ENCODED}
+        self._columns.update({field: array(code) for field, code in _TYPECODES.items()})
+        self.extend(records)
+
+    @classmethod
+    def concat(cls, batches):
+        batch = cls()
+        for other in batches:
+            batch.extend(other)
+        return batch
+
+    def _pool(self, field):
+        return self._pools['team' if field in ('winner', 'loser') else field]
+
+    def append(self, record):
+        if not isinstance(record, GameRecord):
+            record = GameRecord(*record)
+        (tournament, date, winner, winning_score, catch1, ot_catch1, ot2_catch1,
+         loser, losing_score, catch2, ot_catch2, ot2_catch2, ots, gametime) = _values(record)
+        columns, pools = self._columns, self._pools
+        columns['tournament'].append(pools['tournament'].code(tournament))
+        columns['date'].append(pools['date'].code(date))
+        columns['winner'].append(pools['team'].code(winner))
+        columns['loser'].append(pools['team'].code(loser))
+        columns['winning_score'].append(winning_score)
+        columns['losing_score'].append(losing_score)
+        for flag, value in zip(_FLAGS, (catch1, ot_catch1, ot2_catch1, catch2, ot_catch2, ot2_catch2)):
+            columns[flag].append(value)
+        columns['ots'].append(ots)
+        columns['gametime'].append(_NO_GAMETIME if gametime is None else gametime)
+
+    def extend(self, records):
+        if not isinstance(records, GameBatch):
+            for record in records:
+                self.append(record)
+            return
+        # Codes are translated through the other batch's distinct values; the extra
+        # trailing entry keeps _MISSING (-1) mapped to itself
+        for field in _ENCODED:
+            pool = records._pool(field)
+            translate = [self._pool(field).code(value) for value in pool.values] + [_MISSING]
+            self._columns[field].extend([translate[code] for code in records._columns[field]])
+        for field in _TYPECODES:
+            self._columns[field].extend(records._columns[field])
+
+    def rename_teams(self, rename):
+        # Maps every distinct team name through rename once (e.g. a Conformer's conform)
+        pool = _Pool()
+        translate = [pool.code(rename(name)) for name in self._pools['team'].values] + [_MISSING]
+        for field in ('winner', 'loser'):
+            self._columns[field] = array('i', [translate[code] for code in self._columns[field]])
+        self._pools['team'] = pool
+
+    def __len__(self):
+        return len(self._columns['ots'])
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError('GameBatch index out of range')
+        values = []
+        for field in _FIELDS:
+            value = self._columns[field][i]
+            if field in _TYPECODES:
+                values.append(None if field == 'gametime' and value == _NO_GAMETIME else value)
+            else:
+                values.append(None if value == _MISSING else self._pool(field).values[value])
+        return GameRecord(*values)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __repr__(self):
+        return 'GameBatch({} games, {} teams, {} tournaments)'.format(
+            len(self), len(self._pools['team'].values), len(self._pools['tournament'].values))
+
+    def _categorical(self, field):
+        import pandas as pd
+        pool = self._pool(field)
+        return pd.Categorical.from_codes(pool.view(self._columns[field]),
+                                         categories=pd.Index(pool.values, dtype=object), validate=False)
+
+    def to_frame(self):
+        # _COLUMNS frame: names as categoricals over the code buffers, Date decoded to its
+        # original values, numbers viewed in place and a nullable Gametime
+        import numpy as np
+        import pandas as pd
+        columns = {}
+        for field, column in zip(_FIELDS, _COLUMNS):
+            if field == 'date':
+                columns[column] = self._pool(field).decode(self._columns[field])
+            elif field in _ENCODED:
+                columns[column] = self._categorical(field)
+            elif field in _FLAGS:
+                columns[column] = _view(self._columns[field]).view(np.bool_)
+            elif field == 'gametime':
+                values = _view(self._columns[field])
+                columns[column] = pd.arrays.IntegerArray(values, values == _NO_GAMETIME)
+            else:
+                columns[column] = _view(self._columns[field])
+        return pd.DataFrame(columns, copy=False)
+
+    def to_arrow(self):
+        # Table with the columnar scores schema (without Season); needs pyarrow
+        schema = _schema()
+        import numpy as np
+        import pandas as pd
+        import pyarrow as pa
+        arrays = []
+        for field, schema_field in zip(_FIELDS, schema):
+            column = self._columns[field]
+            if field == 'date':
+                # Parsed once per distinct value, then gathered by code
+                pool = self._pool(field)
+                parsed = pd.to_datetime(pd.Series(pool.values + [None], dtype=object), errors='coerce',
+                                        format='mixed').to_numpy(dtype='datetime64[s]')
+                arrays.append(pa.array(parsed[pool.view(column)], type=schema_field.type, from_pandas=True))
+            elif field in _ENCODED:
+                codes = self._pool(field).view(column)
+                arrays.append(pa.DictionaryArray.from_arrays(
+                    pa.array(codes, mask=codes == _MISSING), pa.array(self._pool(field).values, type=pa.string())))
+            elif field in _FLAGS:
+                arrays.append(pa.array(_view(column).view(np.bool_), type=schema_field.type))
+            elif field == 'gametime':
+                values = _view(column)
+                arrays.append(pa.array(values, mask=values == _NO_GAMETIME, type=schema_field.type))
+            else:
+                arrays.append(pa.array(_view(column), type=schema_field.type))
+        return pa.Table.from_arrays(arrays, schema=schema)
@@ -0,0 +1,256 @@
+import argparse
+import csv
+import json
+import os
+from array import array
+import usq_site_scraper.dedup as dd
+import usq_site_scraper.records as rc
+import usq_site_scraper.writers as wr
+
+# *****************************************************************************
+# Inverted roster index. Player, team and season names are interned to int ids, and so
+# is every tournament edition, a (name, season) pair since tournament names recur from
+# season to season. Every (player, team, tournament, role) appearance is kept once, in
+# two sorted orders with offsets per id (CSR postings):
+# ----------------- by player:  player -> appearances by tournament
+#                               (player_offsets, player_team/tournament/role)
+# ----------------- by team:    team -> appearances by season, role and player
+#                               (team_offsets, team_season/player/tournament/role)
+# Saved as one .npy file per array plus index.json with the names, so load() can
+# memory-map the postings of every scraped season instead of walking rosters.json.
+#     python -m usq_site_scraper.roster_index build --rosters rosters.json --scores scores.csv
+#     python -m usq_site_scraper.roster_index player "Jane Doe"
+# The index grows with add(); numpy is only imported to sort, save or look up.
+# *****************************************************************************
+
+_INDEX_DIR = 'roster_index'
+_META_FILE = 'index.json'
+_ROLES = ['Player', 'Coach']
+_ROSTER_KEYS = ['Players', 'Coach']
+_POSTINGS = ['player_offsets', 'player_team', 'player_tournament', 'player_role',
+             'team_offsets', 'team_season', 'team_player', 'team_tournament', 'team_role']
+
+
+def _entries(entries):
+    # (tournament, roster) of a team's roster entries, possibly nested in lists
+    for entry in entries:
+        if isinstance(entry, list):
+            yield from _entries(entry)
+        else:
+            yield from entry.items()
+
+
+def _ints(values, typecode='i'):
+    column = array(typecode)
+    column.frombytes(values.astype(rc._DTYPES[typecode]).tobytes())
+    return column
+
+
+class RosterIndex:
+    def __init__(self):
+        self._pools = {name: rc._Pool() for name in ('player', 'team', 'season')}
+        # Name and season of every tournament edition, and its code by (name, season code)
+        self._tournaments = []
+        self._tournament_season = array('i')
+        self._editions = {}
+        self._rows = {'player': array('i'), 'team': array('i'), 'tournament': array('i'), 'role': array('b')}
+        # Sorted postings; None while rows were added since the last freeze
+        self._postings = None
+
+    @classmethod
+    def from_outputs(cls, rosters_file='rosters.json', scores_file='scores.csv', sources_file=wr._SOURCES_FILE):
+        # Index of a finished run. Each roster entry is dated by the first game of its page in
+        # scores_file, through the urls in sources_file; outputs without a matching sources
+        # file fall back to the first game of the tournament name, which puts every edition
+        # of a recurring name in the first one's season.
+        rows = []
+        if scores_file and os.path.exists(scores_file):
+            with open(scores_file, newline='') as fp:
+                reader = csv.reader(fp)
+                next(reader, None)
+                rows = [(row[1], row[2]) for row in reader]
+        with open(rosters_file) as fp:
+            rosters = json.load(fp)
+        sources = wr.Sources.load(sources_file) if sources_file else None
+        if sources and not sources.matches(len(rows), rosters):
+            sources = None
+        dates, page_dates = {}, {}
+        for i, (tournament, date) in enumerate(rows):
+            dates.setdefault(tournament, date)
+            if sources and sources.scores[i] is not None:
+                page_dates.setdefault(sources.scores[i], date)
+
+        def appearances():
+            for team, entries in rosters.items():
+                codes = sources.rosters[team] if sources else [None] * len(entries)
+                for entry, code in zip(entries, codes):
+                    for tournament, roster in _entries([entry]):
+                        yield team, tournament, dates.get(tournament) if code is None else page_dates.get(code), roster
+
+        index = cls()
+        index._add(appearances())
+        return index
+
+    def _tournament(self, name, date):
+        season = self._pools['season'].code(rc.season_of(dd.parse_date(date)))
+        code = self._editions.get((name, season))
+        if code is None:
+            code = self._editions[name, season] = len(self._tournaments)
+            self._tournaments.append(name)
+            self._tournament_season.append(season)
+        return code
+
+    def add(self, rosters, dates=None):
+        # rosters: {team: [{tournament: {'Coach': [...], 'Players': [...]}}]}, of one
+        # tournament or many; dates: {tournament: date} to file them under their season
+        dates = dates if dates else {}
+        self._add((team, tournament, dates.get(tournament), roster)
+                  for team, entries in rosters.items() for tournament, roster in _entries(entries))
+
+    def _add(self, appearances):
+        # appearances: (team, tournament, date, roster) of each roster entry
+        self._thaw()
+        pools, rows = self._pools, self._rows
+        for team, tournament, date, roster in appearances:
+            team_code = pools['team'].code(team)
+            tournament_code = self._tournament(tournament, date)
+            for role, key in enumerate(_ROSTER_KEYS):
+                for player in roster.get(key, []):
+                    rows['player'].append(pools['player'].code(player))
+                    rows['team'].append(team_code)
+                    rows['tournament'].append(tournament_code)
+                    rows['role'].append(role)
+        self._postings = None
+
+    def _thaw(self):
+        # A loaded index only has its postings; rows are rebuilt from them before adding more
+        if self._postings is None or len(self._rows['player']):
+            return
+        import numpy as np
+        postings = self._postings
+        counts = np.diff(postings['player_offsets'])
+        self._rows = {'player': _ints(np.repeat(np.arange(len(counts)), counts)),
+                      'team': _ints(postings['player_team']),
+                      'tournament': _ints(postings['player_tournament']),
+                      'role': _ints(postings['player_role'], 'b')}
+
+    def freeze(self):
+        # Drops repeated appearances and sorts the postings both ways
+        if self._postings is not None:
+            return self._postings
+        import numpy as np
+        player, team, tournament, role = [rc._view(self._rows[name]) for name in ('player', 'team', 'tournament',
+                                                                                   'role')]
+        order = np.lexsort((role, team, tournament, player))
+        player, team, tournament, role = player[order], team[order], tournament[order], role[order]
+        keep = np.ones(len(player), dtype=bool)
+        for column in (player, team, tournament, role):
+            keep[1:] &= column[1:] == column[:-1]
+        keep = ~keep
+        keep[:1] = True
+        player, team, tournament, role = player[keep], team[keep], tournament[keep], role[keep]
+        season = rc._view(self._tournament_season)[tournament] if len(tournament) else tournament
+        by_team = np.lexsort((tournament, player, role, season, team))
+        sorted_team = team[by_team]
+        self._postings = {
+            'player_offsets': np.searchsorted(player, np.arange(len(self._pools['player'].values) + 1)),
+            'player_team': team, 'player_tournament': tournament, 'player_role': role,
+            'team_offsets': np.searchsorted(sorted_team, np.arange(len(self._pools['team'].values) + 1)),
+            'team_season': season[by_team], 'team_player': player[by_team],
+            'team_tournament': tournament[by_team], 'team_role': role[by_team]}
+        return self._postings
+
+    def save(self, root=_INDEX_DIR):
+        # index.json goes last; a directory without it holds no usable index
+        import numpy as np
+        postings = self.freeze()
+        os.makedirs(root, exist_ok=True)
+        for name in _POSTINGS:
+            np.save(os.path.join(root, name + '.npy'), np.ascontiguousarray(postings[name]))
+        np.save(os.path.join(root, 'tournament_season.npy'), rc._view(self._tournament_season))
+        meta = {name + 's': self._pools[name].values for name in self._pools}
+        meta['tournaments'] = self._tournaments
+        meta['roles'] = _ROLES
+        tmp = os.path.join(root, _META_FILE + '.tmp')
+        with open(tmp, 'w') as fp:
+            json.dump(meta, fp)
+        os.replace(tmp, os.path.join(root, _META_FILE))
+
+    @classmethod
+    def load(cls, root=_INDEX_DIR, mmap=True):
+        import numpy as np
+        with open(os.path.join(root, _META_FILE)) as fp:
+            meta = json.load(fp)
+        index = cls()
+        for name, pool in index._pools.items():
+            pool.__setstate__(meta[name + 's'])
+        mode = 'r' if mmap else None
+        index._postings = {name: np.load(os.path.join(root, name + '.npy'), mmap_mode=mode) for name in _POSTINGS}
+        index._tournament_season = _ints(np.load(os.path.join(root, 'tournament_season.npy')))
+        index._tournaments = meta['tournaments']
+        index._editions = {(name, season): code for code, (name, season) in enumerate(zip(index._tournaments,
+                                                                                          index._tournament_season))}
+        return index
+
+    def __len__(self):
+        return len(self.freeze()['player_team'])
+
+    def player(self, name) -> list:
+        # [(team, tournament, season, role)] of every appearance of a player
+        postings = self.freeze()
+        code = self._pools['player'].codes.get(name)
+        if code is None:
+            return []
+        start, end = postings['player_offsets'][code:code + 2]
+        values = {field: pool.values for field, pool in self._pools.items()}
+        return [(values['team'][team], self._tournaments[tournament],
+                 values['season'][self._tournament_season[tournament]], _ROLES[role])
+                for team, tournament, role in zip(postings['player_team'][start:end].tolist(),
+                                                  postings['player_tournament'][start:end].tolist(),
+                                                  postings['player_role'][start:end].tolist())]
+
+    def team(self, name, season=None) -> dict:
+        # {season: {'Players': [...], 'Coach': [...]}} of a team, or only the given season
+        postings = self.freeze()
+        code = self._pools['team'].codes.get(name)
+        if code is None:
+            return {}
+        start, end = postings['team_offsets'][code:code + 2]
+        players, seasons = self._pools['player'].values, self._pools['season'].values
+        rosters = {}
+        for season_code, player, role in zip(postings['team_season'][start:end].tolist(),
+                                             postings['team_player'][start:end].tolist(),
+                                             postings['team_role'][start:end].tolist()):
+            if season is not None and seasons[season_code] != season:
+                continue
+            roster = rosters.setdefault(seasons[season_code], {key: [] for key in _ROSTER_KEYS})[_ROSTER_KEYS[role]]
+            # Sorted by season, role and player, so repeats of a player are adjacent
+            if not roster or roster[-1] != players[player]:
+                roster.append(players[player])
+        return rosters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='index the rosters of a finished run')
+    build_parser.add_argument('--rosters', default='rosters.json')
+    build_parser.add_argument('--scores', default='scores.csv', help='dates the tournaments into seasons')
+    build_parser.add_argument('--sources', default=wr._SOURCES_FILE,
+                              help='urls of the outputs, to date each roster entry by its own page')
+    player_parser = commands.add_parser('player', help='every team and tournament a player appeared for')
+    player_parser.add_argument('name')
+    team_parser = commands.add_parser('team', help='the roster of a team per season')
+    team_parser.add_argument('name')
+    team_parser.add_argument('--season', help='only this season, e.g. 2016-2017')
+    for command in (build_parser, player_parser, team_parser):
+        command.add_argument('--index', default=_INDEX_DIR)
+    args = parser.parse_args()
+    if args.command == 'build':
+        index = RosterIndex.from_outputs(args.rosters, args.scores, args.sources)
+        index.save(args.index)
+        print('Indexed {} appearances of {} players'.format(len(index), len(index._pools['player'].values)))
+    elif args.command == 'player':
+        print(json.dumps(RosterIndex.load(args.index).player(args.name), indent=1))
+    else:
+        print(json.dumps(RosterIndex.load(args.index).team(args.name, args.season), indent=1))
@@ -1,36 +1,99 @@
 import re
-import requests
-from bs4 import BeautifulSoup
 import asyncio
-from pyppeteer import launch
-import pandas as pd
 import json
 import datetime as dt
-
+import hashlib
+import os
+import argparse
+import time
+import multiprocessing
+from html import escape as html_escape
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque
+import fetching.cache as fc
+import fetching.scheduler as sch
+import usq_site_scraper.manifest as mf
+import usq_site_scraper.writers as wr
+import usq_site_scraper.logs as lg
+import usq_site_scraper.metrics as mt
+import usq_site_scraper.records as rc
+
+# requests, bs4, pyppeteer, pandas and pyarrow are imported by the functions that use them,
+# so importing the scraper (e.g. in every parser process) only pays for lxml
 _CATCH_MARKERS = ['*', '^', '!']
-_LOG_ERROR_FILE = 'error_log.txt'
-_LOG_PROGRESS_FILE = 'log.txt'
-_EVENTS_LINK = "https://www.usquidditch.org/events/calendar/{}"
-_COLUMNS = ['Tournament', 'Date', 'Winner', 'Winning_Score', '*1', '^1', '!1',
-               'Loser', 'Losing_Score', '*2', '^2', '!2', 'OTS', 'Gametime']
+_LOG_ERROR_FILE = 'error_log.jsonl'
+_LOG_PROGRESS_FILE = 'log.jsonl'
+_BROWSER_PAGES = 4
+_HTTP_WORKERS = 8
+_IN_FLIGHT = 2
+_SESSION = None
+_RECENT_MONTHS = 2
+# QSCORE_USQ_BASE_URL (or --base-url) points the scraper at another copy of the site
+_BASE_URL = os.environ.get('QSCORE_USQ_BASE_URL', 'https://www.usquidditch.org').rstrip('/')
+_EVENTS_PATH = '/events/calendar/{}'
+_EVENTS_LINK = _BASE_URL + _EVENTS_PATH
+_RENDER_KEY = 'render:{}'
+_RENDER_TIMEOUT = 30
+# Lean rendering: requests the event list does not need are aborted and only the event
+# anchors and their colors are read back from the page (--full-render turns it off)
+_LEAN_RENDER = True
+_BLOCKED_RESOURCES = {'image', 'stylesheet', 'font', 'media', 'texttrack', 'eventsource', 'websocket', 'manifest'}
+_BLOCKED_DOMAINS = ('google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'googlesyndication.com',
+                    'facebook.net', 'facebook.com', 'twitter.com', 'addthis.com', 'fonts.googleapis.com',
+                    'fonts.gstatic.com', 'gravatar.com', 'youtube.com', 'vimeo.com', 'hotjar.com')
+_LEAN_ARGS = ['--disable-gpu', '--disable-dev-shm-usage', '--disable-extensions', '--no-first-run', '--mute-audio',
+              '--blink-settings=imagesEnabled=false']
+_NO_EVENTS = 'No events in selected timeframe'
+_EVENTS_READY = ('() => document.querySelector("div.event") !== null || '
+                 '(document.body !== null && document.body.innerText.includes("{}"))'.format(_NO_EVENTS))
+# [{href, style}] of the month's events, or null when the month has none
+_EXTRACT_EVENTS = ('() => {const events = Array.from(document.querySelectorAll("div.event"));'
+                   'if (!events.length) return null;'
+                   'return events.map(e => {const box = e.querySelector("div.calendar_box");'
+                   'return {href: e.getAttribute("href"), style: box ? box.getAttribute("style") : null};});}')
 _CALENDAR_COLORS = {'#0054A6':'Official Tournament',
                     '#D1C221':'USQ Event',
                     '#BA3434':'USQ Sanctioned Event',
                     '#1B996A':'Unofficial Tournament',
                     '#CB7005':'Other'}
 
+try:
+    import lxml.html as lxml_html
+    _LXML_PARSER = lxml_html.HTMLParser(encoding='utf-8')
+except ImportError:
+    lxml_html = None
+_TOURNAMENT_TAGS = ['title', 'table', 'a']
+_ROSTER_TABLES = "//table[contains(concat(' ', normalize-space(@class), ' '), ' roster ')]"
+
+
+def set_base_url(base_url):
+    global _BASE_URL, _EVENTS_LINK
+    _BASE_URL = base_url.rstrip('/')
+    _EVENTS_LINK = _BASE_URL + _EVENTS_PATH
+
+
+def clean_text(text):
+    return text.strip().replace(',', '').replace("'", "").replace('"', '')
+
+
 def clean_soup(soup_val):
-    return soup_val.get_text().strip().replace(',', '').replace("'", "").replace('"', '')
+    return clean_text(soup_val.get_text())
+
+
+def _log_fields(stage, target, **fields):
+    # target is whatever the caller was working on: a url, a tournament name or a month
+    key = 'url' if isinstance(target, str) and target.startswith('http') else 'tournament'
+    return {'stage': stage, key: target, **fields}
 
 
 def _log_exception(e: Exception, doing: str, tournament: str, extra=''):
-    with open(_LOG_ERROR_FILE, 'a') as err:
-        err.write('[{}]|Error {}|{}|{}|\n'.format(dt.datetime.now(), e, doing, tournament, extra))
+    lg.get_logger(_LOG_ERROR_FILE).error(str(e), extra=_log_fields(doing, tournament, error=type(e).__name__,
+                                                                   detail=extra))
 
 
-def _log_progress(message: str):
-    with open(_LOG_PROGRESS_FILE, 'a') as log:
-        log.write(message.strip() + '\n')
+def _log_progress(message: str, stage='', target=''):
+    lg.get_logger(_LOG_PROGRESS_FILE).info(message.strip(), extra=_log_fields(stage, target))
 
 
 def clear_file(file):
@@ -59,62 +122,206 @@ def process_input(start, end):
         return None
 
 
-def get_event_urls(start, end) -> list:
+def _month_slugs(start, end) -> list:
     month, year = start
     month_til, year_til = end
-    event_urls = []
-    slug = ''
+    slugs = []
     while year < year_til or (year == year_til and month <= month_til):
+        slug = str(year)
+        slug += '0' + str(month) if month // 10 == 0 else str(month)
+        slugs.append(slug)
+        if month == 12:
+            month, year = 1, year + 1
+        else:
+            month, year = month + 1, year
+    return slugs
+
+
+def parse_event_list(tournaments) -> list:
+    from bs4 import BeautifulSoup
+    event_urls = []
+    soup_month = BeautifulSoup(tournaments)
+    for v in soup_month.findAll('div',{'class':'event'}):
+        official = True
+        try:
+            color = v.find('div',{'class':'calendar_box'})['style'].split(':')[-1].upper()
+            if  color in _CALENDAR_COLORS and _CALENDAR_COLORS[color] in ['Unofficial Tournament', 'Other']:
+                official = False
+        except Exception as e:
+            _log_exception(e, 'testing event for official status', str(v['href']))
+        if official:
+            event_urls.append(_BASE_URL + v['href'])
+        else:
+            _log_progress('WARNING: Skipping tournament {} due to unofficial status'.format(v['href']),
+                          'testing event for official status', str(v['href']))
+    return event_urls
+
+
+def get_event_urls(start, end, workers=_BROWSER_PAGES) -> list:
+    months = get_month_events(_month_slugs(start, end), workers)
+    return [url for urls in months.values() if urls for url in urls]
+
+
+def get_month_events(slugs, workers=_BROWSER_PAGES, pool=None) -> dict:
+    # slug -> official event urls of that month, or None when the month could not be read.
+    # pool: a BrowserPool kept open by the caller across calls (opened here on first use)
+    events = {}
+    loop = asyncio.get_event_loop()
+    wall_start = time.perf_counter()
+    months = loop.run_until_complete(render_months(slugs, workers, pool))
+    _log_progress('TIMING: Rendered {} months in {:.2f}s with {} pages'.format(
+        len(slugs), time.perf_counter() - wall_start, pool.size if pool else workers))
+    for slug, tournaments in zip(slugs, months):
+        events[slug] = None
         try:
-            slug = str(year)
-            slug += '0' + str(month) if month // 10 == 0 else str(month)
             print(slug)
-            loop = asyncio.get_event_loop()
-            tournaments = loop.run_until_complete(
-                fetch_data(_EVENTS_LINK.format(slug)))
+            if isinstance(tournaments, Exception):
+                raise tournaments
             if tournaments:
-                soup_month = BeautifulSoup(tournaments)
-                for v in soup_month.findAll('div',{'class':'event'}):
-                    official = True
-                    try:
-                        color = v.find('div',{'class':'calendar_box'})['style'].split(':')[-1].upper()
-                        if  color in _CALENDAR_COLORS and _CALENDAR_COLORS[color] in ['Unofficial Tournament', 'Other']:
-                            official = False
-                    except Exception as e:
-                        _log_exception(e, 'testing event for official status', str(v['href']))
-                    if official:
-                        event_urls.append('https://www.usquidditch.org' + v['href'])
-                    else:
-                        _log_progress('WARNING: Skipping tournament {} due to unofficial status'.format(v['href']))
+                events[slug] = parse_event_list(tournaments)
             else:
+                events[slug] = []
                 _log_exception(Exception('No events in month'), 'obtaining event list from page', slug)
-                _log_progress('WARNING: No events in month {}'.format(slug))
+                _log_progress('WARNING: No events in month {}'.format(slug), 'obtaining event list from page', slug)
         except Exception as e:
             _log_exception(e, 'obtaining event list from page', slug)
-            _log_progress('FAILURE: Obtaining event list from page {}'.format(slug))
-        finally:
-            if month == 12:
-                month, year = 1, year + 1
-            else:
-                month, year = month + 1, year
-    return event_urls
+            _log_progress('FAILURE: Obtaining event list from page {}'.format(slug), 'obtaining event list from page',
+                          slug)
+    return events
+
+
+class BrowserPool:
+    # One headless browser shared by every render, with a fixed number of open pages.
+    # Renders wait for a free page, so the page count bounds concurrency; pacing and
+    # retries come from the shared fetch scheduler.
+    def __init__(self, size=_BROWSER_PAGES, options=None, lean=None):
+        self.size = max(1, size)
+        self.lean = _LEAN_RENDER if lean is None else lean
+        self.options = options if options else {"headless": True, **({'args': _LEAN_ARGS} if self.lean else {})}
+        self.browser = None
+        self.timings = []
+        self.blocked = 0
+        self._pages = None
+
+    async def _new_page(self):
+        page = await self.browser.newPage()
+        if self.lean:
+            await page.setRequestInterception(True)
+            page.on('request', lambda request: asyncio.ensure_future(self._intercept(request)))
+        return page
+
+    async def _intercept(self, request):
+        host = urlsplit(request.url).netloc.lower()
+        if request.resourceType in _BLOCKED_RESOURCES or host.endswith(_BLOCKED_DOMAINS):
+            self.blocked += 1
+            await request.abort()
+        else:
+            await request.continue_()
 
+    async def __aenter__(self):
+        return await self.open()
 
-@asyncio.coroutine
-async def fetch_data(url):
-    browser = await launch({"headless": True})
-    page = await browser.newPage()
-    # ... do stuff with page ...
-    await page.goto(url)
-    val = await page.content()
-    if 'No events in selected timeframe' in val:
-        return None
-    else:
-        await page.waitForSelector('div.event')
-        val = await page.content()
-    # Dispose context once it's no longer needed
-    await browser.close()
-    return val
+    async def open(self):
+        # Launches the browser unless it is already open
+        if self.browser:
+            return self
+        from pyppeteer import launch
+        self.browser = await launch(self.options)
+        try:
+            self._pages = asyncio.Queue()
+            for _ in range(self.size):
+                self._pages.put_nowait(await self._new_page())
+        except Exception:
+            await self.close()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self.browser:
+            browser, self.browser = self.browser, None
+            await browser.close()
+
+    async def render(self, url):
+        # Retried with backoff under the shared fetch scheduler's rate limit, and
+        # dead-lettered once every attempt has failed
+        scheduler = sch.get_scheduler()
+        for attempt in range(scheduler.retries + 1):
+            await asyncio.sleep(scheduler.reserve(url))
+            try:
+                return await self._render(url)
+            except Exception as e:
+                error = e
+            if attempt < scheduler.retries:
+                await asyncio.sleep(scheduler.backoff(attempt))
+        scheduler.dead_letter(url, error, scheduler.retries + 1)
+        raise error
+
+    async def _render(self, url):
+        page = await self._pages.get()
+        start = time.perf_counter()
+        val = ''
+        try:
+            response = await page.goto(url, {'waitUntil': 'domcontentloaded', 'timeout': _RENDER_TIMEOUT * 1000})
+            if response and response.status in sch._RETRY_STATUS:
+                raise sch.FetchError('HTTP {}'.format(response.status))
+            await page.waitForFunction(_EVENTS_READY, {'timeout': _RENDER_TIMEOUT * 1000, 'polling': 'mutation'})
+            if self.lean:
+                # Only the parts parse_event_list reads are rebuilt, instead of serializing the page
+                events = await page.evaluate(_EXTRACT_EVENTS)
+                if not events:
+                    return None
+                val = ''.join('<div class="event" href="{}"><div class="calendar_box" style="{}"></div></div>'.format(
+                    html_escape(event['href'] or ''), html_escape(event['style'] or '')) for event in events)
+                return val
+            val = await page.content()
+            return None if _NO_EVENTS in val and 'class="event"' not in val else val
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings.append((url, elapsed))
+            mt.get_metrics().record('render', elapsed, len(val))
+            _log_progress('TIMING: Rendered {} in {:.2f}s ({} requests blocked so far)'.format(
+                url, elapsed, self.blocked), 'rendering calendar', url)
+            self._pages.put_nowait(page)
+
+
+async def render_months(slugs, workers=_BROWSER_PAGES, pool=None) -> list:
+    # Rendered months are replayed from the response cache when one is configured,
+    # so the browser is only launched for months that are not cached. Without a pool
+    # one is opened (and closed) for this call.
+    cache = fc.get_cache()
+    urls = [_EVENTS_LINK.format(slug) for slug in slugs]
+    months = [None] * len(urls)
+    missing = []
+    for i, url in enumerate(urls):
+        body = cache.get(_RENDER_KEY.format(url)) if cache else None
+        if body is not None:
+            months[i] = body.decode('utf-8') or None
+        elif cache and cache.offline:
+            months[i] = fc.CacheMiss(url)
+        else:
+            missing.append(i)
+    if missing and pool is not None:
+        await pool.open()
+        rendered = await asyncio.gather(*[pool.render(urls[i]) for i in missing], return_exceptions=True)
+    elif missing:
+        async with BrowserPool(min(workers, len(missing))) as pool:
+            rendered = await asyncio.gather(*[pool.render(urls[i]) for i in missing], return_exceptions=True)
+    if missing:
+        for i, val in zip(missing, rendered):
+            months[i] = val
+            if cache and not isinstance(val, Exception):
+                cache.put(_RENDER_KEY.format(urls[i]), (val if val else '').encode('utf-8'))
+    return months
+
+
+async def fetch_data(url, pool=None):
+    if pool:
+        return await pool.render(url)
+    async with BrowserPool(1) as pool:
+        return await pool.render(url)
 
 
 def process_result(result):
@@ -138,7 +345,7 @@ def process_result(result):
         hours, minutes, seconds = gtime.split(':')
         return [date, *winner, *loser, ots, int(hours) * 3600 + int(minutes) * 60 + int(seconds)]
     except Exception as e:
-        _log_exception(e, 'processing result', '')
+        _log_exception(e, 'processing result', '', result)
         return []
 
 
@@ -155,14 +362,65 @@ def process_score(score: str, team1=None, team2=None):
             raise Exception('Forfeit or invalid Team Names')
 
     except Exception as e:
-        _log_exception(e, 'processing score', score)
+        _log_exception(e, 'processing score', '', score)
+        return None
+
+
+def get_session(pool_size=_HTTP_WORKERS):
+    # Keep-alive session shared by every tournament fetch (and every fetch worker)
+    global _SESSION
+    if _SESSION is None:
+        import requests
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _SESSION = session
+    return _SESSION
+
+
+def fetch_if_changed(url, entry=None, session=None):
+    # Conditional fetch against a manifest entry: None when the page is unchanged (or
+    # could not be fetched), otherwise the page text with its digest and validators
+    try:
+        cache = fc.get_cache()
+        headers = {}
+        if cache and cache.offline:
+            text = fc.get_text(url)
+            etag, last_modified = None, None
+        else:
+            if entry and entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry and entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+            with mt.timed('http') as timer:
+                response = sch.fetch(url, session if session else get_session(), headers)
+                timer.bytes = len(response.content)
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+            text = response.text
+            etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+            if cache:
+                cache.put(url, text.encode('utf-8'))
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        if entry and entry.get('digest') == digest:
+            return None
+        return {'text': text, 'digest': digest, 'etag': etag, 'last_modified': last_modified}
+    except Exception as e:
+        _log_exception(e, 'checking tournament for changes', url)
         return None
 
 
-def get_tournament_info(url):
+def get_tournament_info(url, session=None, html=None):
+    from bs4 import BeautifulSoup
     try:
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text)
+        if html is None:
+            with mt.timed('http') as timer:
+                html = fc.get_text(url, session if session else get_session())
+                timer.bytes = len(html)
+        with mt.timed('parse', len(html)):
+            soup = BeautifulSoup(html)
         # Get TournamentName
         name = soup.find('title').get_text().split('|')[0].strip()
         # print('Parsing Tournament: {}'.format(name))
@@ -174,13 +432,20 @@ def get_tournament_info(url):
 
 
 def get_roster_info(team_list, soup, tournament_name):
+    cells = [[clean_soup(val) for player_soup in roster for val in player_soup.findAll('td')] for roster in soup]
+    return build_rosters(team_list, cells, tournament_name)
+
+
+def build_rosters(team_list, cells, tournament_name):
+    # cells: the cleaned td texts of each roster table, header row excluded
     rosters = {}
-    if len(team_list) != len(soup):
+    if len(team_list) != len(cells):
         _log_exception(Exception('Mismatched roster lengths'), 'getting roster info', tournament_name)
-        _log_progress('FAILURE: getting rosters from tournament {}'.format(tournament_name))
+        _log_progress('FAILURE: getting rosters from tournament {}'.format(tournament_name), 'getting roster info',
+                      tournament_name)
     else:
-        for tname, roster in zip(team_list, soup):
-            team = [clean_soup(val) for player_soup in roster for val in player_soup.findAll('td')][:-1]
+        for tname, roster in zip(team_list, cells):
+            team = roster[:-1]
             team_roster = {'Coach': [], 'Players': []}
             for i in range(0, len(team), 2):
                 if team[i + 1] == 'Coach':
@@ -191,80 +456,472 @@ def get_roster_info(team_list, soup, tournament_name):
     return rosters
 
 
-def parse_tournament(url) -> dict:
-    name, soup = get_tournament_info(url)
-    if soup:
-        name = name if name else "Unknown @ {}".format(url)
-        try:
-            # Get Rosters
+def _parse_tournament_soup(soup, name, url) -> dict:
+    name = name if name else "Unknown @ {}".format(url)
+    try:
+        # Get Rosters
+        with mt.timed('rosters') as timer:
             team_list = [clean_soup(team) for team in soup.findAll('a', {'target': '_BLANK'})]
             roster_soup = [roster.findAll('tr')[1:] for roster in soup.findAll('table', 'roster')]
             rosters = get_roster_info(team_list, roster_soup, name)
-            if rosters:
-                _log_progress('SUCCESS: Rosters parsed for tournament {}'.format(name))
-            # Get Scores
-            score_soup = soup.findAll('table')[-1].findAll('tr')[1:] if soup.findAll('table') else []
-            score_list = [[name, *process_result([clean_soup(v) for v in row.findAll('td')])] for row in score_soup if
-                          row]
-            scores = list(filter(lambda x: len(x) == 14, score_list))
-            if scores:
-                _log_progress('SUCCESS: Scores parsed for tournament {}'.format(name))
-            return {'Rosters': rosters, 'Scores': scores}
+            timer.count = len(team_list)
+        if rosters:
+            _log_progress('SUCCESS: Rosters parsed for tournament {}'.format(name), 'preparing rosters', name)
+        # Get Scores
+        with mt.timed('scores') as timer:
+            tables = soup.findAll('table')
+            score_soup = tables[-1].findAll('tr')[1:] if tables else []
+            score_list = [process_result([clean_soup(v) for v in row.findAll('td')]) for row in score_soup if row]
+            scores = rc.GameBatch(rc.GameRecord(name, *result) for result in score_list if len(result) == 13)
+            timer.count = len(score_list)
+        if scores:
+            _log_progress('SUCCESS: Scores parsed for tournament {}'.format(name), 'preparing scores', name)
+        return {'Tournament': name, 'Rosters': rosters, 'Scores': scores}
+    except Exception as e:
+        _log_exception(e, "preparing roster or score information", name)
+        return {}
+
+
+def _score_cells(root) -> list:
+    tables = root.xpath('//table')
+    score_rows = list(tables[-1].iterdescendants('tr'))[1:] if tables else []
+    return [[clean_text(td.text_content()) for td in row.iterdescendants('td')] for row in score_rows]
+
+
+def _parse_tournament_tree(root, name, url) -> dict:
+    # Same records as _parse_tournament_soup, read from an lxml tree with XPath
+    name = name if name else "Unknown @ {}".format(url)
+    try:
+        # Get Rosters
+        with mt.timed('rosters') as timer:
+            team_list = [clean_text(team.text_content()) for team in root.xpath('//a[@target="_BLANK"]')]
+            cells = [[clean_text(td.text_content()) for tr in list(table.iterdescendants('tr'))[1:]
+                      for td in tr.iterdescendants('td')] for table in root.xpath(_ROSTER_TABLES)]
+            rosters = build_rosters(team_list, cells, name)
+            timer.count = len(team_list)
+        if rosters:
+            _log_progress('SUCCESS: Rosters parsed for tournament {}'.format(name), 'preparing rosters', name)
+        # Get Scores
+        with mt.timed('scores') as timer:
+            score_list = [process_result(row) for row in _score_cells(root)]
+            scores = rc.GameBatch(rc.GameRecord(name, *result) for result in score_list if len(result) == 13)
+            timer.count = len(score_list)
+        if scores:
+            _log_progress('SUCCESS: Scores parsed for tournament {}'.format(name), 'preparing scores', name)
+        return {'Tournament': name, 'Rosters': rosters, 'Scores': scores}
+    except Exception as e:
+        _log_exception(e, "preparing roster or score information", name)
+        return {}
+
+
+def parse_tournament_html(html, url) -> dict:
+    # Fast path: lxml with targeted XPath lookups when it is installed, otherwise a
+    # soup holding only the title, tables and anchors. The tree is dropped as soon
+    # as the records are extracted.
+    if lxml_html is not None:
+        try:
+            with mt.timed('parse', len(html)):
+                root = lxml_html.fromstring(html.encode('utf-8'), parser=_LXML_PARSER)
+            name = root.xpath('//title')[0].text_content().split('|')[0].strip()
         except Exception as e:
-            _log_exception(e, "preparing roster or score information", name)
+            _log_exception(e, 'obtaining tournament info', url)
             return {}
-    else:
+        return _parse_tournament_tree(root, name, url)
+    from bs4 import BeautifulSoup, SoupStrainer
+    try:
+        with mt.timed('parse', len(html)):
+            soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer(_TOURNAMENT_TAGS))
+        name = soup.find('title').get_text().split('|')[0].strip()
+    except Exception as e:
+        _log_exception(e, 'obtaining tournament info', url)
         return {}
+    try:
+        return _parse_tournament_soup(soup, name, url)
+    finally:
+        soup.decompose()
+
+
+def reparse_scores(url_list, session=None):
+    # Rebuilds the score table of already fetched (usually cached) pages: the raw rows
+    # of every page are collected first and parsed in one batch_parse.parse_results call.
+    # Returns (scores DataFrame, rejects DataFrame). Needs lxml.
+    import usq_site_scraper.batch_parse as bp
+    if lxml_html is None:
+        raise ImportError('lxml is required to reparse scores')
+    tournaments, rows = [], []
+    for url in url_list:
+        try:
+            root = lxml_html.fromstring(fc.get_text(url, session if session else get_session()).encode('utf-8'),
+                                        parser=_LXML_PARSER)
+            name = root.xpath('//title')[0].text_content().split('|')[0].strip()
+            name = name if name else "Unknown @ {}".format(url)
+            cells = _score_cells(root)
+        except Exception as e:
+            _log_exception(e, 'obtaining tournament info', url)
+            continue
+        tournaments.extend([name] * len(cells))
+        rows.extend(cells)
+    return bp.parse_results(rows, tournaments)
+
+
+def parse_tournament(url, session=None, html=None, fast=True) -> dict:
+    with mt.profiled(url):
+        if fast:
+            if html is None:
+                try:
+                    with mt.timed('http') as timer:
+                        html = fc.get_text(url, session if session else get_session())
+                        timer.bytes = len(html)
+                except Exception as e:
+                    _log_exception(e, 'obtaining tournament info', url)
+                    return {}
+            return parse_tournament_html(html, url)
+        name, soup = get_tournament_info(url, session, html)
+        if soup:
+            return _parse_tournament_soup(soup, name, url)
+        else:
+            return {}
+
 
+def _fetch_page(url, session):
+    # Raw page bytes for the parser processes, None when the page could not be fetched
+    try:
+        with mt.timed('http') as timer:
+            html = fc.get_text(url, session)
+            timer.bytes = len(html)
+        return html.encode('utf-8')
+    except Exception as e:
+        _log_exception(e, 'obtaining tournament info', url)
+        return None
 
-def parse_tournament_list(url_list):
+
+def _parse_page(url, body):
+    # Runs in a parser process: page bytes in, plain records and that parse's metrics out
+    metrics = mt.configure()
+    val = parse_tournament_html(body.decode('utf-8'), url) if body else {}
+    return val, metrics.snapshot()
+
+
+def _iter_pipelined(url_list, workers, parsers, pages):
+    # Fetch threads hand page bytes to a pool of parser processes; at most _IN_FLIGHT
+    # pages per fetcher/parser are fetched but not yet taken by the consumer
+    session = get_session(workers)
+    context = multiprocessing.get_context('spawn')
+    remote = context.Queue()
+    receiver = lg.receive(remote)
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as fetchers, \
+                ProcessPoolExecutor(max_workers=parsers, mp_context=context, initializer=lg.log_to,
+                                    initargs=(remote,)) as pool:
+            def fetch_and_submit(url):
+                body = pages[url].encode('utf-8') if url in pages else _fetch_page(url, session)
+                return pool.submit(_parse_page, url, body)
+
+            def take():
+                url, future = pending.popleft()
+                val, snapshot = future.result().result()
+                mt.get_metrics().merge(snapshot)
+                return url, val
+
+            for url in url_list:
+                pending.append((url, fetchers.submit(fetch_and_submit, url)))
+                if len(pending) >= max(workers, parsers) * _IN_FLIGHT:
+                    yield take()
+            while pending:
+                yield take()
+    finally:
+        receiver.stop()
+
+
+def iter_parsed_tournaments(url_list, workers=1, pages=None, parsers=0):
+    # Yields (url, parse result) in url_list order; with workers > 1 the pages are
+    # fetched and parsed by a thread pool over one pooled keep-alive session.
+    # With parsers > 0, the threads only fetch and parsing runs in that many processes.
+    # pages optionally maps urls to already fetched html.
+    # At most _IN_FLIGHT results per worker are held before the consumer takes them.
+    pages = pages if pages else {}
+    if parsers > 0:
+        yield from _iter_pipelined(url_list, max(1, workers), parsers, pages)
+        return
+    if workers <= 1:
+        for url in url_list:
+            yield url, parse_tournament(url, html=pages.get(url))
+        return
+    session = get_session(workers)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for url in url_list:
+            pending.append((url, pool.submit(parse_tournament, url, session, pages.get(url))))
+            if len(pending) >= workers * _IN_FLIGHT:
+                url, future = pending.popleft()
+                yield url, future.result()
+        while pending:
+            url, future = pending.popleft()
+            yield url, future.result()
+
+
+def parse_tournament_list(url_list, workers=1, pages=None, parsers=0):
+    return merge_tournaments(iter_parsed_tournaments(url_list, workers, pages, parsers))
+
+
+def _check_tournament(url, val) -> bool:
+    _log_progress('Parsing tournament @ url: {}'.format(url), 'parsing tournament', url)
+    if not val:
+        _log_progress('FAILURE: Tournament parse @ URL {}'.format(url), 'parsing tournament', url)
+        _log_exception(Exception('Empty parse tournamnet result'), 'parsing tournament', url)
+        return False
+    warning = False
+    if not val['Scores']:
+        _log_progress('WARNING: Scores not parsed for tournament', 'parsing tournament', url)
+        warning = True
+    if not val['Rosters']:
+        _log_progress('WARNING: Rosters not parsed for tournament', 'parsing tournament', url)
+        warning = True
+    if warning:
+        _log_exception(Exception('Tournament is missing either scores or roster'), 'parsing tournament', url)
+    return True
+
+
+def merge_tournaments(parsed):
     rosters = {}
     scores = []
-    warning = False
-    for url in url_list:
-        _log_progress('Parsing tournament @ url: {}'.format(url))
-        val = parse_tournament(url)
-        if val:
-            if not val['Scores']:
-                _log_progress('WARNING: Scores not parsed for tournament')
-                warning = True
+    for url, val in parsed:
+        if _check_tournament(url, val):
             new_roster = val['Rosters']
-            if not new_roster:
-                _log_progress('WARNING: Rosters not parsed for tournament')
-                warning = True
             for team in new_roster:
                 if team in rosters:
-                    rosters[team].append(new_roster[team])
+                    rosters[team].extend(new_roster[team])
                 else:
                     rosters[team] = new_roster[team]
             scores.append(val['Scores'])
-        else:
-            _log_progress('FAILURE: Tournament parse @ URL {}'.format(url))
-            _log_exception(Exception('Empty parse tournamnet result'), 'parsing tournament', url)
-        if warning:
-            _log_exception(Exception('Tournament is missing either scores or roster'), 'parsing tournament', url)
-
     return {'Rosters': rosters, 'Scores': scores}
 
 
+def stream_tournaments(parsed, scores_file='scores.csv', rosters_file='rosters.json', index=None,
+                       sources_file=wr._SOURCES_FILE):
+    # Writes each tournament as soon as it is parsed instead of collecting the whole range;
+    # index (a RosterIndex) also gets every roster as it goes
+    sources = wr.Sources()
+    with wr.ScoreWriter(scores_file) as scores, wr.RosterWriter(rosters_file) as rosters:
+        for url, val in parsed:
+            if _check_tournament(url, val):
+                with mt.timed('store', count=len(val['Scores'])):
+                    scores.write(val['Scores'])
+                    rosters.write(val['Tournament'], val['Rosters'])
+                    sources.add(url, len(val['Scores']), val['Rosters'])
+                    if index is not None:
+                        date = val['Scores'][0].date if len(val['Scores']) else None
+                        index.add(val['Rosters'], {val['Tournament']: date})
+    sources.save(sources_file)
+
+
 def store_data(val):
-    with open('rosters.json', 'w') as fp:
-        json.dump(val['Rosters'], fp)
-    columns = ['Tournament', 'Date', 'Winner', 'Winning_Score', '*1', '^1', '!1',
-               'Loser', 'Losing_Score', '*2', '^2', '!2', 'OTS', 'Gametime']
-    df = pd.DataFrame([score for t in val['Scores'] for score in t], columns=columns)
-    df.to_csv('scores.csv')
+    with mt.timed('store'):
+        with open('rosters.json', 'w') as fp:
+            json.dump(val['Rosters'], fp)
+        df = rc.GameBatch.concat(val['Scores']).to_frame()
+        df.to_csv('scores.csv')
+
+
+def _flatten(entries):
+    # Roster entries are {tournament: roster} dicts, possibly nested in lists by older runs
+    flat = []
+    for entry in entries:
+        if isinstance(entry, list):
+            flat.extend(_flatten(entry))
+        else:
+            flat.append(entry)
+    return flat
+
+
+def upsert_data(parsed, names=(), rosters_file='rosters.json', scores_file='scores.csv',
+                sources_file=wr._SOURCES_FILE):
+    # Replace every row of the tournament urls in parsed ([(url, val)]) with their new rows,
+    # keeping everything else already stored. Rows are matched by url through sources_file,
+    # so tournaments sharing a name keep theirs; rows it has no url for (outputs written
+    # before it was kept) fall back to matching the parsed tournaments' names and names.
+    import pandas as pd
+    parsed = [(url, val) for url, val in parsed if _check_tournament(url, val)]
+    replaced = {url for url, _ in parsed}
+    names = set(names) | {val['Tournament'] for _, val in parsed}
+    rosters = {}
+    if os.path.exists(rosters_file):
+        with open(rosters_file) as fp:
+            rosters = {team: _flatten(entries) for team, entries in json.load(fp).items()}
+    old = pd.read_csv(scores_file, index_col=0) if os.path.exists(scores_file) else None
+    rows = 0 if old is None else len(old)
+    sources = wr.Sources.load(sources_file)
+    if sources is None or not sources.matches(rows, rosters):
+        if rows or rosters:
+            _log_progress('WARNING: {} is missing or out of date, rows without a url are replaced by tournament '
+                          'name'.format(sources_file), 'storing', sources_file)
+        sources = wr.Sources(scores=[None] * rows, rosters={team: [None] * len(entries)
+                                                            for team, entries in rosters.items()})
+
+    def dropped(code, tournaments):
+        url = sources.url(code)
+        return url in replaced if url is not None else bool(set(tournaments) & names)
+
+    keep = [not dropped(code, (name,)) for code, name in zip(sources.scores, old['Tournament'].tolist())] if rows else []
+    kept = wr.Sources(sources.urls, [code for code, k in zip(sources.scores, keep) if k])
+    for team, entries in list(rosters.items()):
+        pairs = [(entry, code) for entry, code in zip(entries, sources.rosters[team]) if not dropped(code, entry)]
+        if pairs:
+            rosters[team] = [entry for entry, _ in pairs]
+            kept.rosters[team] = [code for _, code in pairs]
+        else:
+            del rosters[team]
+    for url, val in parsed:
+        for team, entries in val['Rosters'].items():
+            rosters.setdefault(team, []).extend(entries)
+        kept.add(url, len(val['Scores']), val['Rosters'])
+    with open(rosters_file, 'w') as fp:
+        json.dump(rosters, fp)
+    df = rc.GameBatch.concat(val['Scores'] for _, val in parsed).to_frame()
+    if rows:
+        df = pd.concat([old[keep], df], ignore_index=True)
+    df.to_csv(scores_file)
+    # Written last: outputs newer than their sources file fail matches() instead of misleading
+    kept.save(sources_file)
+
+
+def _recent_slug(months=_RECENT_MONTHS):
+    today = dt.date.today()
+    month, year = today.month - months, today.year
+    while month < 1:
+        month, year = month + 12, year - 1
+    return '{}{:02d}'.format(year, month)
+
+
+def scrape_incremental(start, end, manifest_file=mf._MANIFEST_FILE, workers=_HTTP_WORKERS, pages=_BROWSER_PAGES,
+                       parsers=0, full=False):
+    # Only months missing from the manifest (or recent enough to still change) are
+    # rendered, and only the tournaments of those months plus any not yet in the manifest
+    # are refetched (full: every tournament of the range). Pages that changed are parsed
+    # and their rows upserted into the existing outputs. The manifest is saved after the outputs.
+    manifest = mf.Manifest(manifest_file)
+    slugs = _month_slugs(start, end)
+    recent = _recent_slug()
+    stale = [slug for slug in slugs if not manifest.has_month(slug) or slug >= recent]
+    if stale:
+        for slug, urls in get_month_events(stale, pages).items():
+            if urls is not None:
+                manifest.mark_month(slug, urls)
+    # The site sends no validators, so every recheck is a full download of the page
+    stale_months = set(stale)
+    urls = list(dict.fromkeys(url for slug in slugs for url in manifest.month_urls(slug)
+                              if full or slug in stale_months or manifest.tournament(url) is None))
+    session = get_session(workers)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        fetched = list(pool.map(lambda u: fetch_if_changed(u, manifest.tournament(u), session), urls))
+    changed = {url: page for url, page in zip(urls, fetched) if page}
+    _log_progress('Incremental run: {} of {} tournaments new or changed'.format(len(changed), len(urls)))
+    if changed:
+        parsed = list(iter_parsed_tournaments(list(changed), workers, {u: p['text'] for u, p in changed.items()},
+                                              parsers))
+        # Names stored before a tournament was renamed, for outputs without a sources file
+        renamed = {manifest.tournament(url)['name'] for url, val in parsed if val and manifest.tournament(url)}
+        with mt.timed('store'):
+            upsert_data(parsed, renamed)
+        for url, val in parsed:
+            if val:
+                page = changed[url]
+                manifest.mark_tournament(url, val['Tournament'], page['digest'], page['etag'], page['last_modified'])
+    manifest.save()
+
+
+def retry_dead_letters(path=sch._DEAD_LETTER_FILE, workers=_HTTP_WORKERS, parsers=0):
+    # Refetches the tournament pages that failed every attempt in earlier runs and upserts
+    # them into the outputs. Dead calendar months stay in the file; scraping their range
+    # again (or --incremental) picks them up. Returns the number of tournaments retried.
+    letters = sch.load_dead_letters(path)
+    urls = list(dict.fromkeys(letter['url'] for letter in letters if '/events/view/' in letter['url']))
+    with open(path, 'w', encoding='utf-8') as fp:
+        fp.writelines(json.dumps(letter) + '\n' for letter in letters if '/events/view/' not in letter['url'])
+    if urls:
+        parsed = [(url, val) for url, val in iter_parsed_tournaments(urls, workers, parsers=parsers) if val]
+        with mt.timed('store'):
+            upsert_data(parsed)
+    return len(urls)
 
 
 if __name__ == '__main__':
-    scraper_start = input('Enter start month and year for scraper in the format YYYY-MM\n')
-    scraper_end = input('Enter end month and year for scraper in the format YYYY-MM\n')
-    positions = process_input(scraper_start, scraper_end)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action='store_true',
+                        help='only scrape months and tournaments that changed since the last run')
+    parser.add_argument('--manifest', default=mf._MANIFEST_FILE)
+    parser.add_argument('--full-refresh', action='store_true',
+                        help='with --incremental, recheck every tournament of the range, not only recent ones')
+    parser.add_argument('--columnar', action='store_true',
+                        help='also write scores_parquet/ (partitioned by season) and rosters.parquet')
+    parser.add_argument('--roster-index', metavar='DIR',
+                        help='also write a memory-mappable player/team roster index (see roster_index.py)')
+    parser.add_argument('--metrics', default=mt._REPORT_FILE, help='where to write the per-stage metrics report')
+    parser.add_argument('--profile', type=int, default=0, metavar='N',
+                        help='profile tournaments and keep cProfile/tracemalloc data for the N slowest '
+                             '(tournaments then run one at a time, ignoring --workers and --parsers)')
+    parser.add_argument('--base-url', help='scrape this copy of the USQ site instead (e.g. benchmarks/mock_usq.py)')
+    parser.add_argument('--workers', type=int, default=_HTTP_WORKERS, help='concurrent tournament fetches')
+    parser.add_argument('--pages', type=int, default=_BROWSER_PAGES, help='browser pages rendering calendar months')
+    parser.add_argument('--full-render', action='store_true',
+                        help='load calendar pages with every resource and read back the whole page')
+    parser.add_argument('--parsers', type=int, default=0,
+                        help='parse tournament pages in this many processes (0 parses in the fetch threads)')
+    parser.add_argument('--rate', type=float, default=sch._RATE, help='requests per second per host')
+    parser.add_argument('--max-concurrency', type=int, default=sch._MAX_CONCURRENCY,
+                        help='upper bound for the adaptive per-host concurrency')
+    parser.add_argument('--dead-letters', default=sch._DEAD_LETTER_FILE,
+                        help='where urls that failed every retry are kept')
+    parser.add_argument('--retry-dead-letters', action='store_true',
+                        help='only refetch the tournaments in --dead-letters and update the outputs')
+    args = parser.parse_args()
+    if args.base_url:
+        set_base_url(args.base_url)
+    _LEAN_RENDER = not args.full_render
+    mt.configure(args.profile)
+    if args.profile and (args.workers > 1 or args.parsers > 0):
+        # Only one tournament is profiled at a time and parser processes are not profiled at all
+        print('WARNING: --profile runs tournaments one at a time in this process; ignoring --workers {} and '
+              '--parsers {}'.format(args.workers, args.parsers))
+        args.workers, args.parsers = 1, 0
+    scheduler = sch.configure(rate=args.rate, burst=max(1, int(args.rate)), max_concurrency=args.max_concurrency)
+    positions = None
+    index = None
+    if args.retry_dead_letters:
+        _log_progress('Retried {} dead-lettered tournaments'.format(retry_dead_letters(args.dead_letters,
+                                                                                         args.workers, args.parsers)))
+    else:
+        scraper_start = input('Enter start month and year for scraper in the format YYYY-MM\n')
+        scraper_end = input('Enter end month and year for scraper in the format YYYY-MM\n')
+        positions = process_input(scraper_start, scraper_end)
     if positions:
         SCRAPE_FROM, SCRAPE_UNTIL = positions
-        clear_file(_LOG_ERROR_FILE)
-        clear_file(_LOG_PROGRESS_FILE)
-        urls = get_event_urls(SCRAPE_FROM, SCRAPE_UNTIL)
-        if urls:
-            data = parse_tournament_list(urls)
-            store_data(data)
+        if args.incremental:
+            scrape_incremental(SCRAPE_FROM, SCRAPE_UNTIL, args.manifest, args.workers, args.pages, args.parsers,
+                               args.full_refresh)
+        else:
+            clear_file(_LOG_ERROR_FILE)
+            clear_file(_LOG_PROGRESS_FILE)
+            urls = get_event_urls(SCRAPE_FROM, SCRAPE_UNTIL, args.pages)
+            if args.roster_index:
+                import usq_site_scraper.roster_index as rx
+                index = rx.RosterIndex()
+            if urls:
+                stream_tournaments(iter_parsed_tournaments(urls, args.workers, parsers=args.parsers), index=index)
+    if positions or args.retry_dead_letters:
+        if args.columnar and os.path.exists('scores.csv'):
+            import usq_site_scraper.columnar as columnar
+            with mt.timed('store'):
+                columnar.convert_outputs()
+        if args.roster_index and (index is not None or os.path.exists('rosters.json')):
+            import usq_site_scraper.roster_index as rx
+            # Incremental runs and retries only upsert the outputs, so their index is rebuilt from them
+            with mt.timed('store'):
+                (index if index is not None else rx.RosterIndex.from_outputs()).save(args.roster_index)
+        _log_progress('Fetch scheduler: {}'.format(json.dumps(scheduler.stats())))
+        dead = scheduler.save_dead_letters(args.dead_letters)
+        if dead:
+            print('{} urls failed every retry; they are listed in {} (rerun with --retry-dead-letters)'.format(
+                dead, args.dead_letters))
+        mt.get_metrics().write_report(args.metrics)
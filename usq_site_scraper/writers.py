@@ -0,0 +1,139 @@
+import csv
+import json
+import os
+import usq_site_scraper.records as rc
+
+# *****************************************************************************
+# Incremental writers for the scraper outputs, flushed after every tournament so
+# memory stays flat and an interrupted run still leaves usable files.
+# ----------------- ScoreWriter:   scores.csv in the same layout DataFrame.to_csv gives
+# ----------------- RosterWriter:  one JSON line per tournament, folded into the
+#                                  rosters.json layout when the writer is closed
+# ----------------- Sources:       sources.json, the tournament url of every scores row and
+#                                  roster entry, so upserts replace a page's rows by url
+#                                  even when several tournaments share a name
+# *****************************************************************************
+
+_SOURCES_FILE = 'sources.json'
+
+
+class ScoreWriter:
+    def __init__(self, path='scores.csv', columns=rc._COLUMNS):
+        self.path = path
+        self.rows = 0
+        self._fp = open(path, 'w', newline='')
+        self._writer = csv.writer(self._fp, lineterminator='\n')
+        self._writer.writerow(['', *columns])
+        self._fp.flush()
+
+    def write(self, scores):
+        for score in scores:
+            self._writer.writerow([self.rows, *['' if v is None else v for v in score]])
+            self.rows += 1
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class RosterWriter:
+    def __init__(self, path='rosters.json', lines_path=None):
+        self.path = path
+        self.lines_path = lines_path if lines_path else os.path.splitext(path)[0] + '.jsonl'
+        self._fp = open(self.lines_path, 'w')
+
+    def write(self, tournament, rosters):
+        self._fp.write(json.dumps({'Tournament': tournament, 'Rosters': rosters}) + '\n')
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+        consolidate_rosters(self.lines_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def iter_roster_lines(lines_path):
+    with open(lines_path) as fp:
+        for line in fp:
+            # A run killed mid-write can leave a truncated last line
+            try:
+                yield json.loads(line)
+            except ValueError:
+                return
+
+
+def consolidate_rosters(lines_path, path):
+    # Same merge parse_tournament_list does in memory, replayed from the JSON lines
+    rosters = {}
+    for record in iter_roster_lines(lines_path):
+        new_roster = record['Rosters']
+        for team in new_roster:
+            if team in rosters:
+                rosters[team].extend(new_roster[team])
+            else:
+                rosters[team] = new_roster[team]
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(rosters, fp)
+    os.replace(tmp, path)
+
+
+class Sources:
+    # urls holds each url once; scores and rosters ({team: [...]}) hold the position of the
+    # url of every scores.csv row and rosters.json entry, or None where it is not known
+    # (outputs written before urls were kept)
+    def __init__(self, urls=None, scores=None, rosters=None):
+        self.urls = urls if urls else []
+        self.scores = scores if scores else []
+        self.rosters = rosters if rosters else {}
+        self._codes = {url: code for code, url in enumerate(self.urls)}
+
+    @classmethod
+    def load(cls, path=_SOURCES_FILE):
+        if not os.path.exists(path):
+            return None
+        with open(path) as fp:
+            data = json.load(fp)
+        return cls(data['urls'], data['scores'], data['rosters'])
+
+    def matches(self, scores, rosters) -> bool:
+        # Whether this describes outputs with that many score rows and those roster entries
+        return len(self.scores) == scores and {team: len(codes) for team, codes in self.rosters.items()} == {
+            team: len(entries) for team, entries in rosters.items()}
+
+    def add(self, url, games, rosters):
+        # One tournament's rows, appended after everything already described
+        code = self._codes.get(url)
+        if code is None:
+            code = self._codes[url] = len(self.urls)
+            self.urls.append(url)
+        self.scores.extend([code] * games)
+        for team, entries in rosters.items():
+            self.rosters.setdefault(team, []).extend([code] * len(entries))
+
+    def url(self, code):
+        return None if code is None else self.urls[code]
+
+    def save(self, path=_SOURCES_FILE):
+        # Urls no row refers to any more are dropped
+        used = sorted({code for code in self.scores if code is not None} |
+                      {code for codes in self.rosters.values() for code in codes if code is not None})
+        remap = {code: i for i, code in enumerate(used)}
+        data = {'urls': [self.urls[code] for code in used],
+                'scores': [remap.get(code) for code in self.scores],
+                'rosters': {team: [remap.get(code) for code in codes] for team, codes in self.rosters.items()}}
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(data, fp)
+        os.replace(tmp, path)